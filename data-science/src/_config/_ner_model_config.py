@@ -45,6 +45,10 @@ STANFORD_CONFIGURATION = {
     'LABELS_TO_IGNORE': ["O"],
     'DEFAULT_EXPLANATION': "Identified as {} by transformers's Named Entity Recognition",
     'SUB_WORD_AGGREGATION': 'simple',
+    # Number of overlapping tokens between consecutive chunks of texts longer than the model max length
+    'CHUNK_STRIDE': 32,
+    # Inference backend: 'pytorch' (fp32), 'pytorch-int8' (dynamic int8 quantization, CPU) or 'onnx' (ONNX Runtime)
+    'INFERENCE_BACKEND': 'pytorch',
     'DATASET_TO_PRESIDIO_MAPPING': {"DATE": "DATE_TIME",
                                     "DOCTOR": "PERSON",
                                     "PATIENT": "PERSON",
@@ -96,6 +100,10 @@ BERT_DEID_CONFIGURATION = {'PRESIDIO_SUPPORTED_ENTITIES': [
     'LABELS_TO_IGNORE': ["O"],
     'DEFAULT_EXPLANATION': "Identified as {} by transformers's Named Entity Recognition",
     'SUB_WORD_AGGREGATION': 'simple',
+    # Number of overlapping tokens between consecutive chunks of texts longer than the model max length
+    'CHUNK_STRIDE': 32,
+    # Inference backend: 'pytorch' (fp32), 'pytorch-int8' (dynamic int8 quantization, CPU) or 'onnx' (ONNX Runtime)
+    'INFERENCE_BACKEND': 'pytorch',
 
     'DATASET_TO_PRESIDIO_MAPPING': {"DATE": "DATE_TIME",
                                     "DOCTOR": "PERSON",
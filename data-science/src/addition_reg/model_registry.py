@@ -0,0 +1,173 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+
+import os
+import shutil
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from presidio_analyzer.nlp_engine import NlpEngine, NlpEngineProvider
+
+logger = logging.getLogger("presidio-analyzer")
+
+# Inference backends of the transformers models, see INFERENCE_BACKEND in _ner_model_config
+INFERENCE_BACKENDS = ("pytorch", "pytorch-int8", "onnx")
+
+try:
+    from transformers import (
+        AutoTokenizer,
+        AutoModelForTokenClassification,
+        pipeline,
+        TokenClassificationPipeline,
+    )
+
+except ImportError:
+    logger.error("transformers is not installed")
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of the loaded models. Each transformers pipeline (per model path and pipeline settings)
+    and the default spaCy NLP engine are loaded once, then the same instance is handed out to every caller,
+    e.g. to every analyzer built by initialize_analyzer_engine in a notebook session.
+    With a model cache dir, models are also saved locally the first time they are loaded (as safetensors,
+    or as an ONNX export for the onnx backend), and later processes load them from there instead of
+    resolving and converting them again.
+    :example:
+    >model_registry.model_cache_dir = "model_cache"
+    >ner_pipeline = model_registry.get_ner_pipeline("obi/deid_roberta_i2b2", "simple", ["O"])
+    >model_registry.get_ner_pipeline("obi/deid_roberta_i2b2", "simple", ["O"]) is ner_pipeline  # True
+    """
+
+    def __init__(self, model_cache_dir: Optional[str] = None):
+        """
+        :param model_cache_dir: Directory of the locally saved models, None to always load from model_path
+        """
+        self.model_cache_dir = model_cache_dir
+        self._ner_pipelines: Dict[Tuple, TokenClassificationPipeline] = {}
+        self._nlp_engine: Optional[NlpEngine] = None
+        self._lock = threading.Lock()
+
+    def get_ner_pipeline(
+        self,
+        model_path: str,
+        aggregation_strategy: str,
+        ignore_labels: List[str],
+        backend: str = "pytorch",
+    ) -> TokenClassificationPipeline:
+        """Return the NER pipeline of model_path, loading it on the first call
+        :param backend: one of INFERENCE_BACKENDS. pytorch-int8 and onnx run on CPU
+        """
+        if backend not in INFERENCE_BACKENDS:
+            raise ValueError(
+                f"Inference backend {backend} is not supported, use one of {INFERENCE_BACKENDS}"
+            )
+        device = 0 if backend == "pytorch" and torch.cuda.is_available() else -1
+        key = (model_path, aggregation_strategy, tuple(ignore_labels), backend, device)
+        with self._lock:
+            if key not in self._ner_pipelines:
+                model, tokenizer = self._load_model(model_path, backend)
+                self._ner_pipelines[key] = pipeline(
+                    "ner",
+                    model=model,
+                    tokenizer=tokenizer,
+                    # Will attempt to group sub-entities to word level
+                    aggregation_strategy=aggregation_strategy,
+                    device=device,
+                    framework="pt",
+                    ignore_labels=ignore_labels,
+                )
+            return self._ner_pipelines[key]
+
+    def get_nlp_engine(self) -> NlpEngine:
+        """Return the default NLP engine of AnalyzerEngine (spaCy en_core_web_lg), loading it on the first call"""
+        with self._lock:
+            if self._nlp_engine is None:
+                self._nlp_engine = NlpEngineProvider().create_engine()
+                if not self._nlp_engine.is_loaded():
+                    self._nlp_engine.load()
+            return self._nlp_engine
+
+    def get_cached_model_dir(self, model_path: str, backend: str = "pytorch") -> Optional[Path]:
+        """Directory of the local copy of model_path in the model cache dir, None without a model cache dir.
+        The pytorch backends share the fp32 weights, the onnx backend has its own export"""
+        if self.model_cache_dir is None:
+            return None
+        model_hash = hashlib.sha256(model_path.encode("utf-8")).hexdigest()[:12]
+        suffix = "-onnx" if backend == "onnx" else ""
+        return Path(self.model_cache_dir, f"{Path(model_path).name}-{model_hash}{suffix}")
+
+    def _load_model(self, model_path: str, backend: str):
+        """Load the model and tokenizer of model_path for backend, from the model cache dir if they were saved there"""
+        model, tokenizer = self._load_saved_model(model_path, backend)
+        if backend == "pytorch-int8":
+            # int8 weights for the linear layers, activations are quantized on the fly
+            model = torch.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        return model, tokenizer
+
+    def _load_saved_model(self, model_path: str, backend: str):
+        model_kwargs = {}
+        if backend == "onnx":
+            try:
+                import onnxruntime
+                from optimum.onnxruntime import ORTModelForTokenClassification
+            except ImportError:
+                raise ImportError(
+                    "The onnx inference backend requires optimum[onnxruntime]"
+                )
+            model_class = ORTModelForTokenClassification
+            # same CPU parallelism as torch, see thread_settings.apply_thread_settings
+            session_options = onnxruntime.SessionOptions()
+            session_options.intra_op_num_threads = torch.get_num_threads()
+            session_options.inter_op_num_threads = torch.get_num_interop_threads()
+            model_kwargs["session_options"] = session_options
+        else:
+            model_class = AutoModelForTokenClassification
+
+        cached_model_dir = self.get_cached_model_dir(model_path, backend)
+        if cached_model_dir is not None and cached_model_dir.exists():
+            logger.info(f"Loading {model_path} from {cached_model_dir}")
+            return (
+                model_class.from_pretrained(cached_model_dir, **model_kwargs),
+                AutoTokenizer.from_pretrained(cached_model_dir),
+            )
+
+        logger.info(f"Loading {model_path}")
+        if backend == "onnx":
+            model = model_class.from_pretrained(model_path, export=True, **model_kwargs)
+        else:
+            model = model_class.from_pretrained(model_path)
+        tokenizer = AutoTokenizer.from_pretrained(model_path)
+        if cached_model_dir is not None:
+            # written to a temporary folder first, so a concurrent job never reads a partial copy
+            tmp_dir = cached_model_dir.with_name(f"{cached_model_dir.name}.tmp{os.getpid()}")
+            if backend == "onnx":
+                model.save_pretrained(tmp_dir)
+            else:
+                model.save_pretrained(tmp_dir, safe_serialization=True)
+            tokenizer.save_pretrained(tmp_dir)
+            try:
+                tmp_dir.rename(cached_model_dir)
+                logger.info(f"Saved {model_path} to {cached_model_dir}")
+            except OSError:
+                # another process saved it first
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        return model, tokenizer
+
+    def clear(self):
+        """Forget the loaded models, e.g. to free memory"""
+        with self._lock:
+            self._ner_pipelines.clear()
+            self._nlp_engine = None
+
+
+# Registry shared by the whole process
+model_registry = ModelRegistry()
@@ -0,0 +1,81 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional
+from spacy.tokens import Doc
+from presidio_analyzer.nlp_engine import NlpArtifacts, NlpEngine
+
+
+class SharedNlpEngine:
+    """
+    Wrapper for an NlpEngine shared by several AnalyzerEngine instances.
+    The NlpArtifacts of the last analyzed texts are kept, so when several analyzers process the same text
+    one after the other, the NLP pass (e.g. spaCy) runs only once.
+    A sample with a precomputed spaCy doc (see dataset_io.tokenization_sidecar) skips the NLP pass entirely,
+    its doc is only used while the sample is analyzed (see use_doc).
+    All other attributes are delegated to the wrapped engine.
+    :example:
+    >nlp_engine = SharedNlpEngine(AnalyzerEngine().nlp_engine)
+    >presidio = AnalyzerEngine(nlp_engine=nlp_engine)
+    >transformers = AnalyzerEngine(registry=registry, nlp_engine=nlp_engine)
+    >presidio.analyze(text, language="en")
+    >transformers.analyze(text, language="en")  # reuses the NlpArtifacts of text
+    """
+
+    def __init__(
+        self,
+        nlp_engine: NlpEngine,
+        cache_size: int = 8,
+    ):
+        """
+        :param nlp_engine: The NlpEngine to share, a SpacyNlpEngine if precomputed docs are used
+        :param cache_size: Number of texts for which NlpArtifacts are kept
+        """
+        self.nlp_engine = nlp_engine
+        self.cache_size = cache_size
+        self._nlp_artifacts = OrderedDict()
+        # precomputed doc of the sample being analyzed, see use_doc
+        self._doc = None
+        # Total time spent in the wrapped engine, in seconds
+        self.processing_time = 0.0
+
+    def process_text(self, text: str, language: str) -> NlpArtifacts:
+        """Return the NlpArtifacts of text, running the wrapped engine only if they are not cached"""
+        key = (text, language)
+        if key in self._nlp_artifacts:
+            self._nlp_artifacts.move_to_end(key)
+            return self._nlp_artifacts[key]
+
+        start_time = time.perf_counter()
+        if self._doc is not None and self._doc.text == text:
+            # same conversion as SpacyNlpEngine.process_text, without running the pipeline
+            nlp_artifacts = self.nlp_engine._doc_to_nlp_artifact(self._doc, language)
+        else:
+            nlp_artifacts = self.nlp_engine.process_text(text, language)
+        self.processing_time += time.perf_counter() - start_time
+
+        self._nlp_artifacts[key] = nlp_artifacts
+        if len(self._nlp_artifacts) > self.cache_size:
+            self._nlp_artifacts.popitem(last=False)
+        return nlp_artifacts
+
+    @contextmanager
+    def use_doc(self, doc: Optional[Doc]):
+        """
+        Build the NlpArtifacts of doc's text from doc instead of running the wrapped engine, until the context exits
+        :param doc: doc of the wrapped engine's spaCy pipeline, e.g. the nlp_doc of a sample read with an NLP sidecar
+        (see dataset_io.dataset_reader.read_dataset_stream). None to run the wrapped engine
+        """
+        self._doc = doc
+        try:
+            yield
+        finally:
+            self._doc = None
+
+    def __getattr__(self, name):
+        return getattr(self.nlp_engine, name)
@@ -0,0 +1,90 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+
+import os
+import time
+import logging
+from typing import Callable, Dict, List, Optional, Sequence
+
+import torch
+
+logger = logging.getLogger("presidio-analyzer")
+
+
+def get_default_threads(workers: int = 1) -> int:
+    """Intra-op threads of each process, so that workers processes share the cores without oversubscribing them"""
+    return max(1, (os.cpu_count() or 1) // max(workers, 1))
+
+
+def apply_thread_settings(
+    intra_op_threads: Optional[int] = None,
+    inter_op_threads: Optional[int] = None,
+    tokenizers_parallelism: Optional[bool] = None,
+):
+    """
+    Set the CPU parallelism of the current process, None keeps the current setting.
+    The settings also apply to the ONNX Runtime sessions created afterwards by the model registry.
+    :param intra_op_threads: number of threads of the torch operators
+    :param inter_op_threads: number of threads running independent torch operators,
+    can only be set before the first inter-op parallel work of the process
+    :param tokenizers_parallelism: whether the huggingface fast tokenizers use several threads
+    """
+    if tokenizers_parallelism is not None:
+        os.environ["TOKENIZERS_PARALLELISM"] = "true" if tokenizers_parallelism else "false"
+    if intra_op_threads is not None:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads is not None and inter_op_threads != torch.get_num_interop_threads():
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError:
+            logger.warning(
+                f"Inter-op threads can't be changed after parallel work started, "
+                f"keeping {torch.get_num_interop_threads()}"
+            )
+
+
+def get_thread_candidates(workers: int = 1) -> List[int]:
+    """Intra-op thread counts tried by auto_tune_threads: powers of two up to the share of the cores of a worker"""
+    max_threads = get_default_threads(workers)
+    candidates = [2**i for i in range(max_threads.bit_length()) if 2**i < max_threads]
+    return candidates + [max_threads]
+
+
+def auto_tune_threads(
+    analyze: Callable[[str], object],
+    texts: Sequence[str],
+    workers: int = 1,
+    candidates: Optional[List[int]] = None,
+) -> Dict[int, float]:
+    """
+    Time analyze on texts with each intra-op thread count, then keep the fastest one
+    :param analyze: function analyzing a text, e.g. a call to AnalyzerEngine.analyze
+    :param texts: sample of the evaluation texts
+    :param workers: number of processes sharing the cores, bounds the candidates
+    :param candidates: thread counts to try, get_thread_candidates(workers) by default
+    :return: seconds to analyze texts with each thread count, the fastest thread count is set.
+    Empty if there are no texts, the default thread count of get_default_threads is then set
+    """
+    if not texts:
+        default_threads = get_default_threads(workers)
+        torch.set_num_threads(default_threads)
+        logger.warning(f"No text to tune the intra-op threads on, using {default_threads} threads")
+        return {}
+    candidates = candidates or get_thread_candidates(workers)
+    timings = {}
+    for n_threads in candidates:
+        torch.set_num_threads(n_threads)
+        # warm up, the first calls with a new thread count are slower
+        analyze(texts[0])
+        start_time = time.perf_counter()
+        for text in texts:
+            analyze(text)
+        timings[n_threads] = time.perf_counter() - start_time
+        logger.info(f"{n_threads} intra-op threads: {timings[n_threads]:.2f}s for {len(texts)} texts")
+
+    best_threads = min(timings, key=timings.get)
+    torch.set_num_threads(best_threads)
+    logger.info(f"Using {best_threads} intra-op threads")
+    return timings
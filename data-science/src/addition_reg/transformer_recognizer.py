@@ -4,22 +4,23 @@
 
 
 import logging
-import copy
-from typing import Optional, List, Tuple, Set
-import torch
+import threading
+from collections import Counter
+from types import MappingProxyType
+from importlib import metadata
+from typing import Dict, Optional, List, Tuple, Set
 from presidio_analyzer import (
     RecognizerResult,
     EntityRecognizer,
     AnalysisExplanation,
 )
 from presidio_analyzer.nlp_engine import NlpArtifacts
+
+from addition_reg.model_registry import model_registry
 logger = logging.getLogger("presidio-analyzer")
 
 try:
     from transformers import (
-        AutoTokenizer,
-        AutoModelForTokenClassification,
-        pipeline,
         models,
         TokenClassificationPipeline
     )
@@ -28,6 +29,50 @@ except ImportError:
     logger.error("transformers is not installed")
 
 
+class LazyExplanationResult(RecognizerResult):
+    """`RecognizerResult` building its AnalysisExplanation on first access. AnalyzerEngine.analyze drops the
+    explanations unless return_decision_process=True, so they are usually never built.
+    Only the fields of the explanation are kept, the results are deep copied by the context enhancers.
+
+    :param recognizer_name: name of the recognizer in the explanation
+    :param explanation_template: textual explanation, formatted with the entity type
+    :param pattern: matched text, the pattern of the explanation
+    :param kwargs: RecognizerResult arguments, without analysis_explanation
+    """
+
+    def __init__(self, recognizer_name: str, explanation_template: str, pattern: str, **kwargs):
+        super().__init__(**kwargs)
+        self._explanation_fields = (recognizer_name, explanation_template, pattern, self.score)
+
+    @property
+    def analysis_explanation(self) -> Optional[AnalysisExplanation]:
+        if self._explanation_fields is not None:
+            recognizer_name, explanation_template, pattern, original_score = self._explanation_fields
+            self._explanation_fields = None
+            self._analysis_explanation = AnalysisExplanation(
+                recognizer=recognizer_name,
+                original_score=original_score,
+                textual_explanation=explanation_template.format(self.entity_type),
+                pattern=pattern,
+            )
+        return self._analysis_explanation
+
+    @analysis_explanation.setter
+    def analysis_explanation(self, analysis_explanation: Optional[AnalysisExplanation]):
+        # an explanation set (or removed) by the analyzer replaces the one to build
+        self._explanation_fields = None
+        self._analysis_explanation = analysis_explanation
+
+    def to_dict(self) -> Dict:
+        # same keys as RecognizerResult.to_dict, the explanation is built if needed
+        result = {
+            key: value for key, value in self.__dict__.items()
+            if key not in ("_explanation_fields", "_analysis_explanation")
+        }
+        result["analysis_explanation"] = self.analysis_explanation
+        return result
+
+
 class TransformersRecognizer(EntityRecognizer):
     """
     Wrapper for a transformers model, if needed to be used within Presidio Analyzer.
@@ -48,6 +93,10 @@ class TransformersRecognizer(EntityRecognizer):
     >    print(result.analysis_explanation)
     """
 
+    # Version of the prediction logic of this class (chunking, merging of the chunk predictions, label mapping),
+    # part of the prediction cache key. Bump it when a change of this class changes the predictions of a model
+    PREDICTION_VERSION = 1
+
     def __init__(
         self,
         supported_entities: Optional[List[str]
@@ -59,6 +108,10 @@ class TransformersRecognizer(EntityRecognizer):
         self.pipeline = pipeline
         self.model_path = model_path
         self.check_label_groups = check_label_groups
+        # Predictions computed ahead of time by `prefetch`, keyed by text
+        self._prefetched_results = dict()
+        # prefetch may run in a background thread, the tokenizer can't be used by two threads at once
+        self._inference_lock = threading.Lock()
 
         super().__init__(
             supported_entities=supported_entities, name="Transformers Analytics",)
@@ -74,6 +127,11 @@ class TransformersRecognizer(EntityRecognizer):
         self.aggregation_mechanism = kwargs.get(
             'SUB_WORD_AGGREGATION', 'simple')
         self.default_explanation = kwargs.get('DEFAULT_EXPLANATION', None)
+        # Number of overlapping tokens between consecutive chunks of a long text
+        self.chunk_stride = kwargs.get('CHUNK_STRIDE', 32)
+        # pytorch (fp32), pytorch-int8 or onnx, see model_registry.INFERENCE_BACKENDS
+        self.inference_backend = kwargs.get('INFERENCE_BACKEND', 'pytorch')
+        self._compile_label_mapping()
 
         if not self.pipeline:
             if not self.model_path:
@@ -84,25 +142,61 @@ class TransformersRecognizer(EntityRecognizer):
         self._load_pipeline()
 
     def _load_pipeline(self) -> None:
-        """Initialize NER transformers pipeline using the model_path provided"""
+        """Initialize NER transformers pipeline using the model_path provided.
+        The pipeline is loaded once per process and shared by all recognizers of the same model (see model_registry)
+        """
 
         logging.debug(
             f"Initializing NER pipeline using {self.model_path} path")
-        device = 0 if torch.cuda.is_available() else -1
-        self.pipeline = pipeline(
-            "ner",
-            model=AutoModelForTokenClassification.from_pretrained(
-                self.model_path),
-            tokenizer=AutoTokenizer.from_pretrained(self.model_path),
-            # Will attempt to group sub-entities to word level
-            aggregation_strategy=self.aggregation_mechanism,
-            device=device,
-            framework='pt',
-            ignore_labels=self.ignore_labels
+        self.pipeline = model_registry.get_ner_pipeline(
+            self.model_path, self.aggregation_mechanism, self.ignore_labels, self.inference_backend
         )
 
         self.is_loaded = True
 
+    def get_prediction_key(self) -> dict:
+        """What the predictions depend on besides the model configuration, see PredictionCache.get_model_key:
+        the prediction logic version, the revision of the model (and of the tokenizer, saved with it)
+        when it comes from the Hugging Face hub, and the transformers version"""
+        config = getattr(getattr(self.pipeline, "model", None), "config", None)
+        return {
+            "prediction_version": self.PREDICTION_VERSION,
+            "model_revision": getattr(config, "_commit_hash", None),
+            "transformers": metadata.version("transformers"),
+        }
+
+    def _compile_label_mapping(self) -> None:
+        """Compile the model label to Presidio entity lookup table used for every prediction.
+        Labels of entities which are not supported by this recognizer are mapped to 'O'
+        """
+        supported_entities = set(self.supported_entities)
+        label_mapping = {'O': 'O'}
+        for label, entity in self.model_to_presidio_mapping.items():
+            if entity in supported_entities:
+                label_mapping[label] = entity
+            else:
+                logger.warning(
+                    f"Label {label} is mapped to entity {entity} which is not supported by Presidio, "
+                    f"returning entity as 'O'")
+                label_mapping[label] = 'O'
+        self.label_mapping = MappingProxyType(label_mapping)
+        # predicted labels missing from the mapping, reported by report_unknown_labels
+        self.unknown_label_counts = Counter()
+
+    def report_unknown_labels(self) -> Counter:
+        """Log how many times each label missing from MODEL_TO_PRESIDIO_MAPPING was predicted
+        (and returned as 'O') since the last report, then reset the counts
+
+        Returns:
+            Counter: Number of predictions of each unknown label
+        """
+        unknown_label_counts = Counter(self.unknown_label_counts)
+        if unknown_label_counts:
+            logger.warning(
+                f"Found unrecognized labels, returned as 'O': {dict(unknown_label_counts.most_common())}")
+        self.unknown_label_counts.clear()
+        return unknown_label_counts
+
     def get_supported_entities(self) -> List[str]:
         """
         Return supported entities by this model.
@@ -123,22 +217,57 @@ class TransformersRecognizer(EntityRecognizer):
             transformers detections.
         """
 
-        results = list()
-        # Run transformer model on the provided text
-        ner_results = self._get_ner_results_for_text(text)
+        # Use the predictions computed by a previous prefetch call, if any
+        ner_results = self._prefetched_results.pop(text, None)
+        if ner_results is None:
+            # Run transformer model on the provided text
+            ner_results = self._get_ner_results_for_text(text)
+
+        return self._convert_ner_results(ner_results)
 
+    def analyze_batch(
+        self, texts: List[str], batch_size: int = 8
+    ) -> List[List[RecognizerResult]]:
+        """
+        Analyze multiple texts, running the transformers model on padded batches of text chunks.
+        :param texts(List[str]): The texts for analysis.
+        :param batch_size(int): Number of chunks passed to the model in a single forward pass.
+        :return: A list of Presidio RecognizerResult lists, one per input text (in the same order).
+        """
+        ner_results = self._get_ner_results_for_texts(texts, batch_size)
+        return [self._convert_ner_results(res) for res in ner_results]
+
+    def prefetch(self, texts: List[str], batch_size: int = 8) -> None:
+        """Run batched inference on texts which are about to be analyzed.
+        The predictions are kept in memory and consumed by the next `analyze` call for the same text,
+        which allows the AnalyzerEngine (which analyzes one text at a time) to benefit from batching.
+
+        Args:
+            texts (List[str]): Texts that would be analyzed next
+            batch_size (int): Number of chunks passed to the model in a single forward pass
+        """
+        ner_results = self._get_ner_results_for_texts(texts, batch_size)
+        self._prefetched_results.update(zip(texts, ner_results))
+
+    def clear_prefetched(self, texts: Optional[List[str]] = None) -> None:
+        """Drop predictions that were prefetched but not consumed by `analyze`
+
+        Args:
+            texts (Optional[List[str]]): Texts whose predictions are dropped, all of them if None
+        """
+        if texts is None:
+            self._prefetched_results.clear()
+            return
+        for text in texts:
+            self._prefetched_results.pop(text, None)
+
+    def _convert_ner_results(self, ner_results: List[dict]) -> List[RecognizerResult]:
+        """Convert the model predictions of a single text into Presidio RecognizerResult objects"""
+        results = list()
         for res in ner_results:
             res['entity_group'] = self.__check_label_transformer(
                 res["entity_group"])
-            textual_explanation = self.default_explanation.format(
-                res["entity_group"]
-            )
-            explanation = self.build_transformers_explanation(
-                round(res["score"], 2), textual_explanation, res["word"]
-            )
-            transformers_result = self._convert_to_recognizer_result(
-                res, explanation
-            )
+            transformers_result = self._convert_to_recognizer_result(res)
 
             results.append(transformers_result)
 
@@ -159,9 +288,122 @@ class TransformersRecognizer(EntityRecognizer):
         """
         return [[i, min([i+chunk_length, input_length])] for i in range(0, input_length, chunk_length-overlap_length)]
 
+    def _get_max_chunk_tokens(self) -> int:
+        """Number of text tokens that fit in a single forward pass of the model,
+        i.e. the model max length without the special tokens added by the tokenizer"""
+        tokenizer = self.pipeline.tokenizer
+        model_max_length = tokenizer.model_max_length
+        # some tokenizers do not set model_max_length and use a very large placeholder value
+        max_position_embeddings = getattr(
+            self.pipeline.model.config, 'max_position_embeddings', None)
+        if max_position_embeddings:
+            model_max_length = min(model_max_length, max_position_embeddings)
+        return model_max_length - tokenizer.num_special_tokens_to_add()
+
+    @staticmethod
+    def split_tokens_to_word_chunks(
+        word_ids: List[Optional[int]], chunk_length: int, stride: int
+    ) -> List[List]:
+        """The function calculates chunks of tokens with at most chunk_length tokens. Consecutive chunks
+        overlap by about stride tokens, and chunk boundaries are moved so no word is split between chunks
+
+        Args:
+            word_ids (List[Optional[int]]): Index of the word each token belongs to, as returned by the tokenizer
+            chunk_length (int): Maximum number of tokens in each chunk
+            stride (int): Number of overlapping tokens between consecutive chunks
+
+        Returns:
+            List[List]: List of start and end token position for each chunk
+        """
+        input_length = len(word_ids)
+        stride = max(0, min(stride, chunk_length // 2))
+
+        def word_start(position):
+            while 0 < position < input_length and word_ids[position] is not None \
+                    and word_ids[position] == word_ids[position - 1]:
+                position -= 1
+            return position
+
+        def chunk_end(start):
+            end = min(start + chunk_length, input_length)
+            # do not cut the last word of the chunk, unless it is longer than the chunk itself
+            if end < input_length and word_start(end) > start:
+                end = word_start(end)
+            return end
+
+        start, end = 0, chunk_end(0)
+        chunks = [[start, end]]
+        while end < input_length:
+            next_start = word_start(end - stride)
+            # drop the overlap if it would not let the next chunk cover new tokens
+            if next_start <= start or chunk_end(next_start) <= end:
+                next_start = end
+            start, end = next_start, chunk_end(next_start)
+            chunks.append([start, end])
+        return chunks
+
+    def _get_chunk_indexes(self, text: str) -> List[List]:
+        """The function calculates the chunks of text that are passed to the model.
+        The text is tokenized once, and if it is longer than the model max length it is split into windows
+        of model max length tokens, overlapping by `CHUNK_STRIDE` tokens and aligned on word boundaries.
+
+        Args:
+            text (str): The text to run inference on
+
+        Returns:
+            List[List]: List of start and end character position for each text chunk
+        """
+        max_chunk_tokens = self._get_max_chunk_tokens()
+        text_length = len(text)
+        if text_length == 0:
+            return []
+        # every token covers at least one byte of the text, so short texts fit in a single chunk
+        if len(text.encode('utf-8')) <= max_chunk_tokens:
+            return [[0, text_length]]
+
+        tokenizer = self.pipeline.tokenizer
+        if not tokenizer.is_fast:
+            # slow tokenizers do not return offsets, fall back to character based chunks
+            if text_length <= max_chunk_tokens*2:
+                return [[0, text_length]]
+            return TransformersRecognizer.split_text_to_word_chunks(
+                text_length, max_chunk_tokens*2, 40)
+
+        encoding = tokenizer(
+            text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+        offsets = encoding['offset_mapping']
+        if len(offsets) <= max_chunk_tokens:
+            return [[0, text_length]]
+
+        logger.info(
+            f'splitting the text into chunks, {len(offsets)} tokens > {max_chunk_tokens}')
+        token_chunks = TransformersRecognizer.split_tokens_to_word_chunks(
+            encoding.word_ids(), max_chunk_tokens, self.chunk_stride)
+        # convert to character positions. A chunk starts right after the previous token, so the
+        # whitespace before its first word is kept and the chunk is tokenized the same way as in the full text
+        return [[offsets[start - 1][1] if start > 0 else 0, offsets[end - 1][1]]
+                for start, end in token_chunks]
+
+    @staticmethod
+    def get_chunk_keep_ranges(chunk_indexes: List[List]) -> List[Tuple[int, float]]:
+        """Conflict rule for predictions made in the overlap of two consecutive chunks:
+        the overlap is split at its middle, the first half is owned by the earlier chunk and the second half
+        by the later chunk. A prediction is kept only if it starts in the range owned by its chunk,
+        where it has the most context on both sides.
+
+        Args:
+            chunk_indexes (List[List]): List of start and end character position for each chunk, ordered by start
+
+        Returns:
+            List[Tuple[int, float]]: Range of start positions owned by each chunk
+        """
+        bounds = [(next_chunk[0] + chunk[1]) // 2
+                  for chunk, next_chunk in zip(chunk_indexes, chunk_indexes[1:])]
+        return list(zip([0] + bounds, bounds + [float('inf')]))
+
     def _get_ner_results_for_text(self, text: str) -> List[dict]:
         """The function runs model inference on the provided text.
-        If length of text > max_length tokens, the text is split into chunks with n = 40 overlapping characters
+        If the text is longer than the model max length, it is split into overlapping chunks of tokens.
         The results are aggregated and duplicates are removed.
 
         Args:
@@ -170,46 +412,118 @@ class TransformersRecognizer(EntityRecognizer):
         Returns:
             List[dict]: List of NER predictions on the word level
         """
+        return self._get_ner_results_for_texts([text], batch_size=1)[0]
 
-        model_max_length = self.pipeline.tokenizer.model_max_length
-        # calculate inputs based on the text
-        text_length = len(text)
-        if text_length <= model_max_length*2:
-            return self.pipeline(text)
+    def _get_ner_results_for_texts(self, texts: List[str], batch_size: int) -> List[List[dict]]:
+        """The function runs model inference on multiple texts.
+        The chunks of all texts are sorted by length and passed to the pipeline in batches of batch_size,
+        so each padded batch holds chunks of similar length.
+        The predictions are then aligned back to the character offsets of the text each chunk came from.
 
-        # split text into chunks
-        logger.info(
-            f'splitting the text into chunks, length {text_length} > {model_max_length*2}')
-        predictions = list()
-        chunk_indexes = TransformersRecognizer.split_text_to_word_chunks(
-            text_length, model_max_length*2, 40)
-        for chunk in chunk_indexes:
-            chunk_text = text[chunk[0]:chunk[1]]
-            chunk_preds = self.pipeline(chunk_text)
-
-            # align indexes to match full text - add to each position the index of chunk's start
-            aligned_predictions = list()
-            for prediction in chunk_preds:
-                prediction_tmp = copy.deepcopy(prediction)
-                prediction_tmp['start'] += chunk[0]
-                prediction_tmp['end'] += chunk[0]
-                aligned_predictions.append(prediction_tmp)
-
-            predictions.extend(aligned_predictions)
-
-        # remove duplicates
-        predictions = [dict(t)
-                       for t in {tuple(d.items()) for d in predictions}]
+        Args:
+            texts (List[str]): The texts to run inference on
+            batch_size (int): Number of chunks passed to the model in a single forward pass
+
+        Returns:
+            List[List[dict]]: List of NER predictions on the word level, one list per input text
+        """
+        with self._inference_lock:
+            return self._predict_texts(texts, batch_size)
+
+    def _predict_texts(self, texts: List[str], batch_size: int) -> List[List[dict]]:
+        # collect the chunks of all texts, remembering which text and offset each chunk came from
+        chunk_owners = list()
+        chunk_texts = list()
+        chunks_per_text = [0] * len(texts)
+        for text_index, text in enumerate(texts):
+            chunk_indexes = self._get_chunk_indexes(text)
+            for chunk, keep_range in zip(
+                    chunk_indexes, TransformersRecognizer.get_chunk_keep_ranges(chunk_indexes)):
+                chunk_owners.append((text_index, chunk[0], keep_range))
+                chunk_texts.append(text[chunk[0]:chunk[1]])
+                chunks_per_text[text_index] += 1
+
+        # sort chunks by length to minimize padding within each batch
+        order = sorted(range(len(chunk_texts)),
+                       key=lambda i: len(chunk_texts[i]), reverse=True)
+        chunk_preds = [None] * len(chunk_texts)
+        if len(order) > 0:
+            sorted_preds = self.pipeline(
+                [chunk_texts[i] for i in order], batch_size=batch_size)
+            for i, preds in zip(order, sorted_preds):
+                chunk_preds[i] = preds
+
+        predictions = [list() for _ in texts]
+        for (text_index, chunk_start, keep_range), preds in zip(chunk_owners, chunk_preds):
+            if chunks_per_text[text_index] == 1:
+                predictions[text_index].extend(preds)
+                continue
+            # align indexes to match full text - add to each position the index of chunk's start.
+            # The prediction dicts are created by the pipeline for this call, so they are updated in place
+            for prediction in preds:
+                prediction['start'] += chunk_start
+                prediction['end'] += chunk_start
+                # in the overlap between chunks, keep only the predictions of the chunk owning that part
+                if keep_range[0] <= prediction['start'] < keep_range[1]:
+                    predictions[text_index].append(prediction)
+
+        # resolve spans overlapping across chunk boundaries
+        for text_index, n_chunks in enumerate(chunks_per_text):
+            if n_chunks > 1:
+                predictions[text_index] = TransformersRecognizer.merge_overlapping_predictions(
+                    predictions[text_index])
         return predictions
 
-    def _convert_to_recognizer_result(self, res, explanation) -> RecognizerResult:
+    @staticmethod
+    def merge_overlapping_predictions(predictions: List[dict]) -> List[dict]:
+        """The function removes overlapping predictions. Predictions are sorted by position, then split into groups
+        of transitively overlapping spans in one pass. Within a group, spans are kept by decreasing score
+        if they don't overlap an already kept span (on a tie, the first one by position i.e. the longest of two
+        spans with the same start), so a span is only dropped for a higher scored span it actually overlaps.
+        Exact duplicates are overlaps with the same score.
 
-        transformers_results = RecognizerResult(
+        Args:
+            predictions (List[dict]): NER predictions with start, end and score keys, aligned to the full text
+
+        Returns:
+            List[dict]: Non overlapping predictions, sorted by start position
+        """
+        # predictions of consecutive chunks are already almost sorted, which makes this sort close to linear
+        predictions.sort(key=lambda prediction: (prediction['start'], -prediction['end']))
+        groups = list()
+        group_end = None
+        for prediction in predictions:
+            if groups and prediction['start'] < group_end:
+                groups[-1].append(prediction)
+                group_end = max(group_end, prediction['end'])
+            else:
+                groups.append([prediction])
+                group_end = prediction['end']
+
+        merged = list()
+        for group in groups:
+            if len(group) == 1:
+                merged.extend(group)
+                continue
+            kept = list()
+            # stable sort, ties stay in position order
+            for prediction in sorted(group, key=lambda prediction: -prediction['score']):
+                if all(prediction['end'] <= other['start'] or other['end'] <= prediction['start'] for other in kept):
+                    kept.append(prediction)
+            merged.extend(sorted(kept, key=lambda prediction: prediction['start']))
+        return merged
+
+    def _convert_to_recognizer_result(self, res) -> RecognizerResult:
+        # explanations are dropped by AnalyzerEngine.analyze unless return_decision_process=True,
+        # they are only built if the result's analysis_explanation is read
+        transformers_results = LazyExplanationResult(
+            recognizer_name=self.__class__.__name__,
+            explanation_template=self.default_explanation,
+            pattern=res["word"],
             entity_type=res['entity_group'],
             start=res["start"],
             end=res["end"],
             score=round(res["score"], 2),
-            analysis_explanation=explanation,
         )
 
         return transformers_results
@@ -231,28 +545,20 @@ class TransformersRecognizer(EntityRecognizer):
         )
         return explanation
 
-    def __check_label_transformer(self, label: str) -> bool:
-        """The function validates the predicted label and converts the string into a Presidio representation
+    def __check_label_transformer(self, label: str) -> str:
+        """The function converts the predicted label into a Presidio representation, using the lookup table
+        compiled by `load_transformer`
 
         Args:
             label (str): Predicted label by the model
 
         Returns:
-            bool: If label is found in mapping dictionary and supported by Presidio entities
+            str: Presidio entity of the label, 'O' if it is not in the mapping or not supported by Presidio
         """
-        if label == 'O':
-            return label
-        # convert model label to presidio label
-        entity = self.model_to_presidio_mapping.get(label, None)
-
+        entity = self.label_mapping.get(label)
         if entity is None:
-            logger.warning(
-                f"Found unrecognized label {label}, returning entity as 'O'")
-            return "O"
-
-        if entity not in self.supported_entities:
-            logger.warning(
-                f"Found entity {entity} which is not supported by Presidio")
+            # reported once with the other unknown labels, see report_unknown_labels
+            self.unknown_label_counts[label] += 1
             return "O"
         return entity
 
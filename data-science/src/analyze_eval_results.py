@@ -8,17 +8,34 @@ Saves predictions, evaluation results and deploy flag.
 import os
 import argparse
 import logging
-import json
+import itertools
+from pathlib import Path
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import mlflow
 
+from scoring.bootstrap import load_sample_counts, paired_bootstrap_test
+from experiment_tracking.results_table import (
+    KEY_COLUMNS,
+    UNKNOWN_DATASET_VERSION,
+    ResultsTable,
+    find_result_files,
+)
+
 
 def parse_args():
     """Parse input arguments"""
 
     parser = argparse.ArgumentParser("evaluate")
+    parser.add_argument(
+        "--experiment-outputs",
+        type=str,
+        nargs="*",
+        default=[],
+        help="Evaluation outputs to compare: folders written by evaluate.py, experiment folders "
+        "or glob patterns of them, e.g. 'outputs/*'. Without any, every run of the results table is compared",
+    )
     parser.add_argument(
         "--presidio-output", type=str, help="Path of presidio evaluation output"
     )
@@ -31,19 +48,60 @@ def parse_args():
     parser.add_argument(
         "--final-output-path", default="str", help="Path of final evaluation output"
     )
+    parser.add_argument(
+        "--results-table",
+        type=str,
+        default=None,
+        help="Parquet file aggregating the results of every analyzed run, only the new runs are read. "
+        "Defaults to results_table.parquet in --final-output-path",
+    )
+    parser.add_argument(
+        "--bootstrap-resamples",
+        type=int,
+        default=1000,
+        help="Number of bootstrap resamples of the paired tests between models (0 disables them)",
+    )
+    parser.add_argument(
+        "--bootstrap-workers",
+        type=int,
+        default=1,
+        help="Number of processes computing the bootstrap resamples, 1 computes them in the main process",
+    )
+    parser.add_argument(
+        "--max-paired-tests",
+        type=int,
+        default=10,
+        help="Maximum number of paired tests between the models of a same dataset version, "
+        "no test is run above it",
+    )
 
     args = parser.parse_args()
 
     return args
 
 
-def load_result(json_path):
-    with open(json_path, "r") as f:
-        result = json.load(f)
-    return result
+def load_intervals(model_dir, model_name):
+    """Bootstrap confidence intervals saved by evaluate.py in model_dir, None if they were not computed"""
+    intervals_path = os.path.join(model_dir, "confidence_intervals.csv")
+    if not os.path.exists(intervals_path):
+        return None
+    intervals = pd.read_csv(intervals_path)
+    intervals["model_name"] = model_name
+    return intervals
+
 
+def get_error_bars(df_intervals, model_name, metric, labels, values):
+    """Distance from the scores to the bounds of their confidence intervals, 0 without an interval"""
+    intervals = df_intervals[
+        (df_intervals["model_name"] == model_name) & (df_intervals["metric"] == metric)
+    ].set_index("entity")
+    intervals = intervals.reindex(labels)
+    low = np.nan_to_num(values - intervals["low"].to_numpy(), nan=0).clip(0)
+    high = np.nan_to_num(intervals["high"].to_numpy() - values, nan=0).clip(0)
+    return np.vstack([low, high])
 
-def plot_results(df_result, metric):
+
+def plot_results(df_result, metric, df_intervals=None):
     ylabel = metric
     data = df_result.filter(regex=f"{ylabel}|model_name").set_index("model_name")
     if metric != "execution_time":
@@ -58,20 +116,27 @@ def plot_results(df_result, metric):
     # Define the color map
     cmap = plt.get_cmap("tab20")
 
-    # Define the width of each bar
-    bar_width = 0.2
+    # Define the width of each bar, narrower when many models are compared
+    bar_width = min(0.2, 0.8 / len(model_names))
 
     # Define the y positions of the bars
     y_pos = np.arange(len(labels))
 
     # Plot each group of bars
     for i, model_name in enumerate(model_names):
+        xerr = None
+        if df_intervals is not None and metric != "execution_time":
+            xerr = get_error_bars(
+                df_intervals, model_name, metric, labels, data.loc[model_name].to_numpy(dtype=float)
+            )
         ax.barh(
             y_pos + i * bar_width,
             data.loc[model_name],
             height=bar_width,
             label=model_name,
-            color=cmap(i),
+            color=cmap(i % cmap.N),
+            xerr=xerr,
+            error_kw={"elinewidth": 0.8, "capsize": 2},
         )
 
         # Add percentage labels above each bar
@@ -105,22 +170,106 @@ def plot_results(df_result, metric):
     return fig
 
 
-def main(args):
-    # Load presidio output
-    presidio_result = load_result(
-        os.path.join(args.presidio_output, "Presidio", "evaluation_result.json")
+def compare_models(model_dirs, dataset_versions, n_resamples, workers, max_tests):
+    """
+    Paired bootstrap tests of the score differences between each pair of models evaluated on the same dataset version
+    :param model_dirs: experiment folder of each model, by model name
+    :param dataset_versions: dataset version of each model, by model name
+    :param n_resamples: number of bootstrap resamples
+    :param workers: number of processes computing the resamples
+    :param max_tests: maximum number of paired tests, no test is run above it
+    :return: DataFrame of the tests, None if no pair of models can be compared
+    """
+    groups = {}
+    for model_name, model_dir in model_dirs.items():
+        dataset_version = dataset_versions[model_name]
+        if dataset_version == UNKNOWN_DATASET_VERSION:
+            # the samples of runs without a dataset version can't be paired
+            logging.warning(f"Unknown dataset version of {model_name}, skipping its paired tests")
+            continue
+        counts_path = os.path.join(model_dir, "sample_counts.npz")
+        if not os.path.exists(counts_path):
+            logging.warning(f"{counts_path} not found, skipping the paired tests of {model_name}")
+            continue
+        groups.setdefault(dataset_version, []).append((model_name, counts_path))
+
+    pairs = [
+        (dataset_version, pair)
+        for dataset_version, models in groups.items()
+        for pair in itertools.combinations(models, 2)
+    ]
+    if len(pairs) > max_tests:
+        logging.warning(
+            f"{len(pairs)} paired tests above --max-paired-tests {max_tests}, skipping them"
+        )
+        return None
+
+    df_tests = []
+    for dataset_version, ((model_a, counts_path_a), (model_b, counts_path_b)) in pairs:
+        entities_a, counts_a, beta = load_sample_counts(counts_path_a)
+        entities_b, counts_b, _ = load_sample_counts(counts_path_b)
+        if len(counts_a) != len(counts_b):
+            logging.warning(
+                f"{model_a} and {model_b} evaluated {len(counts_a)} and {len(counts_b)} samples "
+                f"of dataset version {dataset_version}, skipping their paired test"
+            )
+            continue
+        df_test = paired_bootstrap_test(
+            counts_a, entities_a, counts_b, entities_b, beta, n_resamples, workers=workers
+        )
+        df_test.insert(0, "model_b", model_b)
+        df_test.insert(0, "model_a", model_a)
+        df_test.insert(0, "dataset_version", dataset_version)
+        df_tests.append(df_test)
+    return pd.concat(df_tests, ignore_index=True) if df_tests else None
+
+
+def get_model_labels(df_result):
+    """Model name of each run, followed by the name of its evaluation output when several runs share it"""
+    output_names = pd.Series(
+        [Path(source).parent.parent.name for source in df_result["source"]], index=df_result.index
     )
-    # Load stanford output
-    stanford_result = load_result(
-        os.path.join(args.stanford_output, "StanfordAIMI", "evaluation_result.json")
+    labels = df_result["model_name"].where(
+        ~df_result["model_name"].duplicated(keep=False),
+        df_result["model_name"] + " (" + output_names + ")",
     )
-    # Load bert-deid output
-    bert_deid_result = load_result(
-        os.path.join(args.bert_deid_output, "BertDEID", "evaluation_result.json")
+    # runs of evaluation outputs with the same name
+    occurrence = labels.groupby(labels).cumcount()
+    return labels.where(occurrence == 0, labels + " #" + (occurrence + 1).astype(str))
+
+
+def main(args):
+    experiment_outputs = list(args.experiment_outputs)
+    # single model outputs of the evaluation pipeline
+    for output, model_name in (
+        (args.presidio_output, "Presidio"),
+        (args.stanford_output, "StanfordAIMI"),
+        (args.bert_deid_output, "BertDEID"),
+    ):
+        if output is not None:
+            experiment_outputs.append(os.path.join(output, model_name))
+    results_table = ResultsTable(
+        args.results_table or os.path.join(args.final_output_path, "results_table.parquet")
     )
-    df_result = pd.DataFrame([presidio_result, stanford_result, bert_deid_result])
-    fig_precision = plot_results(df_result, "precision")
-    fig_recall = plot_results(df_result, "recall")
+    if experiment_outputs:
+        df_result = results_table.ingest(find_result_files(experiment_outputs))
+        results_table.save()
+    else:
+        df_result = results_table.df
+    # the same run can be found in several copies of its folder
+    df_result = df_result.drop_duplicates(KEY_COLUMNS, keep="last")
+    if len(df_result) == 0:
+        raise ValueError("No evaluation result to analyze")
+    # experiment folder of each run, by model name
+    model_dirs = dict(
+        zip(get_model_labels(df_result), [str(Path(source).parent) for source in df_result["source"]])
+    )
+    df_result = df_result.assign(model_name=list(model_dirs))
+    intervals = [load_intervals(model_dir, model_name) for model_name, model_dir in model_dirs.items()]
+    # error bars only when every model has its confidence intervals
+    df_intervals = pd.concat(intervals) if all(i is not None for i in intervals) else None
+    fig_precision = plot_results(df_result, "precision", df_intervals)
+    fig_recall = plot_results(df_result, "recall", df_intervals)
     fig_execution_time = plot_results(df_result, "execution_time")
     if fig_precision is not None:
         fig_precision.savefig(
@@ -132,6 +281,16 @@ def main(args):
         fig_execution_time.savefig(
             os.path.join(args.final_output_path, "execution_time.png")
         )
+    if args.bootstrap_resamples > 0:
+        df_tests = compare_models(
+            model_dirs,
+            dict(zip(model_dirs, df_result["dataset_version"])),
+            args.bootstrap_resamples,
+            args.bootstrap_workers,
+            args.max_paired_tests,
+        )
+        if df_tests is not None:
+            df_tests.to_csv(os.path.join(args.final_output_path, "paired_tests.csv"), index=False)
 
     mlflow.log_artifacts(args.final_output_path)
 
@@ -143,10 +302,15 @@ if __name__ == "__main__":
     args = parse_args()
 
     lines = [
+        f"Experiment outputs: {args.experiment_outputs}",
         f"Presidio evaluation output: {args.presidio_output}",
         f"Stanfort evaluation output: {args.stanford_output}",
         f"bert_deid_output: {args.bert_deid_output}",
         f"Output path: {args.final_output_path}",
+        f"Results table: {args.results_table}",
+        f"Bootstrap resamples: {args.bootstrap_resamples}",
+        f"Bootstrap workers: {args.bootstrap_workers}",
+        f"Max paired tests: {args.max_paired_tests}",
     ]
 
     for line in lines:
@@ -18,6 +18,7 @@ from _config._data_augmented_config import (
     FAKER_TO_PRESIDIO_TRANSLATION,
 )
 from data_generator.data_generator import DataGenerator
+from dataset_io.sample_store import write_sample_store
 
 logging.basicConfig(level=logging.INFO)
 
@@ -33,6 +34,11 @@ def parse_args():
     parser.add_argument(
         "--output-path", type=str, help="Path to save output of the job"
     )
+    parser.add_argument(
+        "--write-sample-store",
+        action="store_true",
+        help="Also save the samples as a memory-mapped sample store, faster to load for the evaluation steps",
+    )
 
     args = parser.parse_args()
     return args
@@ -56,6 +62,9 @@ def main(args):
     output_path = os.path.join(args.output_path, "augmented_samples.json")
     with open("{}".format(output_path), "w+", encoding="utf-8") as f:
         json.dump(json_dataset, f, ensure_ascii=False, indent=4)
+    if args.write_sample_store:
+        # Same samples as a memory-mapped sample store, faster to load for the evaluation steps
+        write_sample_store(json_dataset, os.path.join(args.output_path, "augmented_samples.samples"))
     mlflow.log_metric("Orginal data size", len(orginal_data))
     mlflow.log_metric("Augemented data size", len(augmented_data))
 
@@ -73,6 +82,7 @@ if __name__ == "__main__":
         f"Raw data path: {args.raw_data}",
         f"Output path: {args.output_path}",
         f"Number of sample to generate: {args.number_samples}",
+        f"Write sample store: {args.write_sample_store}",
     ]
 
     for line in lines:
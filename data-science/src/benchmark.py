@@ -0,0 +1,236 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""
+Benchmarks the throughput of the model configurations on synthetic documents of controlled length.
+Saves docs/sec, chars/sec, latency percentiles, peak RSS and model load time of each configuration as json.
+"""
+
+import os
+import sys
+import argparse
+import logging
+import json
+import time
+import random
+import platform
+import resource
+import multiprocessing
+from datetime import datetime
+from typing import List
+
+import numpy as np
+import mlflow
+
+from evaluate import get_model_config, get_transformers_recognizer, initialize_analyzer_engine
+
+logging.basicConfig(level=logging.INFO)
+
+# Sentences of the synthetic clinical notes
+SENTENCE_TEMPLATES = [
+    "{name} was admitted to {hospital} on {date} with chest pain.",
+    "The patient lives in {city} and can be reached at {phone}.",
+    "Follow-up with Dr. {name} is scheduled for {date}.",
+    "Blood pressure was stable and no acute distress was observed.",
+    "{name}, a {age} year old, was transferred from {hospital} in {city}.",
+    "Discharge medications were reviewed with the patient and family.",
+    "Contact the clinic at {phone} or {email} with any questions.",
+    "Labs on {date} showed a mild elevation of liver enzymes.",
+]
+FIELD_VALUES = {
+    "name": ["John Smith", "Maria Garcia", "Wei Chen", "Fatima Al-Sayed", "Olga Ivanova"],
+    "hospital": ["Mercy General Hospital", "St. Mary's Medical Center", "Lakeside Clinic"],
+    "date": ["March 3, 2021", "2020-11-17", "12/05/2019", "July 21st"],
+    "city": ["Boston", "San Diego", "Springfield", "Tacoma"],
+    "phone": ["(617) 555-0134", "212-555-0188", "+1 415 555 0199"],
+    "age": ["54", "67", "72", "38"],
+    "email": ["jsmith@example.com", "clinic@example.org"],
+}
+# Number of documents analyzed before timing, so lazy initializations are not measured
+WARMUP_DOCS = 3
+
+
+def parse_args():
+    """Parse input arguments"""
+
+    parser = argparse.ArgumentParser("benchmark")
+    parser.add_argument(
+        "--experiment-name",
+        default="Presidio,StanfordAIMI,BertDEID",
+        help="Comma separated names of the model configurations to benchmark",
+    )
+    parser.add_argument(
+        "--doc-lengths",
+        default="200,1000,3000,10000",
+        help="Comma separated number of characters of the synthetic documents",
+    )
+    parser.add_argument(
+        "--docs-per-length", type=int, default=50, help="Number of documents of each length"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=8,
+        help="Number of text chunks per transformers forward pass (1 disables batching)",
+    )
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the synthetic documents")
+    parser.add_argument("--output-path", type=str, help="Path of the benchmark output folder")
+
+    args = parser.parse_args()
+
+    return args
+
+
+def generate_document(n_chars: int, rng: random.Random) -> str:
+    """
+    Generate a synthetic clinical note of n_chars characters (cut at a word boundary when possible)
+    :param n_chars: length of the document
+    :param rng: random generator
+    :return: the document
+    """
+    sentences = []
+    length = 0
+    while length < n_chars:
+        sentence = rng.choice(SENTENCE_TEMPLATES).format(
+            **{field: rng.choice(values) for field, values in FIELD_VALUES.items()}
+        )
+        sentences.append(sentence)
+        length += len(sentence) + 1
+    document = " ".join(sentences)[:n_chars]
+    if len(document) == n_chars and " " in document:
+        document = document[: document.rindex(" ")]
+    return document
+
+
+def generate_documents(doc_lengths: List[int], docs_per_length: int, seed: int) -> dict:
+    """Synthetic documents of each length, the same for every configuration given the seed"""
+    rng = random.Random(seed)
+    return {
+        doc_length: [generate_document(doc_length, rng) for _ in range(docs_per_length)]
+        for doc_length in doc_lengths
+    }
+
+
+def get_peak_rss_mb() -> float:
+    """Peak resident set size of the current process, in MB"""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, in kilobytes on Linux
+    return peak_rss / 2**20 if sys.platform == "darwin" else peak_rss / 2**10
+
+
+def benchmark_config(experiment_name: str, documents: dict, batch_size: int) -> dict:
+    """
+    Load a model configuration and time its analyzer on the documents of each length.
+    With batching, the documents are analyzed batch_size at a time and the latency of a document
+    is its share of the batch time.
+    :param experiment_name: one of Presidio, StanfordAIMI or BertDEID
+    :param documents: documents by length, from generate_documents
+    :param batch_size: number of text chunks per transformers forward pass
+    :return: benchmark results of the configuration
+    """
+    start_time = time.perf_counter()
+    wrapper = initialize_analyzer_engine(get_model_config(experiment_name))
+    model_load_time = time.perf_counter() - start_time
+    analyzer = wrapper.analyzer_engine
+    recognizer = get_transformers_recognizer(wrapper)
+    batch_size = batch_size if recognizer is not None else 1
+
+    def analyze_batch(texts):
+        if batch_size > 1:
+            recognizer.prefetch(texts, batch_size=batch_size)
+        for text in texts:
+            analyzer.analyze(text=text, language=wrapper.language)
+
+    warmup_docs = next(iter(documents.values()))[:WARMUP_DOCS]
+    analyze_batch(warmup_docs)
+
+    lengths = []
+    for doc_length, texts in documents.items():
+        latencies = []
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            batch_start_time = time.perf_counter()
+            analyze_batch(batch)
+            batch_time = time.perf_counter() - batch_start_time
+            latencies.extend([batch_time / len(batch)] * len(batch))
+        total_time = sum(latencies)
+        n_chars = sum(len(text) for text in texts)
+        latencies_ms = np.array(latencies) * 1e3
+        lengths.append(
+            {
+                "doc_length": doc_length,
+                "n_docs": len(texts),
+                "docs_per_sec": len(texts) / total_time,
+                "chars_per_sec": n_chars / total_time,
+                "latency_ms_p50": float(np.percentile(latencies_ms, 50)),
+                "latency_ms_p95": float(np.percentile(latencies_ms, 95)),
+                "latency_ms_p99": float(np.percentile(latencies_ms, 99)),
+            }
+        )
+        logging.info(
+            f"{experiment_name} - {doc_length} chars: {lengths[-1]['docs_per_sec']:.2f} docs/sec, "
+            f"p95 {lengths[-1]['latency_ms_p95']:.1f} ms"
+        )
+
+    return {
+        "experiment_name": experiment_name,
+        "model_load_time": model_load_time,
+        "peak_rss_mb": get_peak_rss_mb(),
+        "batch_size": batch_size,
+        "doc_lengths": lengths,
+    }
+
+
+def main(args):
+    """Benchmark each configuration in a fresh process, so load time and peak RSS are not shared"""
+    doc_lengths = [int(doc_length) for doc_length in args.doc_lengths.split(",")]
+    documents = generate_documents(doc_lengths, args.docs_per_length, args.seed)
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for experiment_name in args.experiment_name.split(","):
+        with context.Pool(processes=1) as pool:
+            result = pool.apply(benchmark_config, (experiment_name, documents, args.batch_size))
+        results.append(result)
+        # MLflow metric names can't contain @, e.g. of BertDEID@onnx
+        metric_prefix = experiment_name.replace("@", "_")
+        mlflow.log_metric(f"{metric_prefix}_model_load_time", result["model_load_time"])
+        mlflow.log_metric(f"{metric_prefix}_peak_rss_mb", result["peak_rss_mb"])
+        for length_result in result["doc_lengths"]:
+            prefix = f"{metric_prefix}_{length_result['doc_length']}_chars"
+            mlflow.log_metric(f"{prefix}_docs_per_sec", length_result["docs_per_sec"])
+            mlflow.log_metric(f"{prefix}_latency_ms_p95", length_result["latency_ms_p95"])
+
+    benchmark_output = {
+        "timestamp": datetime.now().isoformat(),
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "docs_per_length": args.docs_per_length,
+        "seed": args.seed,
+        "results": results,
+    }
+    os.makedirs(args.output_path, exist_ok=True)
+    output_file = os.path.join(args.output_path, "benchmark_result.json")
+    with open(output_file, "w+") as f:
+        json.dump(benchmark_output, f, indent=4)
+    mlflow.log_artifact(output_file)
+
+
+if __name__ == "__main__":
+
+    mlflow.start_run()
+
+    args = parse_args()
+
+    lines = [
+        f"Experiment names: {args.experiment_name}",
+        f"Document lengths: {args.doc_lengths}",
+        f"Documents per length: {args.docs_per_length}",
+        f"Batch size: {args.batch_size}",
+        f"Output path: {args.output_path}",
+    ]
+
+    for line in lines:
+        logging.info(line)
+    main(args)
+    mlflow.end_run()
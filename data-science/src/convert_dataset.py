@@ -0,0 +1,50 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""
+Convert a JSON dataset of InputSample to a memory-mapped sample store
+"""
+
+import argparse
+import logging
+import time
+
+from dataset_io.dataset_reader import iter_json_records
+from dataset_io.sample_store import write_sample_store
+
+logging.basicConfig(level=logging.INFO)
+
+
+def parse_args():
+    """Parse input arguments"""
+
+    parser = argparse.ArgumentParser("convert_dataset")
+    parser.add_argument("--input-path", type=str, help="Path to the json or jsonl dataset")
+    parser.add_argument("--output-path", type=str, help="Path of the sample store to write")
+
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    """Stream the records of the JSON dataset to a sample store"""
+    start_time = time.time()
+    n_records = write_sample_store(iter_json_records(args.input_path), args.output_path)
+    logging.info(f"Wrote {n_records} samples to {args.output_path} in {time.time() - start_time:.1f}s")
+
+
+if __name__ == "__main__":
+
+    # ---------- Parse Arguments ----------- #
+    # -------------------------------------- #
+
+    args = parse_args()
+
+    lines = [
+        f"Input path: {args.input_path}",
+        f"Output path: {args.output_path}",
+    ]
+
+    for line in lines:
+        logging.info(line)
+
+    main(args)
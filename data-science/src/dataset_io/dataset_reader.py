@@ -0,0 +1,237 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+
+import json
+import queue
+import logging
+import itertools
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Union
+
+from spacy.language import Language
+from presidio_evaluator import InputSample, Span
+from presidio_evaluator.span_to_tag import get_spacy
+
+from dataset_io.sample_store import SampleStore, is_sample_store
+from dataset_io.tokenization_sidecar import get_sidecar_path, iter_nlp_docs, read_docs, sidecar_exists
+
+# Number of characters read from the file at once
+READ_CHUNK_SIZE = 1 << 20
+JSON_WHITESPACE_AND_SEPARATORS = " \t\r\n,"
+# Seconds between two checks that the consumer of iter_in_background is still reading
+BACKGROUND_PUT_TIMEOUT = 0.1
+
+
+def iter_json_records(
+    filepath: Union[Path, str], chunk_size: int = READ_CHUNK_SIZE
+) -> Iterator[dict]:
+    """Yield the records of a JSON array file, or of a JSON Lines file, one at a time.
+    The file is read in chunks, so memory stays flat with the file size.
+
+    Args:
+        filepath (Union[Path, str]): Path to a json file containing an array of records, or a jsonl file
+        chunk_size (int): Number of characters read from the file at once
+
+    Returns:
+        Iterator[dict]: The records of the file, in order
+    """
+    decoder = json.JSONDecoder()
+    with open(filepath, "r", encoding="utf-8") as f:
+        buffer = f.read(chunk_size)
+        position = 0
+        in_array = False
+        while True:
+            # skip whitespace and separators, reading more of the file if needed
+            while position < len(buffer) and buffer[position] in JSON_WHITESPACE_AND_SEPARATORS:
+                position += 1
+            if position == len(buffer):
+                more = f.read(chunk_size)
+                if not more:
+                    return
+                buffer, position = more, 0
+                continue
+
+            if buffer[position] == "[" and not in_array:
+                in_array = True
+                position += 1
+                continue
+            if buffer[position] == "]" and in_array:
+                return
+
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # the record continues in the next chunk
+                more = f.read(chunk_size)
+                if not more:
+                    raise
+                buffer, position = buffer[position:] + more, 0
+                continue
+            yield record
+            position = end
+
+
+def iter_dataset_records(filepath: Union[Path, str], start: int = 0) -> Iterator[dict]:
+    """Yield the records of a json or jsonl file, or of a sample store, in `InputSample.to_dict` format,
+    from the record at index start"""
+    if is_sample_store(filepath):
+        with SampleStore(filepath) as store:
+            # records of a sample store are read by index
+            for index in range(start, len(store)):
+                yield store.get_record(index)
+    else:
+        yield from itertools.islice(iter_json_records(filepath), start, None)
+
+
+def read_dataset_stream(
+    filepath: Union[Path, str],
+    length: Optional[int] = None,
+    sidecar_prefix: Optional[Union[Path, str]] = None,
+    nlp: Optional[Language] = None,
+    start: int = 0,
+    **kwargs,
+) -> Iterator[InputSample]:
+    """Incremental version of `InputSample.read_dataset_json`, which also reads JSON Lines files
+    and sample stores (see `dataset_io.sample_store`).
+    Samples are parsed and tokenized one at a time, as they are consumed.
+
+    Args:
+        filepath (Union[Path, str]): Path to a json or jsonl file, or to a sample store
+        length (Optional[int]): Number of records to return (all records if None)
+        sidecar_prefix (Optional[Union[Path, str]]): Path prefix of the tokenization sidecars of the dataset
+        (see `tokenize_dataset.py`). Samples are built from the saved tokens and tags instead of running spaCy
+        nlp (Optional[Language]): spaCy pipeline of the analyzers' NLP engine. The docs of its NLP sidecar are
+        read along the samples and attached to them as `nlp_doc`, see `SharedNlpEngine`
+        start (int): Index of the first record to return, e.g. the first sample of a shard
+        kwargs: Additional arguments of InputSample.from_json
+
+    Returns:
+        Iterator[InputSample]: The samples of the dataset, in order
+    """
+    records = iter_dataset_records(filepath, start)
+    if length:
+        records = itertools.islice(records, length)
+    samples = _read_samples(records, sidecar_prefix, start, **kwargs)
+
+    nlp_docs = None
+    if sidecar_prefix is not None and nlp is not None:
+        nlp_docs = iter_nlp_docs(sidecar_prefix, nlp, start)
+    if nlp_docs is None:
+        yield from samples
+        return
+
+    n_missing = 0
+    for sample, doc in itertools.zip_longest(samples, nlp_docs):
+        if sample is None:
+            break
+        # a sidecar of another version of the dataset is not used
+        if doc is not None and doc.text == sample.full_text:
+            sample.nlp_doc = doc
+        else:
+            n_missing += 1
+        yield sample
+    if n_missing:
+        logging.warning(f"{n_missing} samples did not match the NLP sidecar, the NLP pass will run on them")
+
+
+def _read_samples(
+    records: Iterable[dict], sidecar_prefix: Optional[Union[Path, str]], start: int = 0, **kwargs
+) -> Iterator[InputSample]:
+    """Samples of the records (from the record at index start), built from the tokenization sidecar
+    if there is one, see read_dataset_stream"""
+    docs = None
+    if sidecar_prefix is not None:
+        token_model_version = kwargs.get("token_model_version", "en_core_web_sm")
+        sidecar_path = get_sidecar_path(sidecar_prefix, token_model_version)
+        if sidecar_exists(sidecar_path):
+            docs = read_docs(sidecar_path, get_spacy(model_version=token_model_version).vocab, start)
+        else:
+            logging.warning(f"No tokenization sidecar {sidecar_path}, samples are tokenized with spaCy")
+    if docs is None:
+        for record in records:
+            yield InputSample.from_json(record, **kwargs)
+        return
+
+    scheme = kwargs.get("scheme", "IO")
+    n_tokenized = 0
+    for record, doc in itertools.zip_longest(records, docs):
+        if record is None:
+            break
+        # a sidecar of another version of the dataset, or another scheme, is not used
+        if doc is None or doc.text != record["full_text"] or doc.user_data.get("scheme") != scheme:
+            n_tokenized += 1
+            yield InputSample.from_json(record, **kwargs)
+            continue
+        yield InputSample(
+            full_text=record["full_text"],
+            spans=[Span.from_json(span) for span in record.get("spans") or []],
+            masked=record.get("masked"),
+            tokens=doc,
+            tags=list(doc.user_data["tags"]),
+            metadata=record.get("metadata"),
+            template_id=record.get("template_id"),
+        )
+    if n_tokenized:
+        logging.warning(f"{n_tokenized} samples did not match the tokenization sidecar and were tokenized with spaCy")
+
+
+def iter_blocks(samples: Iterable, block_size: int) -> Iterator[List]:
+    """Group an iterable in lists of block_size items (the last one may be shorter)"""
+    iterator = iter(samples)
+    while True:
+        block = list(itertools.islice(iterator, block_size))
+        if not block:
+            return
+        yield block
+
+
+def iter_in_background(items: Iterable, max_queued: int) -> Iterator:
+    """Consume an iterable in a background thread, at most max_queued items ahead of the caller.
+    Reading a dataset this way overlaps the reads and the tokenization of the next samples with the work done
+    on the current ones. Errors of the background thread are raised to the caller.
+
+    Args:
+        items (Iterable): Iterable to consume, e.g. iter_blocks of read_dataset_stream
+        max_queued (int): Size of the queue between the background thread and the caller
+
+    Returns:
+        Iterator: The items, in order
+    """
+    item_queue = queue.Queue(maxsize=max(max_queued, 1))
+    stopped = threading.Event()
+    end_of_items = object()
+
+    def put(entry) -> bool:
+        # give up if the caller stopped reading, instead of blocking on a full queue forever
+        while not stopped.is_set():
+            try:
+                item_queue.put(entry, timeout=BACKGROUND_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+            put((end_of_items, None))
+        except BaseException as error:
+            put((end_of_items, error))
+
+    thread = threading.Thread(target=produce, name="dataset-reader", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = item_queue.get()
+            if item is end_of_items:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
@@ -0,0 +1,181 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+
+import json
+import mmap
+import struct
+from pathlib import Path
+from typing import Iterable, Iterator, Union
+
+from presidio_evaluator import InputSample
+
+# Layout of a sample store file:
+#   header   | magic, number of records, position of the index
+#   records  | one binary record per sample, see `_encode_record`
+#   index    | position of each record, and the end of the last record
+#   entities | JSON list of the entity types, referenced by id in the records
+MAGIC = b"PIISMP02"
+HEADER = struct.Struct("<8sQQ")
+OFFSET = struct.Struct("<Q")
+# length of the utf-8 text, number of spans, length of the extra fields
+RECORD_HEADER = struct.Struct("<III")
+# start and end positions, entity type id, length of the utf-8 entity value
+SPAN = struct.Struct("<IIHI")
+# entity value length of a span whose value is the text between its start and end positions
+VALUE_FROM_TEXT = 0xFFFFFFFF
+# record fields which are not stored in binary, kept as compact JSON
+EXTRA_FIELDS = ("masked", "template_id", "metadata")
+
+
+def is_sample_store(filepath: Union[Path, str]) -> bool:
+    """Check whether filepath is a sample store written by `write_sample_store`"""
+    with open(filepath, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _encode_record(record: dict, entity_ids: dict) -> bytes:
+    """Encode a sample record (`InputSample.to_dict` format) as bytes, adding new entity types to entity_ids"""
+    text = record["full_text"]
+    text_bytes = text.encode("utf-8")
+    spans = record.get("spans") or []
+
+    span_bytes = []
+    values = []
+    for span in spans:
+        entity_id = entity_ids.setdefault(span["entity_type"], len(entity_ids))
+        start, end = span["start_position"], span["end_position"]
+        value = span["entity_value"]
+        # most entity values are the annotated part of the text and are not stored twice
+        if value == text[start:end]:
+            value_length = VALUE_FROM_TEXT
+        else:
+            value_bytes = value.encode("utf-8")
+            value_length = len(value_bytes)
+            values.append(value_bytes)
+        span_bytes.append(SPAN.pack(start, end, entity_id, value_length))
+
+    extra = {field: record[field] for field in EXTRA_FIELDS if record.get(field) is not None}
+    extra_bytes = json.dumps(extra, ensure_ascii=False, separators=(",", ":")).encode("utf-8") if extra else b""
+
+    return b"".join(
+        [RECORD_HEADER.pack(len(text_bytes), len(spans), len(extra_bytes)), text_bytes]
+        + span_bytes
+        + values
+        + [extra_bytes]
+    )
+
+
+def write_sample_store(records: Iterable[dict], filepath: Union[Path, str]) -> int:
+    """Write sample records to a binary sample store, which `SampleStore` memory-maps.
+    Records are written as they come, so records can be a stream.
+
+    Args:
+        records (Iterable[dict]): Samples in `InputSample.to_dict` format, e.g. from `iter_json_records`
+        filepath (Union[Path, str]): Path of the sample store to write
+
+    Returns:
+        int: Number of records written
+    """
+    entity_ids = dict()
+    offsets = []
+    with open(filepath, "wb") as f:
+        # the header is written again once the number of records and the index position are known
+        f.write(HEADER.pack(MAGIC, 0, 0))
+        position = HEADER.size
+        for record in records:
+            offsets.append(position)
+            record_bytes = _encode_record(record, entity_ids)
+            f.write(record_bytes)
+            position += len(record_bytes)
+        offsets.append(position)
+
+        f.write(b"".join(OFFSET.pack(offset) for offset in offsets))
+        f.write(json.dumps(list(entity_ids), ensure_ascii=False).encode("utf-8"))
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, len(offsets) - 1, position))
+    return len(offsets) - 1
+
+
+class SampleStore:
+    def __init__(self, filepath: Union[Path, str]):
+        """Memory-mapped, read-only access to a sample store written by `write_sample_store`.
+            Records are decoded on demand, so opening a store costs the same whatever its size,
+            and processes reading the same file share its pages.
+
+        Args:
+            filepath (Union[Path, str]): Path of the sample store
+        """
+        self.filepath = filepath
+        with open(filepath, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._length, self._index_position = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{filepath} is not a sample store")
+        entities_position = self._index_position + OFFSET.size * (self._length + 1)
+        self._entity_types = json.loads(self._mmap[entities_position:].decode("utf-8"))
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _get_offset(self, index: int) -> int:
+        return OFFSET.unpack_from(self._mmap, self._index_position + OFFSET.size * index)[0]
+
+    def get_record(self, index: int) -> dict:
+        """Decode the record at index, in `InputSample.to_dict` format"""
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(f"record {index} out of range for a store of {self._length} records")
+
+        position = self._get_offset(index)
+        text_length, n_spans, extra_length = RECORD_HEADER.unpack_from(self._mmap, position)
+        position += RECORD_HEADER.size
+        text = self._mmap[position:position + text_length].decode("utf-8")
+        position += text_length
+
+        span_fields = [SPAN.unpack_from(self._mmap, position + SPAN.size * i) for i in range(n_spans)]
+        position += SPAN.size * n_spans
+        spans = []
+        for start, end, entity_id, value_length in span_fields:
+            if value_length == VALUE_FROM_TEXT:
+                value = text[start:end]
+            else:
+                value = self._mmap[position:position + value_length].decode("utf-8")
+                position += value_length
+            spans.append(
+                {
+                    "entity_type": self._entity_types[entity_id],
+                    "entity_value": value,
+                    "start_position": start,
+                    "end_position": end,
+                }
+            )
+
+        extra = json.loads(self._mmap[position:position + extra_length]) if extra_length else {}
+        record = {"full_text": text, "spans": spans}
+        record.update({field: extra.get(field) for field in EXTRA_FIELDS})
+        return record
+
+    def iter_records(self) -> Iterator[dict]:
+        for index in range(self._length):
+            yield self.get_record(index)
+
+    def __getitem__(self, index: int) -> InputSample:
+        """Build the InputSample at index (tokenized on access)"""
+        return InputSample.from_json(self.get_record(index))
+
+    def __iter__(self) -> Iterator[InputSample]:
+        for record in self.iter_records():
+            yield InputSample.from_json(record)
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
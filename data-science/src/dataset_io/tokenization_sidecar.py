@@ -0,0 +1,183 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+
+import json
+import shutil
+import logging
+import itertools
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Union
+
+from spacy.language import Language
+from spacy.tokens import Doc, DocBin
+from spacy.vocab import Vocab
+from presidio_evaluator import span_to_tag
+from presidio_evaluator.span_to_tag import get_spacy
+
+# Sidecars of a dataset are folders named <sidecar prefix>.<spaCy model>.spacy
+SIDECAR_SUFFIX = ".spacy"
+# Docs per DocBin shard of a sidecar, only one shard is in memory at a time
+SHARD_SIZE = 1000
+# The shards of a sidecar are listed in its index, written once they are all complete
+INDEX_FILE_NAME = "_index.json"
+
+
+def get_model_name(nlp: Language) -> str:
+    """Name of a loaded spaCy model, e.g. en_core_web_lg"""
+    return f"{nlp.meta['lang']}_{nlp.meta['name']}"
+
+
+def get_sidecar_path(sidecar_prefix: Union[Path, str], model_name: str) -> Path:
+    """Path of the sidecar holding the docs of a dataset processed by the spaCy model model_name
+
+    Args:
+        sidecar_prefix (Union[Path, str]): Path prefix of the sidecars of the dataset, e.g. <output dir>/<dataset file name>
+        model_name (str): Name of the spaCy model
+    """
+    return Path(f"{sidecar_prefix}.{model_name}{SIDECAR_SUFFIX}")
+
+
+def sidecar_exists(filepath: Union[Path, str]) -> bool:
+    """Whether a complete sidecar was written at filepath"""
+    filepath = Path(filepath)
+    # sidecars written before they were sharded are a single DocBin file
+    return (filepath / INDEX_FILE_NAME).exists() or filepath.is_file()
+
+
+def write_docs(docs: Iterable[Doc], filepath: Union[Path, str], shard_size: int = SHARD_SIZE) -> int:
+    """Serialize spaCy docs (tokens, annotations and user data) to a sidecar folder of DocBin shards,
+    holding shard_size docs each, and to its index
+
+    Returns:
+        int: Number of docs written
+    """
+    filepath = Path(filepath)
+    if filepath.is_dir():
+        shutil.rmtree(filepath)
+    elif filepath.exists():
+        filepath.unlink()
+    filepath.mkdir(parents=True)
+
+    docs = iter(docs)
+    shards = []
+    while True:
+        doc_bin = DocBin(store_user_data=True)
+        for doc in itertools.islice(docs, shard_size):
+            doc_bin.add(doc)
+        if len(doc_bin) == 0:
+            break
+        shard_name = f"shard-{len(shards):05d}{SIDECAR_SUFFIX}"
+        doc_bin.to_disk(filepath / shard_name)
+        shards.append({"file": shard_name, "n_docs": len(doc_bin)})
+
+    n_docs = sum(shard["n_docs"] for shard in shards)
+    with open(filepath / INDEX_FILE_NAME, "w", encoding="utf-8") as f:
+        json.dump({"shard_size": shard_size, "n_docs": n_docs, "shards": shards}, f)
+    return n_docs
+
+
+def read_docs(filepath: Union[Path, str], vocab: Vocab, start: int = 0) -> Iterator[Doc]:
+    """Deserialize the docs of a sidecar, in the order they were written, loading one shard at a time
+
+    Args:
+        filepath (Union[Path, str]): Path of the sidecar
+        vocab (Vocab): Vocabulary of the spaCy model which produced the docs
+        start (int): Index of the first doc to return, the shards before it are not loaded
+    """
+    filepath = Path(filepath)
+    if filepath.is_file():
+        yield from itertools.islice(DocBin().from_disk(filepath).get_docs(vocab), start, None)
+        return
+    with open(filepath / INDEX_FILE_NAME, "r", encoding="utf-8") as f:
+        index = json.load(f)
+    for shard in index["shards"]:
+        if start >= shard["n_docs"]:
+            start -= shard["n_docs"]
+            continue
+        docs = DocBin().from_disk(filepath / shard["file"]).get_docs(vocab)
+        yield from itertools.islice(docs, start, None)
+        start = 0
+
+
+def write_sample_tokens_sidecar(
+    records: Iterable[dict],
+    sidecar_prefix: Union[Path, str],
+    scheme: str = "IO",
+    token_model_version: str = "en_core_web_sm",
+    batch_size: int = 64,
+) -> Path:
+    """Tokenize the samples of a dataset, as `InputSample.from_json` would, and save the tokens and tags.
+    `dataset_reader.read_dataset_stream` builds the samples from this sidecar instead of running spaCy.
+
+    Args:
+        records (Iterable[dict]): Samples in `InputSample.to_dict` format, in dataset order
+        sidecar_prefix (Union[Path, str]): Path prefix of the sidecars of the dataset
+        scheme (str): Labeling scheme of the tags (IO, BIO or BILUO)
+        token_model_version (str): spaCy model tokenizing the samples
+        batch_size (int): Number of texts per spaCy batch
+
+    Returns:
+        Path: Path of the sidecar
+    """
+    nlp = get_spacy(model_version=token_model_version)
+
+    def tagged_docs():
+        texts_and_records = ((record["full_text"], record) for record in records)
+        for doc, record in nlp.pipe(texts_and_records, as_tuples=True, batch_size=batch_size):
+            spans = record.get("spans") or []
+            doc.user_data["scheme"] = scheme
+            doc.user_data["tags"] = span_to_tag(
+                scheme=scheme,
+                text=record["full_text"],
+                tags=[span["entity_type"] for span in spans],
+                starts=[span["start_position"] for span in spans],
+                ends=[span["end_position"] for span in spans],
+                tokens=doc,
+            )
+            yield doc
+
+    filepath = get_sidecar_path(sidecar_prefix, token_model_version)
+    n_docs = write_docs(tagged_docs(), filepath)
+    logging.info(f"Saved the tokens of {n_docs} samples to {filepath}")
+    return filepath
+
+
+def write_nlp_docs_sidecar(
+    texts: Iterable[str], sidecar_prefix: Union[Path, str], nlp: Language, batch_size: int = 64
+) -> Path:
+    """Run the spaCy pipeline of the analyzer's NLP engine on the texts of a dataset and save the docs.
+    `dataset_reader.read_dataset_stream` attaches these docs to the samples, and `SharedNlpEngine` builds
+    the NlpArtifacts of a sample from its doc instead of running spaCy.
+
+    Args:
+        texts (Iterable[str]): Full texts of the samples
+        sidecar_prefix (Union[Path, str]): Path prefix of the sidecars of the dataset
+        nlp (Language): spaCy pipeline of the analyzer's NLP engine
+        batch_size (int): Number of texts per spaCy batch
+
+    Returns:
+        Path: Path of the sidecar
+    """
+    filepath = get_sidecar_path(sidecar_prefix, get_model_name(nlp))
+    n_docs = write_docs(nlp.pipe(texts, batch_size=batch_size), filepath)
+    logging.info(f"Saved the NLP pass of {n_docs} samples to {filepath}")
+    return filepath
+
+
+def iter_nlp_docs(
+    sidecar_prefix: Union[Path, str], nlp: Language, start: int = 0
+) -> Optional[Iterator[Doc]]:
+    """Read the docs written by `write_nlp_docs_sidecar` for the spaCy pipeline nlp, one at a time in dataset order,
+    from the doc of the sample at index start
+
+    Returns:
+        Optional[Iterator[Doc]]: Docs of the samples, None if the dataset has no sidecar for this pipeline
+    """
+    filepath = get_sidecar_path(sidecar_prefix, get_model_name(nlp))
+    if not sidecar_exists(filepath):
+        logging.warning(f"No NLP sidecar {filepath}, the NLP pass will run on every text")
+        return None
+    logging.info(f"Reading the NLP pass of the samples from {filepath}")
+    return read_docs(filepath, nlp.vocab, start)
@@ -6,30 +6,61 @@ Saves predictions, evaluation results and deploy flag.
 """
 
 import os
+import math
 import argparse
 import logging
 import json
 import time
+import copy
+import hashlib
+import itertools
+import multiprocessing
 from pathlib import Path
-from typing import List
-from collections import Counter
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from collections import Counter, deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 import matplotlib.pyplot as plt
-from copy import deepcopy
+import numpy as np
 import pandas as pd
+from tqdm import tqdm
 import mlflow
+from mlflow.tracking import MlflowClient
 
 from presidio_evaluator import InputSample
-from presidio_evaluator.evaluation import Evaluator
+from presidio_evaluator.evaluation import Evaluator, EvaluationResult
 from presidio_evaluator.models import PresidioAnalyzerWrapper
 from presidio_analyzer import AnalyzerEngine, RecognizerRegistry
 
 from _config import _ner_model_config_data_sample2 as _ner_model_config
 from addition_reg.transformer_recognizer import TransformersRecognizer
+from addition_reg.shared_nlp_engine import SharedNlpEngine
+from addition_reg.model_registry import model_registry, INFERENCE_BACKENDS
+from addition_reg.thread_settings import apply_thread_settings, auto_tune_threads, get_default_threads
 from experiment_tracking.experiment_tracker import LocalExperimentTracker
+from experiment_tracking.stage_timer import StageTimer, instrument_recognizers
+from experiment_tracking.artifact_writer import AsyncArtifactWriter
+from experiment_tracking.evaluation_checkpoint import EvaluationCheckpoint, to_record, from_record
+from experiment_tracking.error_store import ErrorStoreWriter
+from experiment_tracking.error_index import ErrorIndex
+from experiment_tracking.figure_renderer import FigureRenderer, FIGURE_FORMATS
+from prediction_cache.prediction_cache import CachedPresidioAnalyzerWrapper
+from dataset_io.dataset_reader import read_dataset_stream, iter_blocks, iter_in_background
+from scoring.score_table import ScoreTable, score_results, REPORTED_BETAS
+from scoring.bootstrap import PII_ROW, sample_count_vectors, save_sample_counts, bootstrap_intervals
 from plotter import Plotter
 
 logging.basicConfig(level=logging.INFO)
 
+# Number of batches prefetched at once by iter_prefetched_blocks
+PREFETCH_BATCHES_PER_BLOCK = 16
+# Number of shards per worker process in evaluate_all_sharded, so faster workers pick up more shards
+SHARDS_PER_WORKER = 4
+
+# Per-process state of the sharded evaluation workers, set by _init_evaluation_worker
+_worker_state = {}
+
 
 def parse_args():
     """Parse input arguments"""
@@ -44,7 +75,124 @@ def parse_args():
         "--beta-value", type=float, default=2, help="Beta parameter for F measure"
     )
     parser.add_argument(
-        "--experiment-name", default="presidio", help="Name of the experiment"
+        "--experiment-name",
+        default="presidio",
+        help="Name of the experiment, or comma separated names to evaluate several models in one process. "
+        "Transformers models take an optional inference backend suffix, e.g. BertDEID,BertDEID@onnx",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=8,
+        help="Number of text chunks per transformers forward pass (1 disables batching)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes evaluating shards of the dataset in parallel",
+    )
+    parser.add_argument(
+        "--prediction-cache-dir",
+        type=str,
+        default=None,
+        help="Directory of the persistent prediction cache (disabled by default)",
+    )
+    parser.add_argument(
+        "--tokenization-dir",
+        type=str,
+        default=None,
+        help="Directory of the tokenization sidecars written by tokenize_dataset.py (disabled by default)",
+    )
+    parser.add_argument(
+        "--model-cache-dir",
+        type=str,
+        default=None,
+        help="Directory where transformers models are saved as safetensors after their first load (disabled by default)",
+    )
+    parser.add_argument(
+        "--intra-op-threads",
+        type=str,
+        default=None,
+        help="Number of torch intra-op threads of each process, or auto to time a few values on a sample "
+        "of the dataset and keep the fastest. Defaults to the cores shared between the workers with --workers",
+    )
+    parser.add_argument(
+        "--inter-op-threads",
+        type=int,
+        default=None,
+        help="Number of torch inter-op threads of each process (torch default if not set)",
+    )
+    parser.add_argument(
+        "--tokenizers-parallelism",
+        type=str,
+        choices=["true", "false"],
+        default=None,
+        help="Whether huggingface tokenizers use several threads. Defaults to false with --workers",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=2,
+        help="Number of sample blocks read and predicted ahead by background threads, which also export "
+        "the images and artifacts of an experiment while the next one runs. 0 runs every stage sequentially",
+    )
+    parser.add_argument(
+        "--auto-tune-samples",
+        type=int,
+        default=20,
+        help="Number of samples timed by --intra-op-threads auto",
+    )
+    parser.add_argument(
+        "--checkpoint-dir",
+        type=str,
+        default=None,
+        help="Directory where the predictions and scores of each sample are saved as they are evaluated "
+        "(disabled by default). With --resume, defaults to the checkpoints folder of --evaluation-output",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Restore the samples saved in --checkpoint-dir by a previous run of the same experiments, "
+        "and only evaluate the remaining ones",
+    )
+    parser.add_argument(
+        "--save-error-vectors",
+        action="store_true",
+        help="Also save the spaCy vector of the token of each model error, as a float16 array",
+    )
+    parser.add_argument(
+        "--bootstrap-resamples",
+        type=int,
+        default=1000,
+        help="Number of bootstrap resamples of the confidence intervals of the scores (0 disables them)",
+    )
+    parser.add_argument(
+        "--bootstrap-workers",
+        type=int,
+        default=1,
+        help="Number of processes computing the bootstrap resamples, 1 computes them in the main process",
+    )
+    parser.add_argument(
+        "--figure-format",
+        type=str,
+        choices=FIGURE_FORMATS,
+        default="png",
+        help="Format of the exported figures, html is much faster to export than png (no kaleido)",
+    )
+    parser.add_argument(
+        "--figure-workers",
+        type=int,
+        default=1,
+        help="Number of spawned processes exporting the figures of an experiment, 1 exports them in the "
+        "artifact writer thread",
+    )
+    parser.add_argument(
+        "--figure-cache-dir",
+        type=str,
+        default=None,
+        help="Directory of the exported figures by hash of their data, reused when a figure did not change. "
+        "Defaults to the figure_cache folder of --evaluation-output",
     )
 
     args = parser.parse_args()
@@ -52,15 +200,27 @@ def parse_args():
     return args
 
 
-def initialize_analyzer_engine(model_config=None) -> PresidioAnalyzerWrapper():
+def initialize_analyzer_engine(
+    model_config=None, prediction_cache_dir=None, nlp_engine=None
+) -> PresidioAnalyzerWrapper():
     """
     Initialize analyzer engine based on model configuration
     :param model_config: model configuration dictionary from _ner_model_config
+    :param prediction_cache_dir: directory of the persistent prediction cache, None to disable caching
+    :param nlp_engine: NlpEngine shared with other analyzers, None to use the process-wide one of model_registry
     :return: PresidioAnalyzerWrapper() object
     """
     entity_mapping = _ner_model_config.PRESIDIO_CONFIGURATION.get(
         "DATASET_TO_PRESIDIO_MAPPING"
     )
+    if prediction_cache_dir is not None:
+        wrapper_class = partial(
+            CachedPresidioAnalyzerWrapper,
+            prediction_cache_dir=prediction_cache_dir,
+            model_config=model_config,
+        )
+    else:
+        wrapper_class = PresidioAnalyzerWrapper
     if model_config is not None:
         transformers_recognizer = TransformersRecognizer(
             model_path=model_config["DEFAULT_MODEL_PATH"],
@@ -71,92 +231,944 @@ def initialize_analyzer_engine(model_config=None) -> PresidioAnalyzerWrapper():
         # Add transformers model to the registry
         registry = RecognizerRegistry()
         registry.add_recognizer(transformers_recognizer)
-        analyzer = AnalyzerEngine(registry=registry)
-        wrapper = PresidioAnalyzerWrapper(
+        analyzer = AnalyzerEngine(
+            registry=registry,
+            nlp_engine=nlp_engine if nlp_engine is not None else model_registry.get_nlp_engine(),
+        )
+        wrapper = wrapper_class(
             analyzer_engine=analyzer,
             labeling_scheme="IO",
             entity_mapping=entity_mapping,
         )
-        return wrapper
     else:  # Default
-        return PresidioAnalyzerWrapper(entity_mapping=entity_mapping)
+        analyzer = AnalyzerEngine(nlp_engine=model_registry.get_nlp_engine())
+        wrapper = wrapper_class(
+            analyzer_engine=analyzer,
+            # same entities as a wrapper building its own AnalyzerEngine
+            entities_to_keep=analyzer.get_supported_entities(language="en"),
+            entity_mapping=entity_mapping,
+        )
+        if nlp_engine is not None:
+            wrapper.analyzer_engine.nlp_engine = nlp_engine
+    return wrapper
+
+
+def get_transformers_recognizer(
+    wrapper: PresidioAnalyzerWrapper,
+) -> Optional[TransformersRecognizer]:
+    """
+    Return the TransformersRecognizer registered in the wrapper's analyzer engine
+    :param wrapper: PresidioAnalyzerWrapper() object
+    :return: TransformersRecognizer, or None for the default Presidio analyzer
+    """
+    for recognizer in wrapper.analyzer_engine.registry.recognizers:
+        if isinstance(recognizer, TransformersRecognizer):
+            return recognizer
+    return None
+
+
+def instrument_analyzer(wrapper: PresidioAnalyzerWrapper, stage_timer: StageTimer):
+    """
+    Time the NLP pass and each recognizer of the wrapper's analyzer with stage_timer.
+    The NLP engine is wrapped in a SharedNlpEngine (if it is not one already), which measures its processing time
+    :param wrapper: PresidioAnalyzerWrapper() object
+    :param stage_timer: StageTimer of the experiment
+    """
+    if not isinstance(wrapper.analyzer_engine.nlp_engine, SharedNlpEngine):
+        wrapper.analyzer_engine.nlp_engine = SharedNlpEngine(wrapper.analyzer_engine.nlp_engine)
+    instrument_recognizers(wrapper.analyzer_engine, stage_timer)
+
+
+def evaluate_all_batched(
+    evaluator: Evaluator,
+    evaluation_data: Iterable[InputSample],
+    batch_size: int,
+    stage_timer: Optional[StageTimer] = None,
+    queue_size: int = 0,
+    checkpoint: Optional[EvaluationCheckpoint] = None,
+    on_evaluated: Optional[Callable[[int, InputSample, List[str], EvaluationResult], None]] = None,
+) -> List[EvaluationResult]:
+    """
+    Same as Evaluator.evaluate_all, but the transformers model predicts batch_size chunks per forward pass,
+    and the evaluation data is left unchanged: each sample is aligned to the model entities on a copy
+    of its annotations (see copy_sample_annotations), so the dataset does not need to be copied.
+    Samples are processed in blocks: the predictions of a block are prefetched in batches,
+    then the block is evaluated sample by sample (see iter_prefetched_blocks).
+    :param evaluator: Evaluator wrapping a PresidioAnalyzerWrapper
+    :param evaluation_data: evaluation data in InputSample format, a list or a stream of samples
+    :param batch_size: number of text chunks per forward pass
+    :param stage_timer: StageTimer receiving the time of each stage, None to skip timing
+    :param queue_size: number of blocks read and predicted ahead in background threads, 0 to run sequentially
+    :param checkpoint: EvaluationCheckpoint of the experiment. The samples it has are restored instead of evaluated,
+    and the others are saved to it as they are evaluated. None to evaluate every sample
+    :param on_evaluated: called with the index, the sample, its prediction and its EvaluationResult
+    after each evaluated sample (the restored ones excluded)
+    :return: list of EvaluationResult, one per sample
+    """
+    stage_timer = stage_timer if stage_timer is not None else StageTimer()
+    if evaluator.model.entity_mapping:
+        logging.info(
+            f"Mapping entity values using this dictionary: {evaluator.model.entity_mapping}"
+        )
+    if checkpoint is not None:
+        on_evaluated = chain_callbacks(checkpoint.write, on_evaluated)
+    indexed_samples = IndexedSamples(evaluation_data, [checkpoint] if checkpoint else [])
+    evaluation_results = {}
+    with tqdm(
+        total=len(evaluation_data) if hasattr(evaluation_data, "__len__") else None,
+        desc=f"Evaluating {evaluator.model.__class__}",
+    ) as progress_bar:
+        for block, _ in iter_prefetched_blocks(
+            [evaluator], [stage_timer], indexed_samples, batch_size, queue_size
+        ):
+            for sample in block:
+                sample_index = indexed_samples.next_index()
+                evaluation_results[sample_index] = evaluate_sample(
+                    evaluator,
+                    sample,
+                    stage_timer,
+                    partial(on_evaluated, sample_index, sample) if on_evaluated else None,
+                )
+            progress_bar.update(len(block))
+    if checkpoint is not None:
+        evaluation_results.update(indexed_samples.get_restored(0))
+    return [evaluation_results[sample_index] for sample_index in sorted(evaluation_results)]
+
+
+class IndexedSamples:
+    def __init__(
+        self, evaluation_data: Iterable[InputSample], checkpoints: List[EvaluationCheckpoint]
+    ):
+        """Iterable over the samples of evaluation_data which are missing from at least one of the checkpoints.
+        The results of the samples a checkpoint has are restored while iterating, and `next_index` returns
+        the index in evaluation_data of the next iterated sample, in iteration order.
+        Iteration may run ahead in a background thread (see iter_prefetched_blocks)
+        :param evaluation_data: evaluation data in InputSample format, a list or a stream of samples
+        :param checkpoints: EvaluationCheckpoint of each evaluated model
+        """
+        self.evaluation_data = evaluation_data
+        self.checkpoints = checkpoints
+        # restored EvaluationResult of each checkpoint, by sample index
+        self.restored = [dict() for _ in checkpoints]
+        # (sample index, id of the sample) of the iterated samples, in iteration order
+        self._indices = deque()
+        # checkpoints which restored an iterated sample, by id of the sample, until its index is returned
+        self._restored_samples = {}
+
+    def __iter__(self) -> Iterator[InputSample]:
+        for sample_index, sample in enumerate(self.evaluation_data):
+            restored_by = set()
+            for checkpoint_index, (checkpoint, restored) in enumerate(zip(self.checkpoints, self.restored)):
+                if checkpoint.has(sample_index, sample):
+                    restored[sample_index] = checkpoint.restore(sample_index, sample)
+                    restored_by.add(checkpoint_index)
+            if self.checkpoints and len(restored_by) == len(self.checkpoints):
+                continue
+            if restored_by:
+                self._restored_samples[id(sample)] = restored_by
+            self._indices.append((sample_index, id(sample)))
+            yield sample
+
+    def next_index(self) -> int:
+        sample_index, sample_id = self._indices.popleft()
+        self._restored_samples.pop(sample_id, None)
+        return sample_index
+
+    def is_restored_sample(self, checkpoint_index: int, sample: InputSample) -> bool:
+        """Whether a checkpoint restored an iterated sample whose index was not returned by next_index yet,
+        e.g. to skip its prefetch"""
+        return checkpoint_index in self._restored_samples.get(id(sample), ())
+
+    def is_restored(self, checkpoint_index: int, sample_index: int) -> bool:
+        return sample_index in self.restored[checkpoint_index]
+
+    def get_restored(self, checkpoint_index: int) -> Dict[int, EvaluationResult]:
+        restored = self.restored[checkpoint_index]
+        if restored:
+            logging.info(f"{len(restored)} samples restored from {self.checkpoints[checkpoint_index].path}")
+        return restored
+
+
+def chain_callbacks(*callbacks: Optional[Callable]) -> Callable:
+    """Callback calling each of callbacks (None ones are skipped) with the same arguments"""
+    callbacks = [callback for callback in callbacks if callback is not None]
+
+    def call_all(*args):
+        for callback in callbacks:
+            callback(*args)
+
+    return call_all
+
+
+def get_texts_to_prefetch(
+    evaluator: Evaluator, samples: List[InputSample], batch_size: int
+) -> List[str]:
+    """
+    Texts of the samples whose transformers predictions can be prefetched in batches
+    :param evaluator: Evaluator wrapping a PresidioAnalyzerWrapper
+    :param samples: samples in InputSample format
+    :param batch_size: number of text chunks per forward pass
+    :return: texts to predict, none without TransformersRecognizer or batching
+    """
+    recognizer = get_transformers_recognizer(evaluator.model)
+    if recognizer is None or batch_size <= 1:
+        return []
+    # samples found in the prediction cache do not need to be predicted
+    if isinstance(evaluator.model, CachedPresidioAnalyzerWrapper):
+        return [
+            sample.full_text for sample in samples if not evaluator.model.is_cached(sample)
+        ]
+    return [sample.full_text for sample in samples]
+
+
+def prefetch_predictions(
+    evaluator: Evaluator,
+    texts: List[str],
+    batch_size: int,
+    stage_timer: Optional[StageTimer] = None,
+) -> float:
+    """
+    Run the batched transformers inference of texts about to be evaluated (see get_texts_to_prefetch)
+    :param evaluator: Evaluator wrapping a PresidioAnalyzerWrapper
+    :param texts: texts to predict
+    :param batch_size: number of text chunks per forward pass
+    :param stage_timer: StageTimer receiving the inference time, None to skip timing
+    :return: inference time in seconds
+    """
+    if not texts:
+        return 0.0
+    recognizer = get_transformers_recognizer(evaluator.model)
+    start_time = time.perf_counter()
+    recognizer.prefetch(texts, batch_size=batch_size)
+    seconds = time.perf_counter() - start_time
+    if stage_timer is not None:
+        stage_timer.add("recognizer_inference", seconds)
+        stage_timer.add_prefetched_latency(recognizer.name, texts, seconds)
+    return seconds
+
+
+def iter_prefetched_blocks(
+    evaluators: List[Evaluator],
+    stage_timers: List[StageTimer],
+    evaluation_data: Iterable[InputSample],
+    batch_size: int,
+    queue_size: int = 0,
+    prefetch_filters: Optional[List[Optional[Callable[[InputSample], bool]]]] = None,
+) -> Iterator[Tuple[List[InputSample], List[float]]]:
+    """
+    Split the evaluation data in blocks, and prefetch the transformers predictions of each evaluator
+    on a block before it is yielded. The predictions left unused by the caller, and their share of the inference time,
+    are dropped once it asks for the next block.
+    With queue_size > 0, the stages run concurrently: a background thread reads and tokenizes the samples
+    up to queue_size blocks ahead, and another one predicts the next block while the caller evaluates the current one.
+    The prediction cache is only read from the calling thread.
+    :param evaluators: Evaluator of each model
+    :param stage_timers: StageTimer of each evaluator, receiving the inference times
+    :param evaluation_data: evaluation data in InputSample format, a list or a stream of samples
+    :param batch_size: number of text chunks per forward pass
+    :param queue_size: number of blocks read and predicted ahead in background threads, 0 to run sequentially
+    :param prefetch_filters: function of each evaluator selecting the samples it evaluates, whose predictions
+    are prefetched (None to prefetch them all), None to prefetch every sample for every evaluator
+    :return: iterator of (block, inference time in seconds of each evaluator)
+    """
+    recognizers = [get_transformers_recognizer(evaluator.model) for evaluator in evaluators]
+    block_size = max(batch_size, 1) * PREFETCH_BATCHES_PER_BLOCK
+    blocks = iter_blocks(evaluation_data, block_size)
+    prefetch_filters = prefetch_filters or [None] * len(evaluators)
+
+    def get_block_texts(block: List[InputSample]) -> List[List[str]]:
+        return [
+            get_texts_to_prefetch(
+                evaluator,
+                block if keep is None else [sample for sample in block if keep(sample)],
+                batch_size,
+            )
+            for evaluator, keep in zip(evaluators, prefetch_filters)
+        ]
+
+    def prefetch_block(block_texts: List[List[str]]) -> Tuple[List[StageTimer], List[float]]:
+        # timed apart, then merged by the calling thread which owns the stage timers
+        block_timers = [StageTimer() for _ in evaluators]
+        seconds = [
+            prefetch_predictions(evaluator, texts, batch_size, block_timer)
+            for evaluator, texts, block_timer in zip(evaluators, block_texts, block_timers)
+        ]
+        return block_timers, seconds
+
+    def clear_unused(block_texts: List[List[str]]):
+        for recognizer, stage_timer, texts in zip(recognizers, stage_timers, block_texts):
+            if recognizer is not None:
+                recognizer.clear_prefetched(texts)
+                stage_timer.clear_prefetched_latencies(recognizer.name, texts)
+
+    if queue_size <= 0:
+        for block in blocks:
+            block_texts = get_block_texts(block)
+            yield block, [
+                prefetch_predictions(evaluator, texts, batch_size, stage_timer)
+                for evaluator, texts, stage_timer in zip(evaluators, block_texts, stage_timers)
+            ]
+            clear_unused(block_texts)
+        return
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference") as executor:
+        pending = deque()
+        # None marks the end of the data, then the last predicted block is yielded
+        for block in itertools.chain(iter_in_background(blocks, queue_size), [None]):
+            if block is not None:
+                block_texts = get_block_texts(block)
+                pending.append((block, block_texts, executor.submit(prefetch_block, block_texts)))
+            # the inference of the newest block keeps running while the previous one is evaluated
+            while len(pending) > (0 if block is None else 1):
+                ready_block, ready_texts, prefetched = pending.popleft()
+                block_timers, seconds = prefetched.result()
+                for stage_timer, block_timer in zip(stage_timers, block_timers):
+                    stage_timer.merge(block_timer)
+                yield ready_block, seconds
+                clear_unused(ready_texts)
+
+
+def evaluate_sample(
+    evaluator: Evaluator,
+    sample: InputSample,
+    stage_timer: StageTimer,
+    on_evaluated: Optional[Callable[[List[str], EvaluationResult], None]] = None,
+) -> EvaluationResult:
+    """
+    Evaluate a single sample, following the same steps as Evaluator.evaluate_all
+    :param evaluator: Evaluator wrapping a PresidioAnalyzerWrapper
+    :param sample: sample in InputSample format, left unchanged (its annotations are aligned on a copy)
+    :param stage_timer: StageTimer receiving the time of each stage
+    :param on_evaluated: called with the prediction and the EvaluationResult of the sample, e.g. to checkpoint them
+    :return: EvaluationResult of the sample
+    """
+    with stage_timer.stage("span_alignment"):
+        sample = copy_sample_annotations(sample)
+        # Align tag values to the ones expected by the model
+        evaluator.model.align_entity_types(sample)
+    # Predict, the NLP pass and the recognizers are timed separately (see instrument_analyzer)
+    nlp_engine = evaluator.model.analyzer_engine.nlp_engine
+    nlp_start_time = getattr(nlp_engine, "processing_time", 0.0)
+    inference_start_time = stage_timer.stage_times["recognizer_inference"]
+    start_time = time.perf_counter()
+    # the NLP pass of a sample read with an NLP sidecar is built from its doc (see read_dataset_stream)
+    nlp_doc = getattr(sample, "nlp_doc", None)
+    with nlp_engine.use_doc(nlp_doc) if isinstance(nlp_engine, SharedNlpEngine) else nullcontext():
+        prediction = evaluator.model.predict(sample)
+    predict_time = time.perf_counter() - start_time
+    nlp_time = getattr(nlp_engine, "processing_time", 0.0) - nlp_start_time
+    if nlp_time > 0:
+        stage_timer.record_latency("nlp_engine", nlp_time, len(sample.full_text))
+    stage_timer.add("nlp_pass", nlp_time)
+    stage_timer.add(
+        "prediction_other",
+        predict_time - nlp_time - (stage_timer.stage_times["recognizer_inference"] - inference_start_time),
+    )
+    with stage_timer.stage("span_alignment"):
+        # Remove entities not requested
+        prediction = evaluator.model.filter_tags_in_supported_entities(prediction)
+        # Switch to requested labeling scheme (IO/BIO/BILUO)
+        prediction = evaluator.model.to_scheme(prediction)
+    with stage_timer.stage("scoring"):
+        evaluation_result = evaluator.evaluate_sample(sample=sample, prediction=prediction)
+    if on_evaluated is not None:
+        on_evaluated(prediction, evaluation_result)
+    return evaluation_result
+
+
+def copy_sample_annotations(sample: InputSample) -> InputSample:
+    """
+    Copy a sample so its annotations can be aligned to a model's entities without changing the original.
+    Only the fields changed by align_entity_types (tags and spans) are copied,
+    the text and spaCy tokens are shared with the original sample.
+    :param sample: sample in InputSample format
+    :return: shallow copy of the sample with its own tags and spans
+    """
+    sample_copy = copy.copy(sample)
+    sample_copy.tags = list(sample.tags)
+    sample_copy.spans = [copy.copy(span) for span in sample.spans]
+    return sample_copy
+
+
+def evaluate_all_models(
+    evaluators: Dict[str, Evaluator],
+    evaluation_data: Iterable[InputSample],
+    batch_size: int,
+    nlp_engine: SharedNlpEngine,
+    stage_timers: Dict[str, StageTimer],
+    queue_size: int = 0,
+    checkpoints: Optional[Dict[str, EvaluationCheckpoint]] = None,
+    on_evaluated: Optional[Dict[str, Callable]] = None,
+) -> Tuple[Dict[str, List[EvaluationResult]], Dict[str, float]]:
+    """
+    Evaluate several models in a single pass over the evaluation data.
+    Each sample is evaluated by all models one after the other, so its NLP artifacts are computed once
+    by the shared NLP engine and reused by every analyzer.
+    :param evaluators: Evaluator of each experiment, by experiment name
+    :param evaluation_data: evaluation data in InputSample format, a list or a stream of samples
+    :param batch_size: number of text chunks per transformers forward pass
+    :param nlp_engine: NLP engine shared by the analyzers of all evaluators
+    :param stage_timers: StageTimer of each experiment, by experiment name
+    :param queue_size: number of blocks read and predicted ahead in background threads, 0 to run sequentially
+    :param checkpoints: EvaluationCheckpoint of each experiment, by experiment name (see evaluate_all_batched),
+    None to evaluate every sample
+    :param on_evaluated: on_evaluated callback of each experiment, by experiment name (see evaluate_all_batched)
+    :return: list of EvaluationResult of each experiment, and execution time of each experiment.
+    The execution time and the nlp_pass stage of an experiment include the full NLP pass, as if it was evaluated alone.
+    """
+    evaluation_results = {experiment_name: {} for experiment_name in evaluators}
+    execution_times = {experiment_name: 0.0 for experiment_name in evaluators}
+    experiment_names = list(evaluators)
+    checkpoints = checkpoints or {}
+    indexed_samples = IndexedSamples(
+        evaluation_data, [checkpoints[experiment_name] for experiment_name in checkpoints]
+    )
+    checkpoint_indices = {experiment_name: i for i, experiment_name in enumerate(checkpoints)}
+    on_evaluated = on_evaluated or {}
+    callbacks = {
+        experiment_name: chain_callbacks(
+            checkpoints[experiment_name].write if experiment_name in checkpoints else None,
+            on_evaluated.get(experiment_name),
+        )
+        for experiment_name in experiment_names
+    }
+    # the samples restored for a model are not predicted by it
+    prefetch_filters = [
+        partial(is_not_restored, indexed_samples, checkpoint_indices[experiment_name])
+        if experiment_name in checkpoint_indices
+        else None
+        for experiment_name in experiment_names
+    ]
+    for block, prefetch_times in iter_prefetched_blocks(
+        [evaluators[experiment_name] for experiment_name in experiment_names],
+        [stage_timers[experiment_name] for experiment_name in experiment_names],
+        indexed_samples,
+        batch_size,
+        queue_size,
+        prefetch_filters,
+    ):
+        for experiment_name, prefetch_time in zip(experiment_names, prefetch_times):
+            execution_times[experiment_name] += prefetch_time
+        for sample in block:
+            sample_index = indexed_samples.next_index()
+            for experiment_name, evaluator in evaluators.items():
+                checkpoint = checkpoints.get(experiment_name)
+                if checkpoint is not None and indexed_samples.is_restored(
+                    checkpoint_indices[experiment_name], sample_index
+                ):
+                    continue
+                start_time = time.time()
+                nlp_start_time = nlp_engine.processing_time
+                evaluation_results[experiment_name][sample_index] = evaluate_sample(
+                    evaluator,
+                    sample,
+                    stage_timers[experiment_name],
+                    partial(callbacks[experiment_name], sample_index, sample),
+                )
+                # the NLP pass is accounted for separately, since it is shared
+                execution_times[experiment_name] += (time.time() - start_time) - (
+                    nlp_engine.processing_time - nlp_start_time
+                )
+
+    for experiment_name, checkpoint_index in checkpoint_indices.items():
+        evaluation_results[experiment_name].update(indexed_samples.get_restored(checkpoint_index))
+    evaluation_results = {
+        experiment_name: [results[sample_index] for sample_index in sorted(results)]
+        for experiment_name, results in evaluation_results.items()
+    }
+
+    execution_times = {
+        experiment_name: execution_time + nlp_engine.processing_time
+        for experiment_name, execution_time in execution_times.items()
+    }
+    for stage_timer in stage_timers.values():
+        stage_timer.stage_times["nlp_pass"] = nlp_engine.processing_time
+    return evaluation_results, execution_times
+
+
+def is_not_restored(indexed_samples: IndexedSamples, checkpoint_index: int, sample: InputSample) -> bool:
+    return not indexed_samples.is_restored_sample(checkpoint_index, sample)
+
+
+def _init_evaluation_worker(
+    model_config: Optional[dict],
+    dataset_source: dict,
+    batch_size: int,
+    prediction_cache_dir: Optional[str],
+    thread_settings: Optional[dict],
+    model_cache_dir: Optional[str],
+):
+    """Build the analyzer of a worker process of evaluate_all_sharded"""
+    apply_thread_settings(**(thread_settings or {}))
+    # spawned workers don't inherit the model registry settings of the main process
+    model_registry.model_cache_dir = model_cache_dir
+    stage_timer = StageTimer()
+    with stage_timer.stage("model_load"):
+        wrapper = initialize_analyzer_engine(model_config, prediction_cache_dir)
+    instrument_analyzer(wrapper, stage_timer)
+    _worker_state["evaluator"] = Evaluator(model=wrapper)
+    _worker_state["stage_timer"] = stage_timer
+    _worker_state["dataset_source"] = dataset_source
+    # same NLP sidecar as the main process, see main
+    _worker_state["nlp"] = (
+        model_registry.get_nlp_engine().get_nlp("en")
+        if dataset_source.get("sidecar_prefix") is not None
+        else None
+    )
+    _worker_state["batch_size"] = batch_size
+
+
+def _read_shard(sample_indices: List[int]) -> List[InputSample]:
+    """
+    Read the samples of a shard in a worker process, from the dataset file and its sidecars.
+    Only the records from the first sample of the shard to its last one are tokenized
+    :param sample_indices: indices of the shard samples in the evaluation data, in increasing order
+    """
+    start = sample_indices[0]
+    samples = read_dataset_stream(
+        **_worker_state["dataset_source"],
+        nlp=_worker_state["nlp"],
+        start=start,
+        length=sample_indices[-1] + 1 - start,
+    )
+    # the samples restored from a checkpoint are not part of the shard
+    shard_indices = set(sample_indices)
+    return [sample for sample_index, sample in enumerate(samples, start) if sample_index in shard_indices]
+
+
+def _evaluate_shard(sample_indices: List[int]) -> Tuple[List[dict], StageTimer, Counter]:
+    """
+    Evaluate a shard of the evaluation data in a worker process.
+    spaCy tokens cannot be pickled, so the samples are returned as checkpoint records (see to_record)
+    :param sample_indices: indices of the shard samples in the evaluation data
+    :return: list of records, one per sample,
+    the stage times of the shard (the first shard of a worker also has its model load time)
+    and the number of predictions of each unknown model label
+    """
+    stage_timer = _worker_state["stage_timer"]
+    samples = _read_shard(sample_indices)
+    shard_records = []
+
+    def on_evaluated(shard_index, sample, prediction, evaluation_result):
+        shard_records.append(
+            to_record(sample_indices[shard_index], sample, prediction, evaluation_result)
+        )
+
+    evaluate_all_batched(
+        _worker_state["evaluator"],
+        samples,
+        _worker_state["batch_size"],
+        stage_timer,
+        on_evaluated=on_evaluated,
+    )
+    shard_timer = copy.deepcopy(stage_timer)
+    stage_timer.reset()
+    unknown_label_counts = Counter()
+    recognizer = get_transformers_recognizer(_worker_state["evaluator"].model)
+    if recognizer is not None:
+        unknown_label_counts.update(recognizer.unknown_label_counts)
+        recognizer.unknown_label_counts.clear()
+    return shard_records, shard_timer, unknown_label_counts
+
+
+def evaluate_all_sharded(
+    evaluation_data: List[InputSample],
+    dataset_source: dict,
+    model_config: Optional[dict],
+    workers: int,
+    batch_size: int,
+    prediction_cache_dir: Optional[str] = None,
+    stage_timer: Optional[StageTimer] = None,
+    thread_settings: Optional[dict] = None,
+    unknown_label_counts: Optional[Counter] = None,
+    checkpoint: Optional[EvaluationCheckpoint] = None,
+    on_evaluated: Optional[Callable[[int, InputSample, List[str], EvaluationResult], None]] = None,
+) -> List[EvaluationResult]:
+    """
+    Same as Evaluator.evaluate_all, but the samples are split in shards evaluated by a pool of processes.
+    Each worker builds its own analyzer with initialize_analyzer_engine.
+    :param evaluation_data: evaluation data in InputSample format, with the nlp_doc of read_dataset_stream
+    if the dataset has an NLP sidecar
+    :param dataset_source: keyword arguments of read_dataset_stream which read evaluation_data (filepath and
+    sidecar_prefix). Workers are spawned, and each of them reads the samples of its shards from the files
+    :param model_config: model configuration dictionary from _ner_model_config (None for Presidio)
+    :param workers: number of worker processes
+    :param batch_size: number of text chunks per transformers forward pass
+    :param prediction_cache_dir: directory of the persistent prediction cache, None to disable caching
+    :param stage_timer: StageTimer receiving the stage times of all workers (summed), None to skip timing
+    :param thread_settings: keyword arguments of apply_thread_settings, applied by each worker
+    :param unknown_label_counts: Counter receiving the unknown model labels predicted by all workers, None to ignore them
+    :param checkpoint: EvaluationCheckpoint restoring the samples evaluated before and saving the other ones,
+    None to evaluate every sample
+    :param on_evaluated: called with the index, the sample, its prediction and its EvaluationResult
+    after each evaluated sample (the restored ones excluded), as the shards complete
+    :return: list of EvaluationResult, one per sample (in the order of evaluation_data)
+    """
+    evaluation_results = {}
+    if checkpoint is not None:
+        for sample_index, sample in enumerate(evaluation_data):
+            if checkpoint.has(sample_index, sample):
+                evaluation_results[sample_index] = checkpoint.restore(sample_index, sample)
+        if evaluation_results:
+            logging.info(f"Restored {len(evaluation_results)} samples from {checkpoint.path}")
+    remaining_indices = [
+        sample_index
+        for sample_index in range(len(evaluation_data))
+        if sample_index not in evaluation_results
+    ]
+    n_samples = len(remaining_indices)
+    shard_size = max(1, math.ceil(n_samples / (workers * SHARDS_PER_WORKER)))
+    shards = [
+        remaining_indices[start : start + shard_size]
+        for start in range(0, n_samples, shard_size)
+    ]
+    if not shards:
+        return [evaluation_results[sample_index] for sample_index in sorted(evaluation_results)]
+    logging.info(f"Evaluating {len(shards)} shards with {workers} workers")
+
+    # forking a process running other threads (torch, dataset readers) can deadlock
+    with multiprocessing.get_context("spawn").Pool(
+        processes=workers,
+        initializer=_init_evaluation_worker,
+        initargs=(
+            model_config,
+            dataset_source,
+            batch_size,
+            prediction_cache_dir,
+            thread_settings,
+            model_registry.model_cache_dir,
+        ),
+    ) as pool:
+        for shard_records, shard_timer, shard_unknown_labels in pool.imap(
+            _evaluate_shard, shards
+        ):
+            if stage_timer is not None:
+                stage_timer.merge(shard_timer)
+            if unknown_label_counts is not None:
+                unknown_label_counts.update(shard_unknown_labels)
+            for record in shard_records:
+                sample_index = record["index"]
+                sample = evaluation_data[sample_index]
+                evaluation_results[sample_index] = from_record(record, sample)
+                if checkpoint is not None:
+                    checkpoint.write_record(record)
+                if on_evaluated is not None:
+                    on_evaluated(
+                        sample_index, sample, record["prediction"], evaluation_results[sample_index]
+                    )
+    return [evaluation_results[sample_index] for sample_index in sorted(evaluation_results)]
 
 
 def evaluate_experiment(
     experiment_name: str,
-    evaluation_data: List[InputSample],
+    evaluation_data: Iterable[InputSample],
     wrapper: PresidioAnalyzerWrapper,
     beta: float,
+    batch_size: int = 1,
+    model_config: Optional[dict] = None,
+    workers: int = 1,
+    prediction_cache_dir: Optional[str] = None,
+    stage_timer: Optional[StageTimer] = None,
+    thread_settings: Optional[dict] = None,
+    queue_size: int = 0,
+    artifact_writer: Optional[AsyncArtifactWriter] = None,
+    checkpoint: Optional[EvaluationCheckpoint] = None,
+    dataset_source: Optional[dict] = None,
 ):
     """
     Evaluate a Presidio analyzer based on the evaluation data
     :param experiment_name: The name of the experiment
-    :param evaluation_data: evaluation data in InputSample format
+    :param evaluation_data: evaluation data in InputSample format, left unchanged.
+    A stream of samples is consumed lazily, sharded evaluation (workers > 1) requires a list
     :param experiment_dir: path of experiment directory
+    :param batch_size: number of text chunks per transformers forward pass
+    :param model_config: model configuration used by the wrapper, needed to build the workers' analyzers
+    :param workers: number of processes evaluating shards of the dataset in parallel
+    :param prediction_cache_dir: directory of the persistent prediction cache, None to disable caching
+    :param stage_timer: StageTimer of the experiment, e.g. with the model load time, None to start a new one
+    :param thread_settings: keyword arguments of apply_thread_settings, applied by the worker processes
+    :param queue_size: number of blocks read and predicted ahead in background threads, 0 to run sequentially
+    :param artifact_writer: AsyncArtifactWriter exporting the images and artifacts in the background,
+    None to export them before returning
+    :param checkpoint: EvaluationCheckpoint restoring the samples evaluated by a previous run and saving
+    the other ones, None to evaluate every sample. The execution time only covers the evaluated samples
+    :param dataset_source: keyword arguments of read_dataset_stream which read evaluation_data, needed by
+    the workers of a sharded evaluation to read their shards
     :return: evaluation results
     """
+    if workers > 1 and dataset_source is None:
+        raise ValueError("Sharded evaluation requires the dataset_source of the evaluation data")
     start_time = time.time()
     logging.info(f"Start evaluating the model {experiment_name}")
-    # Initialize experiment tracker
-    # Set up experiment tracking
-    experiment_dir = Path(args.evaluation_output)
-    experiment = LocalExperimentTracker(experiment_dir, experiment_name)
+    stage_timer = stage_timer if stage_timer is not None else StageTimer()
     # Run evalutation
+    instrument_analyzer(wrapper, stage_timer)
     evaluator = Evaluator(model=wrapper)
     # dataset = Evaluator.align_entity_types(
     #     deepcopy(evaluation_data), entities_mapping=PresidioAnalyzerWrapper.presidio_entities_map
     # )
-    print(evaluation_data[132].tags)
-    print(evaluation_data[133].tags)
-    evaluation_results = evaluator.evaluate_all(evaluation_data)
-    results = evaluator.calculate_score(evaluation_results, beta=beta)
+    experiment = LocalExperimentTracker(Path(args.evaluation_output), experiment_name)
+    # model errors are written as the samples are evaluated
+    on_evaluated = stream_errors(open_error_sink(experiment, experiment_name))
+    try:
+        if workers > 1:
+            recognizer = get_transformers_recognizer(wrapper)
+            if isinstance(wrapper, CachedPresidioAnalyzerWrapper):
+                n_cached = sum(wrapper.is_cached(sample) for sample in evaluation_data)
+                logging.info(
+                    f"{n_cached}/{len(evaluation_data)} samples found in the prediction cache"
+                )
+            if artifact_writer is not None:
+                # the workers don't compete with the export of the previous experiment
+                artifact_writer.wait()
+            evaluation_results = evaluate_all_sharded(
+                evaluation_data,
+                dataset_source,
+                model_config,
+                workers,
+                batch_size,
+                prediction_cache_dir,
+                stage_timer,
+                thread_settings,
+                # reported by log_experiment with the labels of the main process
+                recognizer.unknown_label_counts if recognizer is not None else None,
+                checkpoint,
+                on_evaluated,
+            )
+        else:
+            evaluation_results = evaluate_all_batched(
+                evaluator,
+                evaluation_data,
+                batch_size,
+                stage_timer,
+                queue_size,
+                checkpoint,
+                on_evaluated,
+            )
+            if isinstance(wrapper, CachedPresidioAnalyzerWrapper):
+                logging.info(
+                    f"{wrapper.cache_hits}/{len(evaluation_results)} samples found in the prediction cache"
+                )
+    except BaseException:
+        # keep the errors written so far readable
+        experiment.close_error_sink()
+        raise
     end_time = time.time()
     execution_time = end_time - start_time
+    log_experiment(
+        experiment_name,
+        evaluator,
+        evaluation_results,
+        beta,
+        execution_time,
+        stage_timer,
+        artifact_writer,
+        experiment,
+    )
+
+
+def stream_errors(error_sink: ErrorStoreWriter) -> Callable:
+    """on_evaluated callback of evaluate_all_batched, appending the model errors of each sample to error_sink.
+    The errors are then dropped from the EvaluationResult, only its counts are kept in memory"""
+
+    def on_evaluated(sample_index, sample, prediction, evaluation_result):
+        error_sink.write_sample(sample_index, evaluation_result.model_errors)
+        evaluation_result.model_errors = None
+
+    return on_evaluated
+
+
+def open_error_sink(experiment: LocalExperimentTracker, experiment_name: str) -> ErrorStoreWriter:
+    """
+    Open the error store of an experiment, identified by its name, model configuration and dataset version.
+    With --resume, the errors saved by the interrupted run of the same experiment are kept
+    :param experiment: LocalExperimentTracker of the experiment
+    :param experiment_name: name of the experiment
+    """
+    header = {
+        "experiment_name": experiment_name,
+        "model_config": get_model_config(experiment_name),
+        "dataset_version": get_dataset_version(os.path.join(args.raw_data, args.raw_file_name)),
+    }
+    return experiment.open_error_sink(args.save_error_vectors, header, args.resume)
+
+
+def log_experiment(
+    experiment_name: str,
+    evaluator: Evaluator,
+    evaluation_results: List[EvaluationResult],
+    beta: float,
+    execution_time: float,
+    stage_timer: Optional[StageTimer] = None,
+    artifact_writer: Optional[AsyncArtifactWriter] = None,
+    experiment: Optional[LocalExperimentTracker] = None,
+):
+    """
+    Score the evaluation results of an experiment, then save and log the plots, errors and scores
+    :param experiment_name: The name of the experiment
+    :param evaluator: Evaluator used for the experiment
+    :param evaluation_results: list of EvaluationResult, one per sample
+    :param beta: beta parameter for F measure
+    :param execution_time: evaluation time of the experiment in seconds
+    :param stage_timer: StageTimer of the experiment, its stage times and recognizer latencies are saved
+    in evaluation_result.json and logged to MLflow
+    :param artifact_writer: AsyncArtifactWriter exporting the images and artifacts in the background,
+    None to export them before returning
+    :param experiment: LocalExperimentTracker of the experiment, e.g. with the errors streamed during the evaluation,
+    None to start a new one
+    """
+    stage_timer = stage_timer if stage_timer is not None else StageTimer()
+    recognizer = get_transformers_recognizer(evaluator.model)
+    if recognizer is not None:
+        recognizer.report_unknown_labels()
+    experiment_dir = Path(args.evaluation_output)
+    if experiment is None:
+        experiment = LocalExperimentTracker(experiment_dir, experiment_name)
+    wrapper = evaluator.model
+    with stage_timer.stage("scoring"):
+        # same scores as evaluator.calculate_score, with the reported betas in the same pass
+        scores = score_results(evaluation_results, betas=sorted({beta, *REPORTED_BETAS}))
+        results = scores.to_evaluation_result(beta)
+    with stage_timer.stage("artifact_logging"):
+        # the errors not streamed during the evaluation (e.g. restored from a checkpoint) complete the error store
+        error_sink = experiment.open_error_sink(args.save_error_vectors)
+        for sample_index, evaluation_result in enumerate(evaluation_results):
+            if evaluation_result.model_errors:
+                error_sink.write_sample(sample_index, evaluation_result.model_errors)
+                evaluation_result.model_errors = None
+        experiment.close_error_sink()
+    sample_counts, intervals = None, None
+    if args.bootstrap_resamples > 0:
+        with stage_timer.stage("bootstrap"):
+            sample_counts = sample_count_vectors(evaluation_results, scores.entities)
+            intervals = bootstrap_intervals(
+                sample_counts,
+                scores.entities,
+                beta,
+                args.bootstrap_resamples,
+                workers=args.bootstrap_workers,
+            )
     # Plot the results
-    plotter = Plotter(
-        model=wrapper,
-        results=results,
-        output_folder=experiment_dir,
-        model_name=experiment_name,
-        beta=2,
-    )
-    f2_score, precision, recall = plotter.plot_scores()
-    fns_plot, fps_plot = plotter.plot_most_common_tokens()
-    if f2_score is not None:
-        f2_score.write_image(
-            os.path.join(experiment_dir, f"{experiment_name}/f2_score.png")
-        )
-    if precision is not None:
-        precision.write_image(
-            os.path.join(experiment_dir, f"{experiment_name}/precision.png")
-        )
-    if recall is not None:
-        recall.write_image(
-            os.path.join(experiment_dir, f"{experiment_name}/recall.png")
-        )
-    if fns_plot is not None:
-        fns_plot.write_image(
-            os.path.join(experiment_dir, f"{experiment_name}/fns_plot.png")
+    with stage_timer.stage("plotting"):
+        plotter = Plotter(
+            model=wrapper,
+            results=results,
+            output_folder=experiment_dir,
+            model_name=experiment_name,
+            beta=2,
+            error_index=ErrorIndex.from_error_store(error_sink.path),
         )
-    if fps_plot is not None:
-        fps_plot.write_image(
-            os.path.join(experiment_dir, f"{experiment_name}/fps_plot.png")
+        f2_score, precision, recall = plotter.plot_scores()
+        fns_plot, fps_plot = plotter.plot_most_common_tokens()
+    mlflow.log_metric(f"f{beta}_score", results.to_log()["pii_f"])
+    if intervals is not None:
+        pii_f_interval = intervals[
+            (intervals["entity"] == PII_ROW) & (intervals["metric"] == f"f{beta:g}_score")
+        ].iloc[0]
+        mlflow.log_metric(f"f{beta}_score_low", pii_f_interval["low"])
+        mlflow.log_metric(f"f{beta}_score_high", pii_f_interval["high"])
+    figures = {
+        "f2_score": f2_score,
+        "precision": precision,
+        "recall": recall,
+        "fns_plot": fns_plot,
+        "fps_plot": fps_plot,
+    }
+    export = partial(
+        export_experiment_artifacts,
+        experiment,
+        experiment_name,
+        results,
+        beta,
+        scores,
+        sample_counts,
+        intervals,
+        figures,
+        execution_time,
+        stage_timer,
+        # the active run is not shared with the artifact writer thread
+        mlflow.active_run().info.run_id,
+    )
+    if artifact_writer is not None:
+        artifact_writer.submit(export)
+    else:
+        export()
+
+
+def export_experiment_artifacts(
+    experiment: LocalExperimentTracker,
+    experiment_name: str,
+    results: EvaluationResult,
+    beta: float,
+    scores: ScoreTable,
+    sample_counts: Optional[np.ndarray],
+    intervals: Optional[pd.DataFrame],
+    figures: Dict[str, object],
+    execution_time: float,
+    stage_timer: StageTimer,
+    run_id: str,
+):
+    """
+    Save the images, confusion matrix and evaluation_result.json of an experiment,
+    then log them to the MLflow run run_id
+    :param experiment: LocalExperimentTracker of the experiment
+    :param experiment_name: The name of the experiment
+    :param results: scored EvaluationResult of the experiment
+    :param beta: beta parameter for F measure
+    :param scores: ScoreTable of the experiment, saved as entity_scores.csv
+    :param sample_counts: per-sample count vectors of the entities (see sample_count_vectors), saved for
+    the paired tests of analyze_eval_results.py, None if the bootstrap is disabled
+    :param intervals: bootstrap confidence intervals of the scores, None if the bootstrap is disabled
+    :param figures: plotly figures by image name, None for the plots which could not be drawn
+    :param execution_time: evaluation time of the experiment in seconds
+    :param stage_timer: StageTimer of the experiment
+    :param run_id: id of the MLflow run of the experiment
+    """
+    experiment_dir = Path(experiment.dir)
+    with stage_timer.stage("image_export"):
+        figure_renderer = FigureRenderer(
+            args.figure_format,
+            workers=args.figure_workers,
+            cache_dir=args.figure_cache_dir or os.path.join(args.evaluation_output, "figure_cache"),
         )
+        figure_renderer.render(figures, os.path.join(experiment_dir, experiment_name))
 
-    entities, confmatrix = results.to_confusion_matrix()
+    with stage_timer.stage("artifact_logging"):
+        entities, confmatrix = scores.to_confusion_matrix()
 
-    experiment.log_confusion_matrix_table(matrix=confmatrix, labels=entities)
-    # log model errors for future analysis
-    errors = results.model_errors
-    experiment.log_errors(errors)
+        experiment.log_confusion_matrix_table(matrix=confmatrix, labels=entities)
+        # per-entity scores for several betas, and their micro and macro averages
+        scores.to_dataframe().to_csv(
+            os.path.join(experiment_dir, experiment_name, "entity_scores.csv"), index=False
+        )
+        if sample_counts is not None:
+            save_sample_counts(
+                os.path.join(experiment_dir, experiment_name, "sample_counts.npz"),
+                scores.entities,
+                sample_counts,
+                beta,
+            )
+            intervals.to_csv(
+                os.path.join(experiment_dir, experiment_name, "confidence_intervals.csv"),
+                index=False,
+            )
+        experiment.end()
     # Log single model evaluation output
     single_model_output = results.to_log()
     single_model_output["model_name"] = experiment_name
     single_model_output["execution_time"] = execution_time
+    # identify the run in the results table of analyze_eval_results.py
+    single_model_output["run_id"] = run_id
+    single_model_output["dataset_version"] = get_dataset_version(
+        os.path.join(args.raw_data, args.raw_file_name)
+    )
+    # the time to log the artifacts folder itself is only in the MLflow metrics
+    single_model_output.update(stage_timer.to_log())
     with open(f"{experiment_dir}/{experiment_name}/evaluation_result.json", "w+") as f:
         json.dump(single_model_output, f)
-    mlflow.log_artifacts(f"{experiment_dir}/{experiment_name}")
-    mlflow.log_metric(f"f{beta}_score", results.to_log()["pii_f"])
+    with stage_timer.stage("artifact_logging"):
+        MlflowClient().log_artifacts(run_id, f"{experiment_dir}/{experiment_name}")
+    stage_timer.log_to_mlflow(run_id)
 
 
 def plot_result(df_result):
@@ -208,25 +1220,378 @@ def data_analysis(input_data: List[InputSample], title) -> pd.DataFrame():
     return common_entities
 
 
-def main(args):
-    """Read evaluation dataset, evaluate PII solution and save result"""
-    # Load the test data
-    data_path = os.path.join(args.raw_data, args.raw_file_name)
-    data = InputSample.read_dataset_json(data_path)
+def evaluate_experiments(
+    experiment_names: List[str],
+    evaluation_data: Iterable[InputSample],
+    beta: float,
+    batch_size: int = 1,
+    prediction_cache_dir: Optional[str] = None,
+    queue_size: int = 0,
+    artifact_writer: Optional[AsyncArtifactWriter] = None,
+    checkpoint_dir: Optional[str] = None,
+    resume: bool = False,
+):
+    """
+    Evaluate several models in a single process, sharing the evaluation data and the NLP pass.
+    The outputs of each experiment are saved in its own folder of the evaluation output
+    and logged to a nested MLflow run.
+    :param experiment_names: names of the experiments
+    :param evaluation_data: evaluation data in InputSample format (a list or a stream of samples), left unchanged
+    :param beta: beta parameter for F measure
+    :param batch_size: number of text chunks per transformers forward pass
+    :param prediction_cache_dir: directory of the persistent prediction cache, None to disable caching
+    :param queue_size: number of blocks read and predicted ahead in background threads, 0 to run sequentially
+    :param artifact_writer: AsyncArtifactWriter exporting the images and artifacts in the background,
+    None to export them before returning
+    :param checkpoint_dir: directory of the checkpoint of each experiment (see open_checkpoint), None to disable them
+    :param resume: restore the samples saved in the checkpoints by a previous run
+    """
+    # The default Presidio analyzer loads its own NLP engine, build it first so the other analyzers reuse it
+    experiment_names = sorted(
+        experiment_names, key=lambda name: get_model_config(name) is not None
+    )
+    nlp_engine = None
+    evaluators = {}
+    stage_timers = {}
+    for experiment_name in experiment_names:
+        stage_timer = StageTimer()
+        with stage_timer.stage("model_load"):
+            wrapper = initialize_analyzer_engine(
+                get_model_config(experiment_name), prediction_cache_dir, nlp_engine
+            )
+        instrument_analyzer(wrapper, stage_timer)
+        if nlp_engine is None:
+            nlp_engine = wrapper.analyzer_engine.nlp_engine
+        evaluators[experiment_name] = Evaluator(model=wrapper)
+        stage_timers[experiment_name] = stage_timer
+
+    checkpoints = {}
+    if checkpoint_dir is not None:
+        checkpoints = {
+            experiment_name: open_checkpoint(checkpoint_dir, experiment_name, resume)
+            for experiment_name in experiment_names
+        }
+    experiments = {
+        experiment_name: LocalExperimentTracker(Path(args.evaluation_output), experiment_name)
+        for experiment_name in experiment_names
+    }
+    # model errors are written as the samples are evaluated
+    on_evaluated = {
+        experiment_name: stream_errors(open_error_sink(experiment, experiment_name))
+        for experiment_name, experiment in experiments.items()
+    }
+    logging.info(f"Start evaluating the models {', '.join(experiment_names)}")
+    try:
+        evaluation_results, execution_times = evaluate_all_models(
+            evaluators,
+            evaluation_data,
+            batch_size,
+            nlp_engine,
+            stage_timers,
+            queue_size,
+            checkpoints,
+            on_evaluated,
+        )
+    except BaseException:
+        # keep the errors written so far readable
+        for experiment in experiments.values():
+            experiment.close_error_sink()
+        raise
+    finally:
+        for checkpoint in checkpoints.values():
+            checkpoint.close()
+    for experiment_name, evaluator in evaluators.items():
+        with mlflow.start_run(run_name=experiment_name, nested=True):
+            log_experiment(
+                experiment_name,
+                evaluator,
+                evaluation_results[experiment_name],
+                beta,
+                execution_times[experiment_name],
+                stage_timers[experiment_name],
+                artifact_writer,
+                experiments[experiment_name],
+            )
+
+
+def open_checkpoint(checkpoint_dir: str, experiment_name: str, resume: bool = False) -> EvaluationCheckpoint:
+    """
+    Open the checkpoint of an experiment, identified by its name and model configuration
+    so that a changed configuration starts over
+    :param checkpoint_dir: directory of the checkpoints, e.g. on a datastore surviving the compute
+    :param experiment_name: name of the experiment
+    :param resume: restore the samples saved by a previous run, otherwise the checkpoint is overwritten
+    """
+    return EvaluationCheckpoint(
+        os.path.join(checkpoint_dir, f"{experiment_name}.jsonl"),
+        {"experiment_name": experiment_name, "model_config": get_model_config(experiment_name)},
+        resume,
+    )
+
+
+@lru_cache(maxsize=None)
+def get_dataset_version(data_path: str) -> str:
+    """Name of the dataset file and hash of its content, e.g. synth_dataset_v2.json@0123456789ab"""
+    content_hash = hashlib.sha256()
+    with open(data_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            content_hash.update(chunk)
+    return f"{os.path.basename(data_path)}@{content_hash.hexdigest()[:12]}"
 
-    if args.experiment_name == "Presidio":
+
+def get_model_config(experiment_name: str) -> Optional[dict]:
+    """
+    Return the model configuration of an experiment
+    :param experiment_name: one of Presidio, StanfordAIMI or BertDEID, transformers models can be suffixed
+    with an inference backend, e.g. BertDEID@onnx (see INFERENCE_BACKENDS)
+    :return: model configuration dictionary from _ner_model_config, None for Presidio
+    """
+    if "@" in experiment_name:
+        base_name, backend = experiment_name.split("@", 1)
+        model_config = get_model_config(base_name)
+        if model_config is None or backend not in INFERENCE_BACKENDS:
+            raise ValueError(f"Experiment name {experiment_name} is not supported")
+        logging.info(f"Using the {backend} inference backend")
+        return {**model_config, "INFERENCE_BACKEND": backend}
+    elif experiment_name == "Presidio":
         # Evaluate presidio based model
         logging.info("Running evaluation for model presidio")
-        wrapper = initialize_analyzer_engine()
-    elif args.experiment_name == "StanfordAIMI":
+        return None
+    elif experiment_name == "StanfordAIMI":
         logging.info("Running evaluation for stanford model")
-        wrapper = initialize_analyzer_engine(_ner_model_config.STANFORD_CONFIGURATION)
-    elif args.experiment_name == "BertDEID":
+        return _ner_model_config.STANFORD_CONFIGURATION
+    elif experiment_name == "BertDEID":
         logging.info("Running evaluation for deid_roberta_i2b2 model")
-        wrapper = initialize_analyzer_engine(_ner_model_config.BERT_DEID_CONFIGURATION)
+        return _ner_model_config.BERT_DEID_CONFIGURATION
     else:
-        raise ValueError(f"Experiment name {args.experiment_name} is not supported")
-    evaluate_experiment(args.experiment_name, deepcopy(data), wrapper, args.beta_value)
+        raise ValueError(f"Experiment name {experiment_name} is not supported")
+
+
+def compare_backends(experiment_names: List[str], evaluation_output: str) -> Optional[pd.DataFrame]:
+    """
+    Compare the experiments run with another inference backend (e.g. BertDEID@pytorch-int8) to the pytorch
+    baseline of the same model (BertDEID or BertDEID@pytorch): score deltas and speedups, from their
+    evaluation_result.json. The comparison is saved as backend_comparison.csv and logged to MLflow.
+    :param experiment_names: names of the evaluated experiments
+    :param evaluation_output: folder path of results
+    :return: one row per compared experiment, None if no experiment has a baseline
+    """
+
+    def read_result(experiment_name):
+        with open(os.path.join(evaluation_output, experiment_name, "evaluation_result.json")) as f:
+            return json.load(f)
+
+    def mean_entity_delta(result, baseline, metric):
+        # evaluation_result.json only has the overall F measure, precision and recall are per entity
+        deltas = [
+            result[key] - baseline[key]
+            for key in result
+            if key.endswith(f"_{metric}") and key in baseline
+        ]
+        return float(np.nanmean(deltas)) if deltas else np.nan
+
+    rows = []
+    for experiment_name in experiment_names:
+        base_name, _, backend = experiment_name.partition("@")
+        if not backend or backend == "pytorch":
+            continue
+        baseline_name = next(
+            (name for name in (base_name, f"{base_name}@pytorch") if name in experiment_names), None
+        )
+        if baseline_name is None:
+            continue
+        baseline, result = read_result(baseline_name), read_result(experiment_name)
+        baseline_inference = baseline["stage_times"].get("recognizer_inference", 0.0)
+        inference = result["stage_times"].get("recognizer_inference", 0.0)
+        rows.append(
+            {
+                "model_name": experiment_name,
+                "baseline": baseline_name,
+                "backend": backend,
+                "pii_f_delta": result["pii_f"] - baseline["pii_f"],
+                "mean_entity_precision_delta": mean_entity_delta(result, baseline, "precision"),
+                "mean_entity_recall_delta": mean_entity_delta(result, baseline, "recall"),
+                "execution_time_speedup": baseline["execution_time"] / max(result["execution_time"], 1e-9),
+                "inference_speedup": baseline_inference / max(inference, 1e-9),
+            }
+        )
+    if not rows:
+        return None
+
+    df_comparison = pd.DataFrame(rows)
+    logging.info(f"Inference backend comparison:\n{df_comparison.to_string(index=False)}")
+    output_file = os.path.join(evaluation_output, "backend_comparison.csv")
+    df_comparison.to_csv(output_file, index=False)
+    mlflow.log_artifact(output_file)
+    for row in rows:
+        # MLflow metric names can't contain @
+        metric_prefix = row["model_name"].replace("@", "_")
+        for key in ("pii_f_delta", "execution_time_speedup", "inference_speedup"):
+            mlflow.log_metric(f"{metric_prefix}_{key}", row[key])
+    return df_comparison
+
+
+def tune_threads(
+    experiment_names: List[str],
+    data_path: str,
+    n_samples: int,
+    workers: int,
+    sidecar_prefix: Optional[str] = None,
+) -> Optional[int]:
+    """
+    Time the analyzer of the first transformers (pytorch) experiment on the first samples of the dataset
+    with a few intra-op thread counts
+    :param experiment_names: names of the experiments
+    :param data_path: path of the evaluation dataset
+    :param n_samples: number of samples timed with each thread count
+    :param workers: number of worker processes sharing the cores
+    :param sidecar_prefix: path prefix of the tokenization sidecars of the dataset
+    :return: the fastest thread count, None if no experiment runs a pytorch model
+    """
+    model_configs = [get_model_config(experiment_name) for experiment_name in experiment_names]
+    model_config = next(
+        (
+            model_config
+            for model_config in model_configs
+            if model_config is not None and model_config.get("INFERENCE_BACKEND", "pytorch") != "onnx"
+        ),
+        None,
+    )
+    if model_config is None:
+        logging.info("No pytorch model to tune the intra-op threads for")
+        return None
+
+    # without prediction cache, cached predictions would not be timed; the model stays in the model registry
+    wrapper = initialize_analyzer_engine(model_config)
+    texts = [
+        sample.full_text
+        for sample in read_dataset_stream(data_path, length=n_samples, sidecar_prefix=sidecar_prefix)
+    ]
+    timings = auto_tune_threads(
+        lambda text: wrapper.analyzer_engine.analyze(text=text, language=wrapper.language),
+        texts,
+        workers,
+    )
+    if not timings:
+        return get_default_threads(workers)
+    for n_threads, seconds in timings.items():
+        mlflow.log_metric("auto_tune_seconds", seconds, step=n_threads)
+    return min(timings, key=timings.get)
+
+
+def configure_threads(
+    args, experiment_names: List[str], data_path: str, sidecar_prefix: Optional[str] = None
+) -> dict:
+    """
+    Apply the thread settings of the arguments to the current process. With several workers, each process
+    gets its share of the cores and tokenizers are single threaded, unless set otherwise
+    :return: keyword arguments of apply_thread_settings, for the worker processes
+    """
+    tokenizers_parallelism = args.tokenizers_parallelism
+    if tokenizers_parallelism is None and args.workers > 1:
+        tokenizers_parallelism = "false"
+    thread_settings = {
+        "intra_op_threads": None,
+        "inter_op_threads": args.inter_op_threads,
+        "tokenizers_parallelism": None
+        if tokenizers_parallelism is None
+        else tokenizers_parallelism == "true",
+    }
+    apply_thread_settings(**thread_settings)
+
+    if args.intra_op_threads == "auto":
+        thread_settings["intra_op_threads"] = tune_threads(
+            experiment_names, data_path, args.auto_tune_samples, args.workers, sidecar_prefix
+        )
+    elif args.intra_op_threads is not None:
+        thread_settings["intra_op_threads"] = int(args.intra_op_threads)
+    elif args.workers > 1:
+        thread_settings["intra_op_threads"] = get_default_threads(args.workers)
+    apply_thread_settings(intra_op_threads=thread_settings["intra_op_threads"])
+    mlflow.log_params(
+        {key: value for key, value in thread_settings.items() if value is not None}
+    )
+    return thread_settings
+
+
+def main(args):
+    """Read evaluation dataset, evaluate PII solution and save result"""
+    model_registry.model_cache_dir = args.model_cache_dir
+    # Load the test data
+    data_path = os.path.join(args.raw_data, args.raw_file_name)
+    sidecar_prefix = (
+        os.path.join(args.tokenization_dir, args.raw_file_name) if args.tokenization_dir else None
+    )
+    # Samples are read and tokenized lazily, as they are evaluated, along the NLP pass of the analyzers
+    # which all use the NLP engine of the model registry
+    nlp = model_registry.get_nlp_engine().get_nlp("en") if sidecar_prefix is not None else None
+    dataset_source = {"filepath": data_path, "sidecar_prefix": sidecar_prefix}
+    data = read_dataset_stream(**dataset_source, nlp=nlp)
+    if args.workers > 1:
+        # sharded evaluation splits the dataset by index, the workers read their shards from dataset_source
+        data = list(data)
+
+    experiment_names = args.experiment_name.split(",")
+    # checkpoints are only written when asked for, or to resume from
+    checkpoint_dir = args.checkpoint_dir
+    if checkpoint_dir is None and args.resume:
+        checkpoint_dir = os.path.join(args.evaluation_output, "checkpoints")
+    thread_settings = configure_threads(args, experiment_names, data_path, sidecar_prefix)
+    # the images and artifacts of an experiment are exported while the next one runs
+    artifact_writer = AsyncArtifactWriter() if args.queue_size > 0 else None
+    try:
+        if len(experiment_names) > 1 and args.workers <= 1:
+            evaluate_experiments(
+                experiment_names,
+                data,
+                args.beta_value,
+                args.batch_size,
+                args.prediction_cache_dir,
+                args.queue_size,
+                artifact_writer,
+                checkpoint_dir,
+                args.resume,
+            )
+        else:
+            # sharded evaluation builds one analyzer per worker, run the experiments one after the other
+            for experiment_name in experiment_names:
+                # a single experiment is logged to the main run
+                with mlflow.start_run(
+                    run_name=experiment_name, nested=True
+                ) if len(experiment_names) > 1 else nullcontext():
+                    model_config = get_model_config(experiment_name)
+                    stage_timer = StageTimer()
+                    with stage_timer.stage("model_load"):
+                        wrapper = initialize_analyzer_engine(model_config, args.prediction_cache_dir)
+                    checkpoint = None
+                    if checkpoint_dir is not None:
+                        checkpoint = open_checkpoint(checkpoint_dir, experiment_name, args.resume)
+                    try:
+                        evaluate_experiment(
+                            experiment_name,
+                            data,
+                            wrapper,
+                            args.beta_value,
+                            args.batch_size,
+                            model_config,
+                            args.workers,
+                            args.prediction_cache_dir,
+                            stage_timer,
+                            thread_settings,
+                            args.queue_size,
+                            artifact_writer,
+                            checkpoint,
+                            dataset_source,
+                        )
+                    finally:
+                        if checkpoint is not None:
+                            checkpoint.close()
+    finally:
+        if artifact_writer is not None:
+            artifact_writer.close()
+
+    if len(experiment_names) > 1:
+        compare_backends(experiment_names, args.evaluation_output)
 
 
 if __name__ == "__main__":
@@ -241,6 +1606,23 @@ if __name__ == "__main__":
         f"Evaluation result path: {args.evaluation_output}",
         f"Experiment name: {args.experiment_name}",
         f"Beta: {args.beta_value}",
+        f"Batch size: {args.batch_size}",
+        f"Workers: {args.workers}",
+        f"Prediction cache: {args.prediction_cache_dir}",
+        f"Tokenization sidecars: {args.tokenization_dir}",
+        f"Model cache: {args.model_cache_dir}",
+        f"Intra-op threads: {args.intra_op_threads}",
+        f"Inter-op threads: {args.inter_op_threads}",
+        f"Tokenizers parallelism: {args.tokenizers_parallelism}",
+        f"Pipeline queue size: {args.queue_size}",
+        f"Checkpoint dir: {args.checkpoint_dir}",
+        f"Resume: {args.resume}",
+        f"Save error vectors: {args.save_error_vectors}",
+        f"Bootstrap resamples: {args.bootstrap_resamples}",
+        f"Bootstrap workers: {args.bootstrap_workers}",
+        f"Figure format: {args.figure_format}",
+        f"Figure workers: {args.figure_workers}",
+        f"Figure cache dir: {args.figure_cache_dir}",
     ]
 
     for line in lines:
@@ -0,0 +1,47 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+
+class AsyncArtifactWriter:
+    def __init__(self, max_pending: int = 2):
+        """`AsyncArtifactWriter` runs the export of the plots and artifacts of an experiment in a background thread,
+            while the next experiment is evaluated. Tasks run one at a time, in submission order,
+            and `submit` blocks while max_pending tasks are waiting, so finished experiments don't pile up in memory.
+            Errors of a task are raised by the next `submit` or `wait` call following its completion.
+
+        Args:
+            max_pending (int): Number of tasks queued or running before submit waits for the oldest one
+        """
+        self.max_pending = max(max_pending, 1)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="artifact-writer")
+        self._pending = deque()
+
+    def submit(self, task: Callable, *args, **kwargs) -> Future:
+        while len(self._pending) >= self.max_pending:
+            self._pending.popleft().result()
+        future = self._executor.submit(task, *args, **kwargs)
+        self._pending.append(future)
+        return future
+
+    def wait(self):
+        """Wait for all the submitted tasks"""
+        while self._pending:
+            self._pending.popleft().result()
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
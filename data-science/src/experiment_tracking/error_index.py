@@ -0,0 +1,122 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+
+import json
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+from presidio_evaluator.evaluation import ModelError
+
+from experiment_tracking.error_store import read_error_store
+
+# Fields of ModelError, in the column order of ModelError.get_errors_df
+ERROR_FIELDS = ["error_type", "annotation", "prediction", "token", "full_text", "metadata"]
+FALSE_POSITIVE = "FP"
+
+
+class ErrorIndex:
+    def __init__(self, df_errors: pd.DataFrame):
+        """`ErrorIndex` aggregates model errors in a single pass, for the per-entity error exports and plots which
+            used to filter all the errors once per entity (ModelError.get_fps_dataframe / get_fns_dataframe).
+            The entity of a false positive is its prediction, the entity of the other errors (false negatives and
+            wrong entities) is their annotation, as in ModelError.get_false_positives / get_false_negatives.
+            Errors are counted by (entity, error_type, token) in `counts`, along their annotation and the text
+            of their first occurrence.
+
+        Args:
+            df_errors (pd.DataFrame): One row per error with the ERROR_FIELDS columns, tokens as text and metadata
+                as dictionaries (or None), see from_model_errors and from_error_store
+        """
+        is_fp = df_errors["error_type"] == FALSE_POSITIVE
+        self.errors = df_errors.assign(
+            entity=df_errors["prediction"].where(is_fp, df_errors["annotation"]),
+            is_fp=is_fp,
+        )
+        self.counts = self.errors.groupby(["entity", "error_type", "token"], sort=False).agg(
+            count=("token", "size"),
+            annotation=("annotation", "first"),
+            example=("full_text", "first"),
+        )
+
+    @classmethod
+    def from_model_errors(cls, errors: Sequence[ModelError]) -> "ErrorIndex":
+        """ErrorIndex of ModelError objects, e.g. EvaluationResult.model_errors"""
+        columns = {field: [] for field in ERROR_FIELDS}
+        for error in errors or []:
+            for field in ERROR_FIELDS:
+                columns[field].append(getattr(error, field))
+        columns["token"] = [str(token) for token in columns["token"]]
+        return cls(pd.DataFrame(columns, columns=ERROR_FIELDS))
+
+    @classmethod
+    def from_error_store(cls, path: Union[Path, str]) -> "ErrorIndex":
+        """ErrorIndex of the errors saved by write_error_store, in the order of their samples"""
+        df_errors = read_error_store(path, columns=["sample_id", *ERROR_FIELDS])
+        # errors restored from a checkpoint are written after the evaluated ones
+        df_errors = df_errors.sort_values("sample_id", kind="stable", ignore_index=True)
+        df_errors = df_errors.drop(columns=["sample_id"])
+        df_errors["metadata"] = [
+            json.loads(metadata) if isinstance(metadata, str) else None
+            for metadata in df_errors["metadata"]
+        ]
+        return cls(df_errors)
+
+    def _counts(self, false_positives: bool) -> pd.DataFrame:
+        is_fp = self.counts.index.get_level_values("error_type") == FALSE_POSITIVE
+        return self.counts[is_fp if false_positives else ~is_fp]
+
+    def iter_errors_dataframes(
+        self, entities: Optional[Iterable[str]] = None
+    ) -> Iterable[Tuple[str, bool, pd.DataFrame]]:
+        """
+        Errors of each entity, split in false positives and false negatives
+        :param entities: entities to return, None for all of them
+        :return: (entity, false_positives, DataFrame) tuples, each DataFrame as returned by
+        ModelError.get_fps_dataframe / get_fns_dataframe for the entity
+        """
+        entities = set(entities) if entities is not None else None
+        for (entity, is_fp), group in self.errors.groupby(["entity", "is_fp"], sort=False):
+            if entities is not None and entity not in entities:
+                continue
+            group = group[ERROR_FIELDS].reset_index(drop=True)
+            # one column per metadata key
+            metadata_df = pd.DataFrame(group["metadata"].tolist())
+            yield entity, is_fp, pd.concat([group.drop(columns=["metadata"]), metadata_df], axis=1)
+
+    def most_common_tokens(
+        self, false_positives: bool, n: int = 3, entities: Optional[Iterable[str]] = None
+    ) -> pd.DataFrame:
+        """
+        Most common tokens of each entity
+        :param false_positives: count the false positives, otherwise the false negatives
+        :param n: number of tokens per entity
+        :param entities: entities to count, None for all of them
+        :return: DataFrame with the entity, token, annotation and count columns
+        """
+        counts = self._counts(false_positives)
+        if entities is not None:
+            counts = counts[counts.index.get_level_values("entity").isin(list(entities))]
+        counts = (
+            counts
+            .groupby(["entity", "token", "annotation"])["count"]
+            .sum()
+            .reset_index()
+        )
+        return (
+            counts.sort_values("count", ascending=False, kind="stable")
+            .groupby("entity", sort=False)
+            .head(n)
+            .reset_index(drop=True)
+        )
+
+    def most_common_fp_tokens(self, n: int = 10) -> List[Tuple[str, int, str]]:
+        """Same as ModelError.most_common_fp_tokens: the n most common false positive tokens of all entities,
+        with their count and the text of their first occurrence"""
+        counts = self._counts(false_positives=True).groupby("token", sort=False).agg(
+            count=("count", "sum"), example=("example", "first")
+        )
+        counts = counts.sort_values("count", ascending=False, kind="stable").head(n)
+        return list(zip(counts.index, counts["count"].tolist(), counts["example"]))
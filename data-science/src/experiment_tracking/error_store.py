@@ -0,0 +1,294 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+
+import os
+import json
+import logging
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from presidio_evaluator.evaluation import ModelError
+
+# Columns of an error store, one row per model error
+SCHEMA = pa.schema(
+    [
+        ("sample_id", pa.int32()),
+        ("error_type", pa.string()),
+        ("annotation", pa.string()),
+        ("prediction", pa.string()),
+        ("token", pa.string()),
+        ("token_index", pa.int32()),
+        ("full_text", pa.string()),
+        ("metadata", pa.string()),
+    ]
+)
+ERROR_COLUMNS = tuple(SCHEMA.names)
+# Repeated values (labels, texts of the samples with several errors) are stored once per row group
+DICTIONARY_COLUMNS = ["error_type", "annotation", "prediction", "full_text", "metadata"]
+# Errors buffered in memory before they are written, as a part file of the error store
+PART_SIZE = 10000
+# The parts of an error store are listed in its manifest once they are complete
+MANIFEST_FILE_NAME = "_manifest.json"
+ERROR_STORE_VERSION = 1
+
+
+def get_manifest_path(path: Union[Path, str]) -> Path:
+    """Path of the manifest of the error store at path"""
+    return Path(path) / MANIFEST_FILE_NAME
+
+
+def read_manifest(path: Union[Path, str]) -> Optional[dict]:
+    """Manifest of the error store at path, None if it has none (e.g. it was never written)"""
+    manifest_path = get_manifest_path(path)
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def get_part_paths(path: Union[Path, str]) -> List[Path]:
+    """Paths of the complete part files of the error store at path, in the order they were written"""
+    manifest = read_manifest(path)
+    if manifest is None:
+        return []
+    return [Path(path) / part["file"] for part in manifest["parts"]]
+
+
+class ErrorStoreWriter:
+    def __init__(
+        self,
+        path: Union[Path, str],
+        save_vectors: bool = False,
+        part_size: int = PART_SIZE,
+        header: Optional[dict] = None,
+        resume: bool = False,
+    ):
+        """`ErrorStoreWriter` appends model errors to a directory of zstd compressed Parquet files as they are
+            produced, with one column per ModelError field (see SCHEMA), the metadata of the samples being saved
+            as JSON. Errors are buffered and each batch of part_size errors is written as a part file, so memory
+            does not grow with the number of errors. A part is listed in the manifest (see MANIFEST_FILE_NAME) once
+            it is complete, so the errors written before a crash can be read, and the next run can resume
+            from them.
+
+        Args:
+            path (Union[Path, str]): Path of the error store directory
+            save_vectors (bool): Also save the spaCy vector of each token, as a float16 (n_errors, dim) array
+                per part (see read_error_vectors)
+            part_size (int): Number of errors per part file
+            header (Optional[dict]): JSON serializable identity of the errors, e.g. the experiment and its dataset
+            resume (bool): Keep the parts of an existing store with the same header, the samples they have
+                are not written again (see write_sample). Otherwise the store is overwritten
+        """
+        self.path = Path(path)
+        self.save_vectors = save_vectors
+        self.part_size = part_size
+        # as read back from the manifest, e.g. tuples become lists
+        self.header = json.loads(json.dumps(header))
+        self.n_errors = 0
+        # samples whose errors were written, see write_new
+        self.written_samples = set()
+        self._parts = []
+        self._rows = {name: [] for name in ERROR_COLUMNS}
+        self._vectors = []
+
+        manifest = read_manifest(self.path) if resume and self.path.is_dir() else None
+        if manifest is not None and (
+            manifest.get("version") != ERROR_STORE_VERSION
+            or manifest.get("header") != self.header
+            or manifest.get("save_vectors") != save_vectors
+        ):
+            logging.warning(f"{self.path} was written for another experiment, starting over")
+            manifest = None
+        if manifest is not None:
+            self._parts = manifest["parts"]
+            self.n_errors = sum(part["rows"] for part in self._parts)
+            for part_path in get_part_paths(self.path):
+                self.written_samples.update(
+                    pq.read_table(part_path, columns=["sample_id"]).column("sample_id").to_pylist()
+                )
+            logging.info(f"Resuming from {self.n_errors} errors saved in {self.path}")
+        # the files left by an interrupted part, or the whole store when starting over
+        kept_files = {MANIFEST_FILE_NAME}
+        for part in self._parts:
+            kept_files.update(filter(None, [part["file"], part["vectors"]]))
+        if self.path.is_file():
+            self.path.unlink()
+        self.path.mkdir(parents=True, exist_ok=True)
+        for file_path in self.path.iterdir():
+            if file_path.name not in kept_files:
+                file_path.unlink()
+        self._write_manifest(complete=False)
+
+    def write(self, errors: Sequence[ModelError], sample_ids: Optional[Sequence[int]] = None):
+        """
+        Append model errors
+        :param errors: model errors, e.g. EvaluationResult.model_errors
+        :param sample_ids: index in the evaluation data of the sample of each error, None if unknown (-1)
+        """
+        sample_ids = sample_ids if sample_ids is not None else [-1] * len(errors)
+        for error, sample_id in zip(errors, sample_ids):
+            self._rows["sample_id"].append(sample_id)
+            self._rows["error_type"].append(error.error_type)
+            self._rows["annotation"].append(error.annotation)
+            self._rows["prediction"].append(error.prediction)
+            self._rows["token"].append(str(error.token))
+            self._rows["token_index"].append(getattr(error.token, "i", -1))
+            self._rows["full_text"].append(error.full_text)
+            self._rows["metadata"].append(
+                json.dumps(error.metadata, default=str) if error.metadata is not None else None
+            )
+            if self.save_vectors:
+                self._vectors.append(np.asarray(error.token.vector, dtype=np.float16))
+        self.n_errors += len(errors)
+        if len(self._rows["sample_id"]) >= self.part_size:
+            self.flush()
+
+    def write_sample(self, sample_id: int, errors: Optional[Sequence[ModelError]]):
+        """Append the model errors of a sample, e.g. as it is evaluated, unless they were written already"""
+        if sample_id in self.written_samples:
+            return
+        errors = errors or []
+        self.write(errors, [sample_id] * len(errors))
+        self.written_samples.add(sample_id)
+
+    def write_new(self, errors: Sequence[ModelError], sample_ids: Sequence[int]):
+        """Append the model errors of the samples whose errors were not written yet"""
+        new_errors = [
+            (error, sample_id)
+            for error, sample_id in zip(errors, sample_ids)
+            if sample_id not in self.written_samples
+        ]
+        self.write([error for error, _ in new_errors], [sample_id for _, sample_id in new_errors])
+        self.written_samples.update(sample_id for _, sample_id in new_errors)
+
+    def flush(self):
+        """Write the buffered errors as a part file, and add it to the manifest"""
+        n_rows = len(self._rows["sample_id"])
+        if not n_rows:
+            return
+        part_name = f"part-{len(self._parts):05d}"
+        part = {"file": f"{part_name}.parquet", "rows": n_rows, "vectors": None}
+        # written under a temporary name, a part is only read once it is complete
+        tmp_path = self.path / f"{part_name}.tmp"
+        pq.write_table(
+            pa.Table.from_pydict(self._rows, schema=SCHEMA),
+            tmp_path,
+            compression="zstd",
+            use_dictionary=DICTIONARY_COLUMNS,
+        )
+        os.replace(tmp_path, self.path / part["file"])
+        if self.save_vectors:
+            part["vectors"] = f"{part_name}_vectors.npy"
+            with open(tmp_path, "wb") as f:
+                np.save(f, np.stack(self._vectors))
+            os.replace(tmp_path, self.path / part["vectors"])
+        self._parts.append(part)
+        self._write_manifest(complete=False)
+        self._rows = {name: [] for name in ERROR_COLUMNS}
+        self._vectors = []
+
+    def _write_manifest(self, complete: bool):
+        manifest = {
+            "version": ERROR_STORE_VERSION,
+            "header": self.header,
+            "save_vectors": self.save_vectors,
+            "complete": complete,
+            "parts": self._parts,
+        }
+        manifest_path = get_manifest_path(self.path)
+        tmp_path = manifest_path.with_name(f"{MANIFEST_FILE_NAME}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, manifest_path)
+
+    def close(self):
+        """Write the remaining errors, and mark the store as complete"""
+        self.flush()
+        self._write_manifest(complete=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_error_store(
+    path: Union[Path, str],
+    errors: Sequence[ModelError],
+    sample_ids: Optional[Sequence[int]] = None,
+    save_vectors: bool = False,
+):
+    """
+    Save model errors in a single call, see ErrorStoreWriter
+    :param path: path of the error store directory
+    :param errors: model errors, e.g. EvaluationResult.model_errors
+    :param sample_ids: index in the evaluation data of the sample of each error, None if unknown (-1)
+    :param save_vectors: also save the spaCy vector of each token
+    """
+    with ErrorStoreWriter(path, save_vectors) as writer:
+        writer.write(errors, sample_ids)
+
+
+def read_error_store(
+    path: Union[Path, str],
+    columns: Optional[List[str]] = None,
+    filters: Optional[List[Tuple]] = None,
+) -> pd.DataFrame:
+    """
+    Read the errors saved by write_error_store, or the complete parts of a store which is still being written
+    (or whose writer crashed). Only the requested columns are read, and the row groups which can't match
+    the filters are skipped
+    :example:
+    >read_error_store("experiment_errors.parquet", ["token", "full_text"], [("annotation", "=", "PERSON")])
+    :param path: path of the error store directory
+    :param columns: columns to read (see ERROR_COLUMNS), None to read all of them
+    :param filters: pyarrow filters on the rows, e.g. [("error_type", "=", "FN")]
+    """
+    part_paths = get_part_paths(path)
+    if not part_paths:
+        return SCHEMA.empty_table().select(columns or ERROR_COLUMNS).to_pandas()
+    return pq.read_table(
+        [str(part_path) for part_path in part_paths], columns=columns, filters=filters, schema=SCHEMA
+    ).to_pandas()
+
+
+def iter_error_store(
+    path: Union[Path, str], columns: Optional[List[str]] = None, batch_size: int = PART_SIZE
+) -> Iterator[pd.DataFrame]:
+    """Read the errors saved by write_error_store in batches of at most batch_size rows, in memory one at a time"""
+    for part_path in get_part_paths(path):
+        parquet_file = pq.ParquetFile(part_path)
+        for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+            yield batch.to_pandas()
+
+
+def read_error_vectors(path: Union[Path, str]) -> np.ndarray:
+    """Token vectors saved along the errors of the error store at path (save_vectors), one row per error"""
+    manifest = read_manifest(path)
+    if manifest is None or not manifest["save_vectors"]:
+        raise FileNotFoundError(f"No token vectors saved in {path}")
+    vectors = [np.load(Path(path) / part["vectors"]) for part in manifest["parts"]]
+    return np.concatenate(vectors) if vectors else np.empty((0, 0), dtype=np.float16)
+
+
+def to_model_errors(df_errors: pd.DataFrame) -> List[ModelError]:
+    """ModelError objects of the rows of read_error_store, for the ModelError analysis helpers.
+    Tokens are their text, as spaCy tokens are not saved"""
+    return [
+        ModelError(
+            error_type=row.error_type,
+            annotation=row.annotation,
+            prediction=row.prediction,
+            token=row.token,
+            full_text=row.full_text,
+            metadata=json.loads(row.metadata) if isinstance(row.metadata, str) else None,
+        )
+        for row in df_errors.itertuples(index=False)
+    ]
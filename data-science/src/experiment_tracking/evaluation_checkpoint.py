@@ -0,0 +1,180 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+
+import os
+import json
+import time
+import hashlib
+import logging
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from presidio_evaluator import InputSample
+from presidio_evaluator.evaluation import EvaluationResult, ModelError
+
+CHECKPOINT_VERSION = 1
+# Records written between two flushes of the checkpoint file, unless FLUSH_SECONDS elapse first
+FLUSH_RECORDS = 100
+FLUSH_SECONDS = 10.0
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def to_record(
+    sample_index: int,
+    sample: InputSample,
+    prediction: Optional[List[str]],
+    evaluation_result: EvaluationResult,
+) -> dict:
+    """JSON serializable prediction and scores of an evaluated sample.
+    spaCy tokens can't be serialized, so model errors are saved with the index of their token in the sample
+
+    Args:
+        sample_index (int): Index of the sample in the evaluation data
+        sample (InputSample): The evaluated sample
+        prediction (Optional[List[str]]): Tags predicted for the sample
+        evaluation_result (EvaluationResult): EvaluationResult of the sample
+    """
+    return {
+        "index": sample_index,
+        "text_hash": hash_text(sample.full_text),
+        "prediction": prediction,
+        "results": [
+            [annotation, predicted, count]
+            for (annotation, predicted), count in evaluation_result.results.items()
+        ],
+        "errors": [
+            [error.error_type, error.annotation, error.prediction, error.token.i]
+            for error in evaluation_result.model_errors
+        ],
+    }
+
+
+def from_record(record: dict, sample: InputSample) -> EvaluationResult:
+    """EvaluationResult of a sample saved by to_record, its model errors point to the tokens of sample"""
+    results = Counter(
+        {(annotation, predicted): count for annotation, predicted, count in record["results"]}
+    )
+    model_errors = [
+        ModelError(
+            error_type=error_type,
+            annotation=annotation,
+            prediction=prediction,
+            token=sample.tokens[token_index],
+            full_text=sample.full_text,
+            metadata=sample.metadata,
+        )
+        for error_type, annotation, prediction, token_index in record["errors"]
+    ]
+    return EvaluationResult(results, model_errors, sample.full_text)
+
+
+class EvaluationCheckpoint:
+    def __init__(
+        self,
+        path: Union[Path, str],
+        header: dict,
+        resume: bool = False,
+        flush_records: int = FLUSH_RECORDS,
+        flush_seconds: float = FLUSH_SECONDS,
+    ):
+        """`EvaluationCheckpoint` appends the prediction and the scores (results counter and errors) of each evaluated
+            sample to a JSON Lines file, so an interrupted evaluation can resume where it stopped.
+            The first line is a header identifying the experiment. When resuming, a checkpoint with a different
+            header is discarded, and a sample is only restored if its index and text did not change.
+            The file is flushed every flush_records records or flush_seconds seconds, whichever comes first,
+            so an interrupted evaluation evaluates again the samples written since the last flush.
+
+        Args:
+            path (Union[Path, str]): Path of the checkpoint file
+            header (dict): JSON serializable identity of the experiment, e.g. its name and model configuration
+            resume (bool): Restore the samples of an existing checkpoint, otherwise it is overwritten
+            flush_records (int): Number of records written between two flushes
+            flush_seconds (float): Maximum number of seconds between two flushes, checked when a record is written
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.flush_records = flush_records
+        self.flush_seconds = flush_seconds
+        # as read back from the file, e.g. tuples become lists
+        self.header = json.loads(json.dumps({"version": CHECKPOINT_VERSION, **header}))
+        self.records: Dict[int, dict] = {}
+        if resume and self.path.exists():
+            self.records = self._load()
+            logging.info(f"Resuming from {len(self.records)} samples saved in {self.path}")
+        # rewritten without the partial line an interrupted job may have left. The new file replaces the checkpoint
+        # once it is on disk, so an interruption while it is written keeps the restored samples
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as tmp_file:
+            tmp_file.write(json.dumps(self.header) + "\n")
+            for record in self.records.values():
+                tmp_file.write(json.dumps(record) + "\n")
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._unflushed_records = 0
+        self._flush_time = time.monotonic()
+
+    def _load(self) -> Dict[int, dict]:
+        records = {}
+        with open(self.path, encoding="utf-8") as f:
+            lines = iter(f)
+            try:
+                header = json.loads(next(lines))
+            except (StopIteration, json.JSONDecodeError):
+                header = None
+            if header != self.header:
+                logging.warning(f"{self.path} was written for another experiment, starting over")
+                return records
+            for line in lines:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # last line of a job interrupted while writing
+                    break
+                records[record["index"]] = record
+        return records
+
+    def has(self, sample_index: int, sample: InputSample) -> bool:
+        """Whether the sample was evaluated before the evaluation resumed"""
+        record = self.records.get(sample_index)
+        return record is not None and record["text_hash"] == hash_text(sample.full_text)
+
+    def restore(self, sample_index: int, sample: InputSample) -> EvaluationResult:
+        return from_record(self.records[sample_index], sample)
+
+    def write(
+        self,
+        sample_index: int,
+        sample: InputSample,
+        prediction: Optional[List[str]],
+        evaluation_result: EvaluationResult,
+    ):
+        self.write_record(to_record(sample_index, sample, prediction, evaluation_result))
+
+    def write_record(self, record: dict):
+        """Append the record of an evaluated sample (see to_record), it survives the process once flushed"""
+        self._file.write(json.dumps(record) + "\n")
+        self._unflushed_records += 1
+        if (
+            self._unflushed_records >= self.flush_records
+            or time.monotonic() - self._flush_time >= self.flush_seconds
+        ):
+            self.flush()
+
+    def flush(self):
+        """Write the records to disk, e.g. a datastore mount, not only to the OS cache"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unflushed_records = 0
+        self._flush_time = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self._file.close()
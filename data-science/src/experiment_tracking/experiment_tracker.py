@@ -4,11 +4,11 @@
 
 
 import json
-from typing import List
-import pickle
+from typing import List, Optional, Sequence
 import pandas as pd
 from presidio_evaluator.experiment_tracking.experiment_tracker import ExperimentTracker
 from presidio_evaluator.evaluation.model_error import ModelError
+from experiment_tracking.error_store import ErrorStoreWriter
 from pathlib import Path
 from datetime import datetime
 
@@ -19,7 +19,8 @@ class LocalExperimentTracker(ExperimentTracker):
             Each new experiment generate an experiment directory and stores the following files inside the directory:
             1. confusion_matrix.csv - The generated confusion matrix for each entity
             2. experiment_params.json - Dictionary containing any logged information needed to the user
-            3. experiment_errors.pkl - Pickles representation of a `List[ModelError]` instances. 
+            3. experiment_errors.parquet - Directory of Parquet parts with one row per `ModelError`,
+               see `error_store.read_error_store`
 
         Args:
             directory (str): Main location of experimentation folder
@@ -28,6 +29,7 @@ class LocalExperimentTracker(ExperimentTracker):
         super().__init__()
         self.experiment_name = experiment_name
         self.dir = directory
+        self._error_sink = None
         self.start()
 
     def start(self):
@@ -40,25 +42,47 @@ class LocalExperimentTracker(ExperimentTracker):
     def log_start_time(self):
         self.experiment_start_time = datetime.now().strftime("%m/%d/%Y, %H:%M:%S")
 
-    def log_errors(self, errors: List[ModelError]):
-        """ Generate a serialized version of all model errors and store as `.pkl` file
+    def open_error_sink(
+        self, save_vectors: bool = False, header: Optional[dict] = None, resume: bool = False
+    ) -> ErrorStoreWriter:
+        """ Open the `.parquet` errors store in append mode, so errors can be written in batches
+        as they are produced. Each batch is readable once written, the store is marked as complete
+        by `end` (or `close_error_sink`)
+        Args:
+            save_vectors (bool): Also store the token vectors (float16), see `error_store.read_error_vectors`
+            header (Optional[dict]): Identity of the errors, e.g. the model configuration and the dataset version
+            resume (bool): Keep the errors written by a previous run with the same header
+        """
+        if self._error_sink is None:
+            file_path = Path(Path.cwd(), self.dir, self.experiment_name,
+                             "experiment_errors.parquet")
+            self._error_sink = ErrorStoreWriter(file_path, save_vectors, header=header, resume=resume)
+        return self._error_sink
+
+    def log_errors(
+        self,
+        errors: List[ModelError],
+        sample_ids: Optional[Sequence[int]] = None,
+        save_vectors: bool = False,
+    ):
+        """ Store model errors in the compressed columnar `.parquet` errors file.
+            Errors of the samples already written to the error sink are skipped
         Args:
             errors (List[ModelError]): List containing generated errors by the NER model
+            sample_ids (Optional[Sequence[int]]): Index of the sample of each error in the evaluation data
+            save_vectors (bool): Also store the token vectors (float16), see `error_store.read_error_vectors`
         """
-        errors_str = self._serialize_errors(errors)
-        file_path = Path(Path.cwd(), self.dir, self.experiment_name,
-                         "experiment_errors.pkl")
-        file = open(file_path, 'wb')
-        pickle.dump(errors_str, file)
-        file.close()
-
-    def _serialize_errors(self, errors: List) -> List[dict]:
-        errors_str = list()
-        for error in errors:
-            error.vector = error.token.vector
-            error.token = str(error.token)
-            errors_str.append(error)
-        return errors_str
+        error_sink = self.open_error_sink(save_vectors)
+        if sample_ids is None:
+            error_sink.write(errors)
+        else:
+            error_sink.write_new(errors, sample_ids)
+
+    def close_error_sink(self):
+        """Write the remaining errors and mark the errors store as complete"""
+        if self._error_sink is not None:
+            self._error_sink.close()
+            self._error_sink = None
 
     def log_confusion_matrix_table(
         self,
@@ -85,9 +109,11 @@ class LocalExperimentTracker(ExperimentTracker):
         """
         file_path = Path(Path.cwd(), self.dir, self.experiment_name,
                          "experiment_params.json")
+        self.close_error_sink()
         print(f"saving experiment data to directory {self.experiment_name}")
+        params = {key: value for key, value in self.__dict__.items() if not key.startswith("_")}
         with file_path.open('w') as json_file:
-            json.dump(self.__dict__, json_file)
+            json.dump(params, json_file, default=str)
 
 
 if __name__ == "__main__":
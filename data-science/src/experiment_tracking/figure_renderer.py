@@ -0,0 +1,105 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+
+import os
+import hashlib
+import logging
+import multiprocessing
+import shutil
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+import plotly
+import plotly.io as pio
+
+# png images are rendered by kaleido, html pages only need plotly
+FIGURE_FORMATS = ("png", "html")
+
+
+def figure_hash(figure_json: str, figure_format: str) -> str:
+    """Hash of the data and layout of a figure, and of what renders it"""
+    key = f"{plotly.__version__}:{figure_format}:{figure_json}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def _render_figure(task: Tuple[str, str, str]):
+    figure_json, path, figure_format = task
+    figure = pio.from_json(figure_json)
+    if figure_format == "html":
+        # plotly.js is loaded from its CDN instead of being embedded in each page
+        figure.write_html(path, include_plotlyjs="cdn")
+    else:
+        figure.write_image(path, format=figure_format)
+
+
+class FigureRenderer:
+    def __init__(
+        self,
+        figure_format: str = "png",
+        workers: int = 1,
+        cache_dir: Optional[Union[Path, str]] = None,
+    ):
+        """`FigureRenderer` exports plotly figures to files, optionally in parallel worker processes since each kaleido
+            export takes seconds. Workers are spawned rather than forked, as figures are exported from a background
+            thread while other threads (torch, dataset readers) run. Rendered files are kept in cache_dir under
+            the hash of their figure (see figure_hash), so a figure whose data did not change since a previous run
+            is copied instead of being rendered again.
+
+        Args:
+            figure_format (str): png, or html for a fast export which does not need kaleido (see FIGURE_FORMATS)
+            workers (int): Number of processes rendering the figures, 1 to render them in this process
+            cache_dir (Optional[Union[Path, str]]): Directory of the rendered files, None to disable the cache
+        """
+        if figure_format not in FIGURE_FORMATS:
+            raise ValueError(f"figure_format should be one of {FIGURE_FORMATS}, got {figure_format}")
+        self.figure_format = figure_format
+        self.workers = workers
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def render(self, figures: Dict[str, object], output_dir: Union[Path, str]) -> Dict[str, Path]:
+        """
+        Export figures to output_dir
+        :param figures: plotly figures by file name (without extension), None for the figures to skip
+        :param output_dir: directory of the exported files
+        :return: path of each exported figure, by file name
+        """
+        paths = {}
+        tasks = []
+        cached_paths = []
+        for name, figure in figures.items():
+            if figure is None:
+                continue
+            path = Path(output_dir) / f"{name}.{self.figure_format}"
+            paths[name] = path
+            figure_json = figure.to_json()
+            cached_path = None
+            if self.cache_dir is not None:
+                figure_key = figure_hash(figure_json, self.figure_format)
+                cached_path = self.cache_dir / f"{figure_key}.{self.figure_format}"
+                if cached_path.exists():
+                    shutil.copyfile(cached_path, path)
+                    continue
+            tasks.append((figure_json, str(path), self.figure_format))
+            cached_paths.append(cached_path)
+
+        if self.workers > 1 and len(tasks) > 1:
+            with multiprocessing.get_context("spawn").Pool(processes=min(self.workers, len(tasks))) as pool:
+                pool.map(_render_figure, tasks)
+        else:
+            for task in tasks:
+                _render_figure(task)
+
+        for (_, path, _), cached_path in zip(tasks, cached_paths):
+            if cached_path is not None:
+                # copied under a temporary name, so an interrupted copy is never reused
+                tmp_path = cached_path.with_name(f"{cached_path.name}.{os.getpid()}.tmp")
+                shutil.copyfile(path, tmp_path)
+                os.replace(tmp_path, cached_path)
+        logging.info(
+            f"Exported {len(paths)} figures to {output_dir}, {len(paths) - len(tasks)} of them from the cache"
+        )
+        return paths
@@ -0,0 +1,108 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+
+import os
+import glob
+import json
+import logging
+from pathlib import Path
+from typing import Iterable, List, Union
+
+import pandas as pd
+
+# Name of the result file written by evaluate.py for each experiment
+RESULT_FILE_NAME = "evaluation_result.json"
+# Columns identifying a run in the results table
+KEY_COLUMNS = ["model_name", "dataset_version", "run_id"]
+# Dataset version of the results saved before evaluate.py recorded it
+UNKNOWN_DATASET_VERSION = "unknown"
+
+
+def find_result_files(paths: Iterable[str]) -> List[Path]:
+    """
+    Result files of experiments, without duplicates
+    :param paths: glob patterns or paths of evaluation outputs (folder with one sub folder per experiment),
+    of experiment folders or of result files
+    :return: absolute path of each result file found
+    """
+    result_files = []
+    for pattern in paths:
+        matches = sorted(glob.glob(pattern)) or [pattern]
+        for match in matches:
+            match = Path(match)
+            if match.is_dir():
+                if (match / RESULT_FILE_NAME).exists():
+                    result_files.append(match / RESULT_FILE_NAME)
+                else:
+                    result_files.extend(sorted(match.glob(f"*/{RESULT_FILE_NAME}")))
+            elif match.exists():
+                result_files.append(match)
+            else:
+                logging.warning(f"No evaluation result found in {match}")
+    return list(dict.fromkeys(path.resolve() for path in result_files))
+
+
+def read_result(result_file: Union[Path, str]) -> dict:
+    """
+    Results table row of a result file: its scores, timings (flattened, e.g. stage_times.scoring) and key columns.
+    Results without a run id are identified by their file
+    """
+    with open(result_file, "r") as f:
+        result = json.load(f)
+    row = pd.json_normalize(result).iloc[0].to_dict()
+    row.setdefault("dataset_version", UNKNOWN_DATASET_VERSION)
+    row.setdefault("run_id", str(result_file))
+    row["source"] = str(result_file)
+    row["source_mtime"] = os.path.getmtime(result_file)
+    return row
+
+
+class ResultsTable:
+    def __init__(self, path: Union[Path, str]):
+        """`ResultsTable` aggregates the evaluation results of experiments in a Parquet file, one row per run
+            identified by its model, dataset version and MLflow run id (see KEY_COLUMNS), along the result file it
+            was read from. Result files which did not change since they were ingested are not read again.
+
+        Args:
+            path (Union[Path, str]): Path of the Parquet file, created by `save` if it does not exist
+        """
+        self.path = Path(path)
+        if self.path.exists():
+            self.df = pd.read_parquet(self.path)
+        else:
+            self.df = pd.DataFrame(columns=[*KEY_COLUMNS, "source", "source_mtime"])
+
+    def ingest(self, result_files: Iterable[Union[Path, str]]) -> pd.DataFrame:
+        """
+        Add the result files which are not in the table yet, or were modified since they were ingested
+        :param result_files: paths of evaluation_result.json files, see find_result_files
+        :return: rows of the result files, in their order
+        """
+        result_files = [str(path) for path in result_files]
+        ingested = dict(zip(self.df["source"], self.df["source_mtime"]))
+        new_rows = [
+            read_result(path)
+            for path in result_files
+            if ingested.get(path) != os.path.getmtime(path)
+        ]
+        logging.info(
+            f"Read {len(new_rows)} new results, {len(result_files) - len(new_rows)} already in {self.path}"
+        )
+        if new_rows:
+            df_new = pd.DataFrame(new_rows)
+            # a rewritten result file replaces its row, so does a run read from another copy of its folder
+            is_new_run = self.df.set_index(KEY_COLUMNS).index.isin(df_new.set_index(KEY_COLUMNS).index)
+            replaced = self.df["source"].isin(df_new["source"]) | (
+                is_new_run & ~self.df["source"].isin(result_files)
+            )
+            df_kept = self.df[~replaced]
+            self.df = pd.concat([df_kept, df_new], ignore_index=True) if len(df_kept) > 0 else df_new
+        return self.df.set_index("source").loc[result_files].reset_index()
+
+    def save(self):
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,164 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+import mlflow
+from mlflow.entities import Metric
+from mlflow.tracking import MlflowClient
+
+from presidio_analyzer import AnalyzerEngine
+
+# Stages of an evaluation, in execution order
+STAGES = (
+    "model_load",
+    "nlp_pass",
+    "recognizer_inference",
+    "prediction_other",
+    "span_alignment",
+    "scoring",
+    "bootstrap",
+    "plotting",
+    "image_export",
+    "artifact_logging",
+)
+LATENCY_PERCENTILES = (50, 95, 99)
+
+
+class StageTimer:
+    def __init__(self):
+        """`StageTimer` accumulates the time spent in each stage of an evaluation (see STAGES),
+            and the latency of each recognizer per analyzed document.
+            Timers of sharded workers are merged with `merge`, their stage times are then summed over the workers.
+        """
+        self.stage_times = defaultdict(float)
+        # recognizer name -> list of (seconds, number of characters), one per document
+        self.latencies = defaultdict(list)
+        # (recognizer name, text) -> share of a batched inference, added to the latency of the text's analyze call
+        self.prefetched_latencies = dict()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the enclosed block as part of stage name"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_times[name] += time.perf_counter() - start_time
+
+    def add(self, name: str, seconds: float):
+        self.stage_times[name] += seconds
+
+    def record_latency(self, recognizer_name: str, seconds: float, n_chars: int):
+        """Record the time a recognizer took to analyze a document of n_chars characters"""
+        self.latencies[recognizer_name].append((seconds, n_chars))
+
+    def add_prefetched_latency(self, recognizer_name: str, texts: List[str], seconds: float):
+        """Split the time of a batched inference over texts, in proportion to their length.
+        The share of each text is added to its latency when the recognizer analyzes it"""
+        total_chars = max(sum(len(text) for text in texts), 1)
+        for text in texts:
+            self.prefetched_latencies[(recognizer_name, text)] = seconds * len(text) / total_chars
+
+    def clear_prefetched_latencies(self, recognizer_name: str, texts: List[str]):
+        """Drop the shares of a batched inference which were not used, e.g. of texts whose analysis was skipped"""
+        for text in texts:
+            self.prefetched_latencies.pop((recognizer_name, text), None)
+
+    def reset(self):
+        self.stage_times.clear()
+        self.latencies.clear()
+        self.prefetched_latencies.clear()
+
+    def merge(self, other: "StageTimer"):
+        """Add the stage times and latencies of other to this timer, e.g. of a worker process or a background thread"""
+        for name, seconds in other.stage_times.items():
+            self.stage_times[name] += seconds
+        for recognizer_name, latencies in other.latencies.items():
+            self.latencies[recognizer_name].extend(latencies)
+        self.prefetched_latencies.update(other.prefetched_latencies)
+
+    def get_stage_times(self) -> Dict[str, float]:
+        """Seconds spent in each stage, known stages first"""
+        names = [name for name in STAGES if name in self.stage_times]
+        names += sorted(name for name in self.stage_times if name not in STAGES)
+        return {name: self.stage_times[name] for name in names}
+
+    def get_latency_percentiles(self) -> Dict[str, Dict[str, float]]:
+        """p50/p95/p99 latency of each recognizer, in milliseconds per document and microseconds per character"""
+        percentiles = {}
+        for recognizer_name, latencies in sorted(self.latencies.items()):
+            latencies = np.array(latencies, dtype=float)
+            per_doc = latencies[:, 0] * 1e3
+            per_char = latencies[:, 0] * 1e6 / np.maximum(latencies[:, 1], 1)
+            recognizer_percentiles = {"n_docs": len(latencies)}
+            for q, doc_value, char_value in zip(
+                LATENCY_PERCENTILES,
+                np.percentile(per_doc, LATENCY_PERCENTILES),
+                np.percentile(per_char, LATENCY_PERCENTILES),
+            ):
+                recognizer_percentiles[f"p{q}_ms_per_doc"] = float(doc_value)
+                recognizer_percentiles[f"p{q}_us_per_char"] = float(char_value)
+            percentiles[recognizer_name] = recognizer_percentiles
+        return percentiles
+
+    def to_log(self) -> Dict[str, dict]:
+        """Stage times and recognizer latencies, as saved in evaluation_result.json"""
+        return {
+            "stage_times": self.get_stage_times(),
+            "recognizer_latency": self.get_latency_percentiles(),
+        }
+
+    def log_to_mlflow(self, run_id: Optional[str] = None):
+        """Log the stage times and latency percentiles as metrics of the active run, or of run_id
+        (e.g. from a background thread, which does not share the active run)"""
+        metrics = {
+            f"stage_time_{name}": seconds for name, seconds in self.get_stage_times().items()
+        }
+        for recognizer_name, percentiles in self.get_latency_percentiles().items():
+            for key, value in percentiles.items():
+                if key != "n_docs":
+                    metrics[f"latency_{recognizer_name}_{key}"] = value
+        if run_id is None:
+            mlflow.log_metrics(metrics)
+        else:
+            timestamp = int(time.time() * 1000)
+            MlflowClient().log_batch(
+                run_id, metrics=[Metric(key, value, timestamp, 0) for key, value in metrics.items()]
+            )
+
+
+def instrument_recognizers(analyzer_engine: AnalyzerEngine, stage_timer: StageTimer) -> List[str]:
+    """
+    Time each recognizer of an analyzer: every call to its analyze method is added to the recognizer_inference stage
+    and recorded as one document in the recognizer's latencies
+    :param analyzer_engine: AnalyzerEngine whose recognizers are timed
+    :param stage_timer: StageTimer receiving the measurements
+    :return: names of the timed recognizers
+    """
+    names = []
+    for recognizer in analyzer_engine.registry.recognizers:
+        recognizer.analyze = _timed_analyze(recognizer.analyze, recognizer.name, stage_timer)
+        names.append(recognizer.name)
+    return names
+
+
+def _timed_analyze(analyze, recognizer_name: str, stage_timer: StageTimer):
+    def timed_analyze(text, *args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return analyze(text, *args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start_time
+            stage_timer.add("recognizer_inference", seconds)
+            # batched inference time is already in the recognizer_inference stage
+            prefetched_seconds = stage_timer.prefetched_latencies.pop((recognizer_name, text), 0.0)
+            stage_timer.record_latency(recognizer_name, seconds + prefetched_seconds, len(text))
+
+    return timed_analyze
@@ -9,29 +9,35 @@ import os
 import argparse
 import logging
 from pathlib import Path
-from typing import List
+from typing import Iterable
 from collections import Counter
 import matplotlib.pyplot as plt
-from copy import deepcopy
 import pandas as pd
 import mlflow
 
 from presidio_evaluator import InputSample
 
+from dataset_io.dataset_reader import read_dataset_stream
+
 logging.basicConfig(level=logging.INFO)
 
 
-def data_analysis(input_data: List[InputSample], title) -> pd.DataFrame():
-    """Pure analysis of raw data
-    :param transformed_data: folder path of transformed data of raw clinial notes
-    :param evaluation_output: folder path of results
-    :return: evaluation data in InputSample format"""
-    logging.info("Number of samples in evaluation data: %d", len(input_data))
+def data_analysis(input_data: Iterable[InputSample], title) -> pd.DataFrame():
+    """Pure analysis of raw data, computed in a single pass so input_data can be a stream of samples
+    :param input_data: samples in InputSample format, a list or a stream of samples
+    :param title: title of the entity count plot
+    :return: count per entity"""
     # Count the number of entities in the test data
     entity_counter = Counter()
+    n_samples = 0
+    n_tokens = []
+    text_lengths = []
     for sample in input_data:
-        for tag in sample.tags:
-            entity_counter[tag] += 1
+        n_samples += 1
+        entity_counter.update(sample.tags)
+        n_tokens.append(len(sample.tokens))
+        text_lengths.append(len(sample.full_text))
+    logging.info("Number of samples in evaluation data: %d", n_samples)
 
     # Visualize the number of entities in the test data
     common_entities = pd.DataFrame(entity_counter.most_common())
@@ -46,14 +52,14 @@ def data_analysis(input_data: List[InputSample], title) -> pd.DataFrame():
     mlflow.log_figure(plot.figure, f"{title}.png")
     # Close the plot to free up memory
     plt.close(plot.figure)
-    logging.info("Number of sample in dataset: %d", len(input_data))
+    logging.info("Number of sample in dataset: %d", n_samples)
     logging.info("Count per entity: %s", entity_counter.most_common())
     logging.info("Min and max number of tokens in dataset")
-    logging.info(f"Min: {min([len(sample.tokens) for sample in input_data])},")
-    logging.info(f"Max: {max([len(sample.tokens) for sample in input_data])}")
+    logging.info(f"Min: {min(n_tokens)},")
+    logging.info(f"Max: {max(n_tokens)}")
     logging.info("Min and max sentence length in dataset:")
-    logging.info("Min: {min([len(sample.full_text) for sample in evaluation_data])}")
-    logging.info("Max: {max([len(sample.full_text) for sample in evaluation_data])}")
+    logging.info(f"Min: {min(text_lengths)}")
+    logging.info(f"Max: {max(text_lengths)}")
     return common_entities
 
 
@@ -65,6 +71,12 @@ def parse_args():
         "--raw-data", type=str, help="Path of raw data folder"
     )
     parser.add_argument("--raw-file-name", type=str, help="Name of raw data file")
+    parser.add_argument(
+        "--tokenization-dir",
+        type=str,
+        default=None,
+        help="Directory of the tokenization sidecars written by tokenize_dataset.py (disabled by default)",
+    )
     args = parser.parse_args()
 
     return args
@@ -73,7 +85,10 @@ def main(args):
     """Read evaluation dataset, evaluate PII solution and save result"""
     # Load the test data
     data_path = os.path.join(args.raw_data, args.raw_file_name)
-    data = InputSample.read_dataset_json(data_path)
+    sidecar_prefix = (
+        os.path.join(args.tokenization_dir, args.raw_file_name) if args.tokenization_dir else None
+    )
+    data = read_dataset_stream(data_path, sidecar_prefix=sidecar_prefix)
 
     data_analysis(data, "PII_EDA")
 
@@ -1,8 +1,9 @@
 import pandas as pd
 import plotly.express as px
 from pathlib import Path
-from presidio_evaluator.evaluation import Evaluator
-from presidio_evaluator.evaluation import ModelError
+from typing import Optional
+from experiment_tracking.error_index import ErrorIndex
+from scoring.score_table import f_beta_scores
 
 
 class Plotter:
@@ -16,14 +17,18 @@ class Plotter:
     :param model_name: name of the model to be used in the plot title
     :param beta: a float with the beta parameter of the F measure,
     which gives more or less weight to precision vs. recall
+    :param error_index: ErrorIndex of the model errors, e.g. read from the error store,
+    None to index results.model_errors
     """
 
-    def __init__(self, model, results, output_folder: Path, model_name: str, beta: float):
+    def __init__(self, model, results, output_folder: Path, model_name: str, beta: float,
+                 error_index: Optional[ErrorIndex] = None):
         self.model = model
         self.results = results
         self.output_folder = output_folder
         self.model_name = model_name.replace("/", "-")
         self.errors = results.model_errors
+        self.error_index = error_index
         self.beta = beta
 
     def plot_scores(self) -> None:
@@ -36,8 +41,7 @@ class Plotter:
         scores['recall'] = list(self.results.entity_recall_dict.values())
         scores['precision'] = list(self.results.entity_precision_dict.values())
         scores['count'] = list(self.results.n_dict.values())
-        scores[f"f{self.beta}_score"] = [Evaluator.f_beta(precision=precision, recall=recall, beta=self.beta)
-                                for recall, precision in zip(scores['recall'], scores['precision'])]
+        scores[f"f{self.beta}_score"] = f_beta_scores(scores['precision'], scores['recall'], self.beta)
         df = pd.DataFrame(scores)
         df['model'] = self.model_name
         f2_score = self._plot(df, plot_type="f2_score")
@@ -71,29 +75,23 @@ class Plotter:
 
     def plot_most_common_tokens(self) -> None:
         """Graph most common false positive and false negative tokens for each entity."""
-        ModelError.most_common_fp_tokens(self.errors)
-        fps_frames = []
-        fns_frames = []
-        for entity in self.model.entity_mapping.values():
-            fps_df = ModelError.get_fps_dataframe(self.errors, entity=[entity])
-            if fps_df is not None:
-                fps_path = self.output_folder / \
-                    f"{self.model_name}-{entity}-fps.csv"
-                fps_df.to_csv(fps_path)
-                fps_frames.append(fps_path)
-            fns_df = ModelError.get_fns_dataframe(self.errors, entity=[entity])
-            if fns_df is not None:
-                fns_path = self.output_folder / \
-                    f"{self.model_name}-{entity}-fns.csv"
-                fns_df.to_csv(fns_path)
-                fns_frames.append(fns_path)
-
-        def group_tokens(df):
-            return df.groupby(['token', 'annotation']).size().to_frame(
-            ).sort_values([0], ascending=False).head(3).reset_index()
+        # a single pass over the errors for all the entities, instead of one per entity and error type
+        error_index = self.error_index if self.error_index is not None \
+            else ErrorIndex.from_model_errors(self.errors)
+        most_common = error_index.most_common_fp_tokens()
+        print("Most common false positive tokens:")
+        print([(token, count) for token, count, _ in most_common])
+        print("Example sentence with each FP token:")
+        for _, _, example in most_common:
+            print(example)
+        # several dataset entities map to the same model entity
+        entities = list(dict.fromkeys(self.model.entity_mapping.values()))
+        for entity, false_positives, errors_df in error_index.iter_errors_dataframes(entities):
+            suffix = "fps" if false_positives else "fns"
+            errors_df.to_csv(self.output_folder / f"{self.model_name}-{entity}-{suffix}.csv")
 
         def generate_graph(title, tokens_df):
-            fig = px.histogram(tokens_df, x=0, y="token", orientation='h', color='annotation',
+            fig = px.histogram(tokens_df, x="count", y="token", orientation='h', color='annotation',
                                 title=f"Most common {title} for {self.model_name}")
 
             fig.update_layout(yaxis_title=f"count", xaxis_title="PII Entity")
@@ -114,17 +112,12 @@ class Plotter:
             )
             fig.update_layout(yaxis={'categoryorder': 'total ascending'})
             # fig.show()
-        if len(fps_frames) > 0:
-            fps_tokens_df = pd.concat(
-                [group_tokens(pd.read_csv(df_path)) for df_path in fps_frames])
-            fps_plot = generate_graph(title="false-positives", tokens_df=fps_tokens_df)
-        else:
-            fps_plot = None
-        if len(fns_frames) > 0:
-            fns_tokens_df = pd.concat(
-                [group_tokens(pd.read_csv(df_path)) for df_path in fns_frames])
-            fns_plot = generate_graph(title="false-negatives", tokens_df=fns_tokens_df)
-        else:
-            fns_plot = None
+            return fig
+
+        fps_tokens_df = error_index.most_common_tokens(false_positives=True, entities=entities)
+        fns_tokens_df = error_index.most_common_tokens(false_positives=False, entities=entities)
+        fps_plot = generate_graph(title="false-positives", tokens_df=fps_tokens_df) \
+            if len(fps_tokens_df) > 0 else None
+        fns_plot = generate_graph(title="false-negatives", tokens_df=fns_tokens_df) \
+            if len(fns_tokens_df) > 0 else None
         return fns_plot, fps_plot
-    
\ No newline at end of file
@@ -0,0 +1,148 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+
+import json
+import hashlib
+import logging
+import sqlite3
+from importlib import metadata
+from pathlib import Path
+from typing import List, Optional
+
+from presidio_evaluator import InputSample
+from presidio_evaluator.models import PresidioAnalyzerWrapper
+
+# Configuration keys which do not change the predictions of a model, and are left out of the cache key.
+# DATASET_TO_PRESIDIO_MAPPING only translates the annotated tags of the dataset.
+CONFIG_KEYS_NOT_IN_CACHE_KEY = ("DATASET_TO_PRESIDIO_MAPPING", "DEFAULT_EXPLANATION")
+# Version of the cached predictions, part of the cache key.
+# Bump it when a change of the wrappers or of the tags they predict makes the cached predictions stale
+PREDICTION_CACHE_VERSION = 1
+
+
+class PredictionCache:
+    def __init__(self, cache_dir: str, model_key: dict):
+        """`PredictionCache` stores the predicted tags of a model on disk, so a sample is predicted only once
+            for a given model, whatever the entity mapping or the beta value used to score it.
+            Each model key has its own SQLite file in `cache_dir`, where predictions are keyed by the sha256 of the
+            sample's full text. SQLite handles concurrent access, so the cache can be shared by sharded workers.
+
+        Args:
+            cache_dir (str): Directory storing the cache files
+            model_key (dict): JSON serializable identity of the model, see `get_model_key`
+        """
+        key_str = json.dumps(model_key, sort_keys=True)
+        self.model_hash = hashlib.sha256(key_str.encode("utf-8")).hexdigest()[:16]
+        self.dir = Path(cache_dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        # human readable description of the cached model
+        key_path = Path(self.dir, f"{self.model_hash}.json")
+        if not key_path.exists():
+            key_path.write_text(key_str)
+
+        self.connection = sqlite3.connect(
+            Path(self.dir, f"{self.model_hash}.sqlite"), timeout=60, isolation_level=None
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS predictions (text_hash TEXT PRIMARY KEY, tags TEXT)"
+        )
+        logging.info(f"Using prediction cache {key_path}")
+
+    @staticmethod
+    def get_nlp_model(wrapper: PresidioAnalyzerWrapper) -> str:
+        """Name and version of the spaCy model of the analyzer's NLP engine, e.g. en_core_web_lg-3.7.1,
+        the class name of the NLP engine if it has no spaCy model"""
+        nlp_engine = wrapper.analyzer_engine.nlp_engine
+        try:
+            nlp = nlp_engine.get_nlp(wrapper.language)
+        except (AttributeError, ValueError, KeyError):
+            return type(nlp_engine).__name__
+        return f"{nlp.meta['lang']}_{nlp.meta['name']}-{nlp.meta['version']}"
+
+    @staticmethod
+    def get_model_key(model_config: Optional[dict], wrapper: PresidioAnalyzerWrapper) -> dict:
+        """Identity of a model: the recognizer configuration (model path included), the spaCy model of the
+        NLP pass, the labeling scheme of the predicted tags, the analyzer settings, and the versions of the code
+        computing the predictions (PREDICTION_CACHE_VERSION and the get_prediction_key of the recognizers)
+
+        Args:
+            model_config (Optional[dict]): model configuration dictionary from _ner_model_config, None for Presidio
+            wrapper (PresidioAnalyzerWrapper): wrapper of the analyzer making the predictions
+        """
+        model_config = model_config if model_config else {}
+        return {
+            "model_config": {
+                key: value for key, value in model_config.items()
+                if key not in CONFIG_KEYS_NOT_IN_CACHE_KEY
+            },
+            "entities": sorted(wrapper.entities) if wrapper.entities else None,
+            "score_threshold": wrapper.score_threshold,
+            "language": wrapper.language,
+            "labeling_scheme": wrapper.labeling_scheme,
+            "nlp_model": PredictionCache.get_nlp_model(wrapper),
+            "presidio_analyzer": metadata.version("presidio_analyzer"),
+            "cache_version": PREDICTION_CACHE_VERSION,
+            "recognizers": {
+                recognizer.name: recognizer.get_prediction_key()
+                for recognizer in wrapper.analyzer_engine.registry.recognizers
+                if hasattr(recognizer, "get_prediction_key")
+            },
+        }
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get(self, text: str) -> Optional[List[str]]:
+        """Return the cached tags predicted for text, None if text was never predicted"""
+        row = self.connection.execute(
+            "SELECT tags FROM predictions WHERE text_hash = ?", (self.hash_text(text),)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, text: str, tags: List[str]):
+        """Store the tags predicted for text"""
+        self.connection.execute(
+            "INSERT OR REPLACE INTO predictions (text_hash, tags) VALUES (?, ?)",
+            (self.hash_text(text), json.dumps(tags)),
+        )
+
+    def __contains__(self, text: str) -> bool:
+        return self.connection.execute(
+            "SELECT 1 FROM predictions WHERE text_hash = ?", (self.hash_text(text),)
+        ).fetchone() is not None
+
+
+class CachedPresidioAnalyzerWrapper(PresidioAnalyzerWrapper):
+    def __init__(self, prediction_cache_dir: str, model_config: Optional[dict] = None, **kwargs):
+        """`PresidioAnalyzerWrapper` serving predictions from a `PredictionCache`.
+            The analyzer engine (NLP pass and recognizers) only runs on samples missing from the cache.
+
+        Args:
+            prediction_cache_dir (str): Directory storing the cache files
+            model_config (Optional[dict]): model configuration dictionary from _ner_model_config, None for Presidio
+            kwargs: PresidioAnalyzerWrapper arguments
+        """
+        super().__init__(**kwargs)
+        self.prediction_cache = PredictionCache(
+            prediction_cache_dir, PredictionCache.get_model_key(model_config, self)
+        )
+        self.cache_hits = 0
+
+    def is_cached(self, sample: InputSample) -> bool:
+        return sample.full_text in self.prediction_cache
+
+    def predict(self, sample: InputSample) -> List[str]:
+        tags = self.prediction_cache.get(sample.full_text)
+        # tags are aligned with the sample's tokens, a different tokenization invalidates the cached value
+        if tags is not None and len(tags) == len(sample.tokens):
+            self.cache_hits += 1
+            return tags
+
+        tags = super().predict(sample)
+        self.prediction_cache.put(sample.full_text, tags)
+        return tags
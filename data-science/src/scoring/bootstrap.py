@@ -0,0 +1,247 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+
+import math
+import warnings
+import multiprocessing
+from pathlib import Path
+from typing import List, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from presidio_evaluator.evaluation import EvaluationResult
+
+from scoring.score_table import OUTSIDE_LABEL, encode_pairs, precision_recall_f
+
+# Name of the PII detection row of the count vectors (any entity counts as PII)
+PII_ROW = "pii"
+# Weights of each task are (resamples, samples) arrays, bounded to keep the tasks small
+MAX_WEIGHTS_PER_TASK = 10_000_000
+MAX_RESAMPLES_PER_TASK = 100
+
+# Per-process state of the bootstrap workers, set by _init_bootstrap_worker
+_worker_state = {}
+
+
+def sample_count_vectors(
+    evaluation_results: List[EvaluationResult], entities: Sequence[str]
+) -> np.ndarray:
+    """
+    True positive, annotated and predicted token counts of each sample, per entity
+    :param evaluation_results: EvaluationResult of each sample
+    :param entities: entities to count, e.g. ScoreTable.entities
+    :return: (n_samples, len(entities) + 1, 3) array, the last row of each sample counts the PII detection
+    hits (any entity predicted on a PII token) instead of the true positives
+    """
+    labels, pairs = encode_pairs(evaluation_results)
+    sample_index, gold, predicted, count = pairs.T
+    entity_rows = {entity: row for row, entity in enumerate(entities)}
+    # row of each label: its entity, the PII row for the other PII labels, -1 for the outside label
+    rows = np.array(
+        [-1 if label == OUTSIDE_LABEL else entity_rows.get(label, len(entities)) for label in labels],
+        dtype=np.int64,
+    )
+    n_rows = len(entities) + 1
+    counts = np.zeros((len(evaluation_results), n_rows, 3), dtype=np.int64)
+    gold_rows, predicted_rows = rows[gold], rows[predicted]
+    is_entity_gold = (gold_rows >= 0) & (gold_rows < len(entities))
+    is_entity_predicted = (predicted_rows >= 0) & (predicted_rows < len(entities))
+    for column, mask, label_rows in (
+        (0, is_entity_gold & (gold == predicted), gold_rows),
+        (1, is_entity_gold, gold_rows),
+        (2, is_entity_predicted, predicted_rows),
+    ):
+        np.add.at(counts[:, :, column], (sample_index[mask], label_rows[mask]), count[mask])
+    # PII detection counts of every sample
+    is_pii_gold, is_pii_predicted = gold_rows >= 0, predicted_rows >= 0
+    for column, mask in ((0, is_pii_gold & is_pii_predicted), (1, is_pii_gold), (2, is_pii_predicted)):
+        counts[:, -1, column] = np.bincount(
+            sample_index[mask], weights=count[mask], minlength=len(evaluation_results)
+        )
+    return counts
+
+
+def save_sample_counts(path: Union[Path, str], entities: Sequence[str], counts: np.ndarray, beta: float):
+    """Save the count vectors of sample_count_vectors with their entities and the beta of the experiment"""
+    np.savez_compressed(path, entities=np.array(list(entities)), counts=counts, beta=beta)
+
+
+def load_sample_counts(path: Union[Path, str]) -> Tuple[List[str], np.ndarray, float]:
+    """Entities, count vectors and beta saved by save_sample_counts"""
+    with np.load(path) as data:
+        return data["entities"].tolist(), data["counts"], float(data["beta"])
+
+
+def _init_bootstrap_worker(counts: List[np.ndarray]):
+    _worker_state["counts"] = counts
+
+
+def _resample_sums(task: Tuple[int, np.random.SeedSequence]) -> List[np.ndarray]:
+    """Summed count vectors of n_resamples resamples of the samples, the same resamples for each model"""
+    n_resamples, seed = task
+    counts = _worker_state["counts"]
+    n_samples = len(counts[0])
+    rng = np.random.default_rng(seed)
+    # number of times each sample is drawn in each resample
+    draws = rng.integers(0, n_samples, size=(n_resamples, n_samples))
+    draws += np.arange(n_resamples)[:, None] * n_samples
+    weights = np.bincount(draws.ravel(), minlength=n_resamples * n_samples).reshape(
+        n_resamples, n_samples
+    )
+    # float products are exact for token counts, and much faster than integer ones
+    weights = weights.astype(np.float64)
+    return [
+        (weights @ model_counts.reshape(n_samples, -1).astype(np.float64)).reshape(
+            n_resamples, *model_counts.shape[1:]
+        )
+        for model_counts in counts
+    ]
+
+
+def bootstrap_sums(
+    counts: List[np.ndarray], n_resamples: int, workers: int = 1, seed: int = 0
+) -> List[np.ndarray]:
+    """
+    Resample the samples with replacement and sum their count vectors.
+    Resamples are split in tasks of fixed size, so the results only depend on the seed, not on workers
+    :param counts: count vectors of each model, on the same samples (see sample_count_vectors)
+    :param n_resamples: number of resamples
+    :param workers: number of processes sharing the tasks, 1 to run them in this process.
+    Worker processes are spawned, since forking a process running other threads (torch, dataset readers) can deadlock
+    :param seed: seed of the resamples
+    :return: (n_resamples, n_rows, 3) summed counts of each model
+    """
+    n_samples = len(counts[0])
+    if any(len(model_counts) != n_samples for model_counts in counts):
+        raise ValueError("Paired bootstrap requires the count vectors of the same samples")
+    task_size = max(1, min(MAX_RESAMPLES_PER_TASK, MAX_WEIGHTS_PER_TASK // max(n_samples, 1)))
+    n_tasks = math.ceil(n_resamples / task_size)
+    tasks = [
+        (min(task_size, n_resamples - i * task_size), task_seed)
+        for i, task_seed in enumerate(np.random.SeedSequence(seed).spawn(n_tasks))
+    ]
+    if workers > 1 and n_tasks > 1:
+        with multiprocessing.get_context("spawn").Pool(
+            processes=min(workers, n_tasks), initializer=_init_bootstrap_worker, initargs=(counts,)
+        ) as pool:
+            task_sums = pool.map(_resample_sums, tasks)
+    else:
+        _init_bootstrap_worker(counts)
+        task_sums = [_resample_sums(task) for task in tasks]
+        _worker_state.clear()
+    return [np.concatenate(model_sums) for model_sums in zip(*task_sums)]
+
+
+def _scores(counts: np.ndarray, beta: float) -> dict:
+    """Precision, recall and F-beta of summed count vectors, by metric name"""
+    precision, recall, f_beta = precision_recall_f(counts[..., 0], counts[..., 1], counts[..., 2], beta)
+    return {"precision": precision, "recall": recall, f"f{beta:g}_score": f_beta}
+
+
+def _percentiles(resampled: np.ndarray, confidence: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Percentile interval of each column, NaN for the columns which are never defined"""
+    alpha = (1 - confidence) / 2
+    with warnings.catch_warnings():
+        # all-NaN columns, e.g. an entity which is never predicted
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return tuple(np.nanpercentile(resampled, [100 * alpha, 100 * (1 - alpha)], axis=0))
+
+
+def bootstrap_intervals(
+    counts: np.ndarray,
+    entities: Sequence[str],
+    beta: float,
+    n_resamples: int = 1000,
+    confidence: float = 0.95,
+    workers: int = 1,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Bootstrap confidence intervals of the precision, recall and F-beta of each entity and of the PII detection
+    :param counts: count vectors of the samples, see sample_count_vectors
+    :param entities: entities of the count vectors
+    :param beta: beta parameter of the F measure
+    :param n_resamples: number of resamples
+    :param confidence: confidence level of the intervals
+    :param workers: number of processes computing the resamples
+    :param seed: seed of the resamples
+    :return: DataFrame with the entity, metric, score, low and high columns
+    """
+    (resampled,) = bootstrap_sums([counts], n_resamples, workers, seed)
+    scores = _scores(counts.sum(axis=0), beta)
+    resampled_scores = _scores(resampled, beta)
+    rows = []
+    for metric, score in scores.items():
+        low, high = _percentiles(resampled_scores[metric], confidence)
+        rows.append(
+            pd.DataFrame(
+                {
+                    "entity": [*entities, PII_ROW],
+                    "metric": metric,
+                    "score": score,
+                    "low": low,
+                    "high": high,
+                }
+            )
+        )
+    return pd.concat(rows, ignore_index=True)
+
+
+def paired_bootstrap_test(
+    counts_a: np.ndarray,
+    entities_a: Sequence[str],
+    counts_b: np.ndarray,
+    entities_b: Sequence[str],
+    beta: float,
+    n_resamples: int = 1000,
+    confidence: float = 0.95,
+    workers: int = 1,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Paired bootstrap test of the score differences between two models evaluated on the same samples:
+    both models are scored on the same resamples, on the entities they share and the PII detection
+    :param counts_a: count vectors of the first model, see sample_count_vectors
+    :param entities_a: entities of counts_a
+    :param counts_b: count vectors of the second model
+    :param entities_b: entities of counts_b
+    :param beta: beta parameter of the F measure
+    :param n_resamples: number of resamples
+    :param confidence: confidence level of the difference intervals
+    :param workers: number of processes computing the resamples
+    :param seed: seed of the resamples
+    :return: DataFrame with the entity, metric, difference (first model minus second model), low, high
+    and p_value (two-sided) columns
+    """
+    entities = [entity for entity in entities_a if entity in entities_b]
+    rows_a = [entities_a.index(entity) for entity in entities] + [len(entities_a)]
+    rows_b = [entities_b.index(entity) for entity in entities] + [len(entities_b)]
+    counts_a, counts_b = counts_a[:, rows_a], counts_b[:, rows_b]
+    resampled_a, resampled_b = bootstrap_sums([counts_a, counts_b], n_resamples, workers, seed)
+    scores_a, scores_b = _scores(counts_a.sum(axis=0), beta), _scores(counts_b.sum(axis=0), beta)
+    resampled_scores_a, resampled_scores_b = _scores(resampled_a, beta), _scores(resampled_b, beta)
+    rows = []
+    for metric in scores_a:
+        differences = resampled_scores_a[metric] - resampled_scores_b[metric]
+        low, high = _percentiles(differences, confidence)
+        n_defined = np.sum(~np.isnan(differences), axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # share of the resamples on each side of 0, doubled for a two-sided test
+            p_value = 2 * np.minimum(
+                np.sum(differences <= 0, axis=0), np.sum(differences >= 0, axis=0)
+            ) / n_defined
+        rows.append(
+            pd.DataFrame(
+                {
+                    "entity": [*entities, PII_ROW],
+                    "metric": metric,
+                    "difference": scores_a[metric] - scores_b[metric],
+                    "low": low,
+                    "high": high,
+                    "p_value": np.minimum(p_value, 1),
+                }
+            )
+        )
+    return pd.concat(rows, ignore_index=True)
@@ -0,0 +1,222 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+
+
+from collections import Counter
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from presidio_evaluator.evaluation import EvaluationResult, ModelError
+
+OUTSIDE_LABEL = "O"
+# F-beta scores of every experiment, reported along the beta of the run
+REPORTED_BETAS = (0.5, 1, 2)
+
+
+def f_beta_scores(precision: np.ndarray, recall: np.ndarray, beta: float) -> np.ndarray:
+    """Vectorized Evaluator.f_beta: NaN where precision or recall is NaN, or both are 0"""
+    precision = np.asarray(precision, dtype=float)
+    recall = np.asarray(recall, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # same operations as Evaluator.f_beta, so the scores are identical
+        f_beta = ((1 + beta**2) * precision * recall) / (((beta**2) * precision) + recall)
+    return np.where((precision == 0) & (recall == 0), np.nan, f_beta)
+
+
+def confusion_matrix(
+    gold: np.ndarray, predicted: np.ndarray, n_labels: int, counts: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Confusion matrix of integer encoded tags, in a single bincount
+    :param gold: label index of each annotated token (or of each (annotation, prediction) pair)
+    :param predicted: label index of each predicted token, same shape as gold
+    :param n_labels: number of labels
+    :param counts: number of tokens of each (gold, predicted) pair, None to count each pair once
+    :return: (n_labels, n_labels) matrix of token counts, rows are annotations and columns predictions
+    """
+    pair_index = np.asarray(gold, dtype=np.int64) * n_labels + np.asarray(predicted, dtype=np.int64)
+    matrix = np.bincount(pair_index, weights=counts, minlength=n_labels * n_labels)
+    return matrix.astype(np.int64).reshape(n_labels, n_labels)
+
+
+def encode_pairs(evaluation_results: Iterable[EvaluationResult]) -> Tuple[List[str], np.ndarray]:
+    """
+    Integer encoding of the results counters of the evaluated samples
+    :param evaluation_results: EvaluationResult of each sample, as returned by Evaluator.evaluate_sample
+    :return: labels sorted by name, and a (n_pairs, 4) array of
+    (sample index, annotation label index, predicted label index, count) rows
+    """
+    label_ids = {}
+    pairs = [
+        (
+            sample_index,
+            label_ids.setdefault(annotation, len(label_ids)),
+            label_ids.setdefault(predicted, len(label_ids)),
+            count,
+        )
+        for sample_index, evaluation_result in enumerate(evaluation_results)
+        for (annotation, predicted), count in evaluation_result.results.items()
+    ]
+    pairs = np.array(pairs, dtype=np.int64).reshape(-1, 4)
+    labels = sorted(label_ids)
+    # label indices in sorted order
+    sorted_ids = np.empty(len(labels), dtype=np.int64)
+    sorted_ids[[label_ids[label] for label in labels]] = np.arange(len(labels))
+    pairs[:, 1:3] = sorted_ids[pairs[:, 1:3]]
+    return labels, pairs
+
+
+def encode_results(evaluation_results: Iterable[EvaluationResult]) -> Tuple[List[str], np.ndarray]:
+    """
+    Labels and confusion matrix of the results counters of the evaluated samples
+    :param evaluation_results: EvaluationResult of each sample, as returned by Evaluator.evaluate_sample
+    :return: labels sorted by name, and their confusion matrix
+    """
+    labels, pairs = encode_pairs(evaluation_results)
+    return labels, confusion_matrix(pairs[:, 1], pairs[:, 2], len(labels), pairs[:, 3])
+
+
+def precision_recall_f(
+    true_positives: np.ndarray, annotated: np.ndarray, predicted: np.ndarray, beta: float
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Precision, recall and F-beta of token counts of any shape, NaN where they are undefined"""
+    precision = _ratio(true_positives, predicted)
+    recall = _ratio(true_positives, annotated)
+    return precision, recall, f_beta_scores(precision, recall, beta)
+
+
+class ScoreTable:
+    def __init__(self, labels: List[str], matrix: np.ndarray, betas: Sequence[float] = REPORTED_BETAS):
+        """`ScoreTable` computes the scores of Evaluator.calculate_score from a confusion matrix in one vectorized
+            pass: per-entity precision, recall and F-beta for several betas, the PII detection scores
+            (any entity counts as PII), and the micro and macro averages over the entities.
+            Entities are the labels found in the annotations, as in Evaluator.calculate_score.
+
+        Args:
+            labels (List[str]): Name of each row and column of matrix, including the outside label "O"
+            matrix (np.ndarray): Token counts, rows are annotations and columns predictions
+            betas (Sequence[float]): Beta parameters of the F measures
+        """
+        self.labels = labels
+        self.matrix = matrix
+        self.betas = list(dict.fromkeys(betas))
+        annotated = matrix.sum(axis=1)
+        predicted = matrix.sum(axis=0)
+        true_positives = np.diag(matrix)
+        is_pii = np.array([label != OUTSIDE_LABEL for label in labels], dtype=bool)
+        is_entity = is_pii & (annotated > 0)
+
+        self.entities = [label for label, keep in zip(labels, is_entity) if keep]
+        self.n = annotated[is_entity]
+        self.recall = _ratio(true_positives[is_entity], self.n)
+        self.precision = _ratio(true_positives[is_entity], predicted[is_entity])
+        self.f_beta = {
+            beta: f_beta_scores(self.precision, self.recall, beta) for beta in self.betas
+        }
+
+        # any PII entity predicted on a PII token is a hit
+        pii_hits = matrix[np.ix_(is_pii, is_pii)].sum()
+        self.pii_recall = float(_ratio(pii_hits, annotated[is_pii].sum()))
+        self.pii_precision = float(_ratio(pii_hits, predicted[is_pii].sum()))
+        self.micro_recall = float(_ratio(true_positives[is_entity].sum(), self.n.sum()))
+        self.micro_precision = float(_ratio(true_positives[is_entity].sum(), predicted[is_entity].sum()))
+
+    def pii_f_beta(self, beta: float) -> float:
+        return float(f_beta_scores(self.pii_precision, self.pii_recall, beta))
+
+    def to_evaluation_result(
+        self, beta: float, model_errors: Optional[List[ModelError]] = None
+    ) -> EvaluationResult:
+        """Same EvaluationResult as Evaluator.calculate_score with this beta"""
+        nonzero = np.nonzero(self.matrix)
+        results = Counter(
+            {
+                (self.labels[i], self.labels[j]): count
+                for i, j, count in zip(*nonzero, self.matrix[nonzero].tolist())
+            }
+        )
+        n_dict = dict(zip(self.entities, self.n.tolist()))
+        return EvaluationResult(
+            results=results,
+            model_errors=model_errors,
+            pii_precision=self.pii_precision,
+            pii_recall=self.pii_recall,
+            entity_recall_dict=dict(zip(self.entities, self.recall.tolist())),
+            entity_precision_dict=dict(zip(self.entities, self.precision.tolist())),
+            n_dict=n_dict,
+            pii_f=self.pii_f_beta(beta),
+            n=sum(n_dict.values()),
+        )
+
+    def to_confusion_matrix(self) -> Tuple[List[str], List[List[int]]]:
+        """Same as EvaluationResult.to_confusion_matrix: the entities and "O", sorted"""
+        entities = sorted(set(self.entities) | {OUTSIDE_LABEL})
+        label_ids = {label: i for i, label in enumerate(self.labels)}
+        # padded with a zero row and column for an "O" label missing from the results
+        padded = np.pad(self.matrix, ((0, 1), (0, 1)))
+        order = [label_ids.get(label, len(self.labels)) for label in entities]
+        return entities, padded[np.ix_(order, order)].tolist()
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Scores of each entity, followed by the micro, macro and PII rows"""
+        f_columns = {f"f{beta:g}_score": scores for beta, scores in self.f_beta.items()}
+        df = pd.DataFrame(
+            {
+                "entity": self.entities,
+                "count": self.n,
+                "precision": self.precision,
+                "recall": self.recall,
+                **f_columns,
+            }
+        )
+        aggregates = pd.DataFrame(
+            {
+                "entity": ["micro", "macro", "pii"],
+                "count": [self.n.sum()] * 3,
+                "precision": [self.micro_precision, _nanmean(self.precision), self.pii_precision],
+                "recall": [self.micro_recall, _nanmean(self.recall), self.pii_recall],
+                **{
+                    f"f{beta:g}_score": [
+                        float(f_beta_scores(self.micro_precision, self.micro_recall, beta)),
+                        _nanmean(self.f_beta[beta]),
+                        self.pii_f_beta(beta),
+                    ]
+                    for beta in self.betas
+                },
+            }
+        )
+        return pd.concat([df, aggregates], ignore_index=True)
+
+
+def score_results(
+    evaluation_results: List[EvaluationResult], betas: Sequence[float] = REPORTED_BETAS
+) -> ScoreTable:
+    """
+    Vectorized Evaluator.calculate_score for several betas at once.
+    Only the results counters are scored, the model errors are read from the error store (see ErrorIndex)
+    :param evaluation_results: EvaluationResult of each sample
+    :param betas: beta parameters of the F measures
+    :return: ScoreTable of the results
+    """
+    labels, matrix = encode_results(evaluation_results)
+    return ScoreTable(labels, matrix, betas)
+
+
+def _ratio(numerator, denominator) -> np.ndarray:
+    """numerator / denominator, NaN where denominator is 0"""
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    return np.divide(
+        numerator,
+        denominator,
+        out=np.full(np.broadcast(numerator, denominator).shape, np.nan),
+        where=denominator > 0,
+    )
+
+
+def _nanmean(values: np.ndarray) -> float:
+    """Mean of the values which are not NaN, NaN if there are none"""
+    values = values[~np.isnan(values)]
+    return float(values.mean()) if len(values) else np.nan
@@ -0,0 +1,73 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""
+Run spaCy once on a dataset and save the tokenization sidecars reused by evaluate.py and pii_EDA.py
+"""
+
+import os
+import argparse
+import logging
+from pathlib import Path
+
+from presidio_analyzer import AnalyzerEngine
+
+from dataset_io.dataset_reader import iter_dataset_records
+from dataset_io.tokenization_sidecar import write_nlp_docs_sidecar, write_sample_tokens_sidecar
+
+logging.basicConfig(level=logging.INFO)
+
+
+def parse_args():
+    """Parse input arguments"""
+
+    parser = argparse.ArgumentParser("tokenize_dataset")
+    parser.add_argument("--raw-data", type=str, help="Path of raw data folder")
+    parser.add_argument("--raw-file-name", type=str, help="Name of raw data file")
+    parser.add_argument(
+        "--output-path", type=str, help="Directory of the sidecars, passed as --tokenization-dir to the other steps"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=64, help="Number of texts per spaCy batch"
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    """Save the tokens and tags of the samples, and the NLP pass of the default Presidio analyzer"""
+    data_path = os.path.join(args.raw_data, args.raw_file_name)
+    Path(args.output_path).mkdir(parents=True, exist_ok=True)
+    sidecar_prefix = os.path.join(args.output_path, args.raw_file_name)
+
+    # Tokens and tags of InputSample.from_json
+    write_sample_tokens_sidecar(
+        iter_dataset_records(data_path), sidecar_prefix, batch_size=args.batch_size
+    )
+    # NLP pass of the analyzers, which all use the default NLP engine
+    nlp = AnalyzerEngine().nlp_engine.get_nlp("en")
+    write_nlp_docs_sidecar(
+        (record["full_text"] for record in iter_dataset_records(data_path)),
+        sidecar_prefix,
+        nlp,
+        batch_size=args.batch_size,
+    )
+
+
+if __name__ == "__main__":
+
+    # ---------- Parse Arguments ----------- #
+    # -------------------------------------- #
+
+    args = parse_args()
+
+    lines = [
+        f"Raw data: {args.raw_data}",
+        f"Raw file name: {args.raw_file_name}",
+        f"Output path: {args.output_path}",
+    ]
+
+    for line in lines:
+        logging.info(line)
+
+    main(args)